@@ -0,0 +1,165 @@
+"""Benchmark the cost of a cache hit.
+
+Compares the different eviction policies and time constraints of
+:func:`tlru_cache.tlru_cache` against :func:`functools.lru_cache`, both
+for a single thread and for several threads hitting the same cache.
+
+With ``--baseline``, every mode is also run with the implementation of
+another git revision, e.g. a release, side by side with the working
+tree. Modes that the baseline does not support are left out.
+
+Run from the repository root::
+
+    python benchmarks/hit_path.py [--baseline REV]
+
+"""
+
+import argparse
+import functools
+import importlib.util
+import io
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import timeit
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, '.')
+
+# pylint: disable=import-error,wrong-import-position
+import tlru_cache as tlru  # noqa: E402
+
+NUMBER = 200_000
+REPEAT = 5
+THREADS = 4
+
+# Arguments of tlru_cache() for every benchmarked mode
+MODES: Dict[str, Tuple[Tuple[Any, ...], Dict[str, Any]]] = {
+    'lru, untimed': ((128, None), {}),
+    'lru, timed': ((128, 60.0), {}),
+    'clock, untimed': ((128, None), {'policy': 'clock'}),
+    'clock, timed': ((128, 60.0), {'policy': 'clock'}),
+    'unbounded, timed': ((None, 60.0), {}),
+}
+
+
+def _identity(value: int) -> int:
+    return value
+
+
+def _load_baseline(revision: str, directory: str) -> ModuleType:
+    """Import the package as of a git revision under another name."""
+    archive = subprocess.run(
+        ['git', 'archive', '--format=tar', revision, 'tlru_cache'],
+        check=True, stdout=subprocess.PIPE).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    package = f'{directory}/tlru_cache'
+    spec = importlib.util.spec_from_file_location(
+        'tlru_cache_baseline', f'{package}/__init__.py',
+        submodule_search_locations=[package])
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _candidates(baseline: Optional[ModuleType]
+                ) -> Dict[str, List[Optional[Callable[[int], Any]]]]:
+    """Return the current and baseline cache of every mode."""
+    candidates: Dict[str, List[Optional[Callable[[int], Any]]]] = {
+        'functools.lru_cache': [functools.lru_cache(128)(_identity), None]}
+    for name, (args, kwargs) in MODES.items():
+        funcs: List[Optional[Callable[[int], Any]]] = [
+            tlru.tlru_cache(*args, **kwargs)(_identity), None]
+        if baseline is not None:
+            try:
+                funcs[1] = baseline.tlru_cache(*args, **kwargs)(_identity)
+            except TypeError:
+                pass  # Not supported by the baseline
+        candidates[name] = funcs
+    return candidates
+
+
+def single_thread(funcs: List[Optional[Callable[[int], Any]]]
+                  ) -> List[Optional[float]]:
+    """Return the time per hit in nanoseconds of every function.
+
+    The functions take turns, so that they are affected by changes of
+    the load of the machine alike.
+
+    """
+    best: List[Optional[float]] = [None] * len(funcs)
+    for func in funcs:
+        if func is not None:
+            func(1)
+    for _ in range(REPEAT):
+        for i, func in enumerate(funcs):
+            if func is None:
+                continue
+            elapsed = timeit.timeit(lambda: func(1),  # type: ignore
+                                    number=NUMBER) / NUMBER * 1e9
+            previous = best[i]
+            best[i] = elapsed if previous is None else min(previous,
+                                                           elapsed)
+    return best
+
+
+def multi_thread(func: Optional[Callable[[int], Any]]) -> Optional[float]:
+    """Return the time per hit in nanoseconds with concurrent callers."""
+    if func is None:
+        return None
+    func(1)
+    barrier = threading.Barrier(THREADS + 1)
+
+    def target() -> None:
+        barrier.wait()
+        for _ in range(NUMBER):
+            func(1)  # type: ignore
+
+    threads = [threading.Thread(target=target) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - start) / (NUMBER * THREADS) * 1e9
+
+
+def _format(value: Optional[float]) -> str:
+    return f'{"-":>12}' if value is None else f'{value:>9.0f} ns'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--baseline', metavar='REV',
+                        help='git revision to compare against')
+    options = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = (None if options.baseline is None
+                    else _load_baseline(options.baseline, directory))
+        header = f'{"cache":<22}{"1 thread":>12}'
+        if baseline is not None:
+            header += f'{"baseline":>12}'
+        header += f'{f"{THREADS} threads":>12}'
+        if baseline is not None:
+            header += f'{"baseline":>12}'
+        print(header)
+        for name, funcs in _candidates(baseline).items():
+            if baseline is None:
+                funcs = funcs[:1]
+            single = single_thread(funcs)
+            multi = [multi_thread(func) for func in funcs]
+            print(f'{name:<22}' + ''.join(_format(value)
+                                          for value in single)
+                  + ''.join(_format(value) for value in multi))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark the cost of converting call arguments into cache keys.
+
+Compares the generic :func:`tlru_cache._make_key` with the keys built
+from the signature of the cached function, both for key construction
+alone and for a complete cache hit.
+
+Run from the repository root::
+
+    python benchmarks/make_key.py
+
+"""
+
+import sys
+import timeit
+from typing import Any, Callable, Dict, Tuple
+
+sys.path.insert(0, '.')
+
+# pylint: disable=import-error,wrong-import-position
+from tlru_cache import (  # noqa: E402
+    _make_key,
+    _make_key_builder,
+    tlru_cache
+)
+
+NUMBER = 200_000
+REPEAT = 5
+
+
+def _one(a: int) -> int:
+    return a
+
+
+def _two(a: int, b: int) -> int:
+    return a + b
+
+
+def _three(a: int, b: int, c: int = 3) -> int:
+    return a + b + c
+
+
+def _variadic(*args: int, **kwargs: int) -> int:
+    return sum(args) + sum(kwargs.values())
+
+
+_Call = Tuple[Callable[..., int], Tuple[Any, ...], Dict[str, Any]]
+
+# Function and arguments of every benchmarked call
+CALLS: Dict[str, _Call] = {
+    'f(1)': (_one, (1,), {}),
+    'f("key")': (_one, ('key',), {}),
+    'f(1, 2)': (_two, (1, 2), {}),
+    'f(1, b=2)': (_two, (1,), {'b': 2}),
+    'f(1, 2, c=3)': (_three, (1, 2), {'c': 3}),
+    # c is left at its default
+    'f(1, 2) [c]': (_three, (1, 2), {}),
+    'f(1, 2, x=3)': (_variadic, (1, 2), {'x': 3}),
+}
+
+
+def _time(func: Callable[[], Any]) -> float:
+    """Return the time per call in nanoseconds."""
+    best = min(timeit.repeat(func, number=NUMBER, repeat=REPEAT))
+    return best / NUMBER * 1e9
+
+
+def main() -> None:
+    print(f'{"call":<16}{"_make_key":>12}{"builder":>12}{"cache hit":>12}')
+    for name, (function, args, kwargs) in CALLS.items():
+        make_key = _make_key_builder(function, False)
+        cached = tlru_cache(128, 60.0)(function)
+        cached(*args, **kwargs)
+        generic = _time(lambda: _make_key(args, kwargs, False))
+        built = _time(lambda: make_key(args, kwargs))
+        hit = _time(lambda: cached(*args, **kwargs))
+        print(f'{name:<16}{generic:>9.0f} ns{built:>9.0f} ns{hit:>9.0f} ns')
+
+
+if __name__ == '__main__':
+    main()
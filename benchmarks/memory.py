@@ -0,0 +1,72 @@
+"""Benchmark the memory used per cache entry.
+
+Fills caches of different configurations with small integer results
+and reports the memory allocated per million entries, not counting the
+keys and results themselves, next to :func:`functools.lru_cache`.
+Memory is traced with :mod:`tracemalloc`, which is slow, so only
+100,000 entries are cached by default and the result is scaled up.
+
+Run from the repository root::
+
+    python benchmarks/memory.py [entries]
+
+"""
+
+import functools
+import gc
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, '.')
+
+# pylint: disable=import-error,wrong-import-position
+from tlru_cache import tlru_cache  # noqa: E402
+
+ENTRIES = 100_000
+
+
+def _identity(value: int) -> int:
+    return value
+
+
+def _candidates() -> Dict[str, Callable[[Callable[[int], int]], Any]]:
+    return {
+        'functools.lru_cache': functools.lru_cache(None),
+        'unbounded, untimed': tlru_cache(None, None),
+        'unbounded, timed': tlru_cache(None, 3600.0),
+        'lru, untimed': tlru_cache(ENTRIES, None),
+        'lru, timed': tlru_cache(ENTRIES, 3600.0),
+        'clock, timed': tlru_cache(ENTRIES, 3600.0, policy='clock'),
+        'lru, variable': tlru_cache(
+            ENTRIES, lambda args, kwargs, result: 3600.0),
+    }
+
+
+def measure(decorator: Callable[[Callable[[int], int]], Any],
+            keys: 'list[int]') -> float:
+    """Return the memory allocated per million entries in megabytes."""
+    gc.collect()
+    tracemalloc.start()
+    func = decorator(_identity)
+    for key in keys:
+        func(key)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert func.cache_info().currsize == len(keys)
+    return size / len(keys) * 1e6 / 2**20
+
+
+def main() -> None:
+    global ENTRIES  # pylint: disable=global-statement
+    if len(sys.argv) > 1:
+        ENTRIES = int(sys.argv[1])
+    # Keys and results are allocated up front, so they are not measured
+    keys = list(range(1 << 30, (1 << 30) + ENTRIES))
+    print(f'{"cache":<22}{"MB per million entries":>24}')
+    for name, decorator in _candidates().items():
+        print(f'{name:<22}{measure(decorator, keys):>24.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Benchmark all cache modes on several workloads.
+
+Runs every mode of :func:`tlru_cache.tlru_cache`, with
+:func:`functools.lru_cache` as the baseline, on the following
+workloads of small integer keys:
+
+- ``hit``: a small set of keys that always fits into the cache
+- ``miss``: keys that are never repeated
+- ``zipf``: keys drawn from a Zipfian distribution, which is typical
+  for real traffic
+- ``scan``: repeated scans over more keys than the cache can hold,
+  the worst case for LRU
+
+Every workload is timed on a fresh cache in a single thread and split
+across several threads, and the memory per cache entry is measured with
+:mod:`tracemalloc`. Keys are generated from a fixed seed, so runs are
+comparable. The results are written as JSON, so they can be tracked
+over time.
+
+Run from the repository root::
+
+    python benchmarks/suite.py [--output results.json] [--calls N]
+
+"""
+
+import argparse
+import datetime
+import functools
+import gc
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, '.')
+
+# pylint: disable=import-error,wrong-import-position
+import tlru_cache as tlru  # noqa: E402
+
+SEED = 1
+MAXSIZE = 1024
+REPEAT = 3
+THREADS = 4
+# Number of entries whose memory is measured
+ENTRIES = 20_000
+
+
+def _identity(value: int) -> int:
+    return value
+
+
+_Decorator = Callable[[Callable[[int], int]], Any]
+
+# Decorators of all benchmarked caches
+MODES: Dict[str, _Decorator] = {
+    'functools.lru_cache': functools.lru_cache(MAXSIZE),
+    'disabled': tlru.tlru_cache(0),
+    'unbounded, untimed': tlru.tlru_cache(None, None),
+    'unbounded, timed': tlru.tlru_cache(None, 3600.0),
+    'lru, untimed': tlru.tlru_cache(MAXSIZE, None),
+    'lru, timed': tlru.tlru_cache(MAXSIZE, 3600.0),
+    'clock, timed': tlru.tlru_cache(MAXSIZE, 3600.0, policy='clock'),
+}
+
+
+def _workloads(calls: int) -> Dict[str, List[int]]:
+    """Return the keys of every call of each workload."""
+    rng = random.Random(SEED)
+    population = range(10 * MAXSIZE)
+    weights = [1.0 / (rank + 1) for rank in population]
+    return {
+        'hit': [i % (MAXSIZE // 8) for i in range(calls)],
+        'miss': list(range(calls)),
+        'zipf': rng.choices(population, weights, k=calls),
+        'scan': [i % (2 * MAXSIZE) for i in range(calls)],
+    }
+
+
+def _run(func: Callable[[int], Any], keys: List[int], threads: int
+         ) -> float:
+    """Call `func` with every key and return the elapsed seconds.
+
+    With several threads, each thread calls `func` with its own
+    consecutive part of the keys.
+
+    """
+    if threads == 1:
+        start = time.perf_counter()
+        for key in keys:
+            func(key)
+        return time.perf_counter() - start
+    barrier = threading.Barrier(threads + 1)
+
+    def target(part: List[int]) -> None:
+        barrier.wait()
+        for key in part:
+            func(key)
+
+    size = -(-len(keys) // threads)
+    workers = [threading.Thread(target=target,
+                                args=(keys[i * size:(i + 1) * size],))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def measure(decorator: _Decorator, keys: List[int], threads: int,
+            warm: bool) -> Dict[str, float]:
+    """Return the best time per call and the hit ratio of a workload.
+
+    If `warm` is True, every distinct key is cached before the timing
+    starts.
+
+    """
+    best = float('inf')
+    ratio = 0.0
+    for _ in range(REPEAT):
+        func = decorator(_identity)
+        if warm:
+            for key in set(keys):
+                func(key)
+        before = func.cache_info()
+        best = min(best, _run(func, keys, threads))
+        after = func.cache_info()
+        ratio = (after.hits - before.hits) / len(keys)
+    return {'ns_per_call': best / len(keys) * 1e9,
+            'hit_ratio': round(ratio, 4)}
+
+
+def memory(decorator: _Decorator) -> float:
+    """Return the bytes allocated per cache entry."""
+    keys = list(range(1 << 30, (1 << 30) + ENTRIES))
+    gc.collect()
+    tracemalloc.start()
+    func = decorator(_identity)
+    for key in keys:
+        func(key)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    currsize = func.cache_info().currsize
+    return size / currsize if currsize else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='file to write the JSON results '
+                        'to, defaults to standard output')
+    parser.add_argument('--calls', type=int, default=100_000,
+                        help='number of calls per workload')
+    options = parser.parse_args()
+
+    workloads = _workloads(options.calls)
+    results: Dict[str, Any] = {
+        'version': tlru.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'calls': options.calls,
+        'threads': THREADS,
+        'modes': {},
+    }
+    for name, decorator in MODES.items():
+        mode: Dict[str, Any] = {}
+        for workload, keys in workloads.items():
+            warm = workload == 'hit'
+            mode[workload] = measure(decorator, keys, 1, warm)
+            mode[f'{workload}, {THREADS} threads'] = measure(
+                decorator, keys, THREADS, warm)
+        mode['bytes_per_entry'] = round(memory(decorator), 1)
+        results['modes'][name] = mode
+        print(f'{name}: done', file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if options.output is None:
+        print(text)
+    else:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,30 @@
+import asyncio
+import copy
+import gc
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
 import time
 import unittest
+import weakref
+from typing import List, Optional, Tuple
 
 # pylint: disable=import-error
-from tlru_cache import tlru_cache
+from tlru_cache import TLRUCache, tlru_cache
+from tlru_cache._policies import Policy
+
+
+class Account:
+    """Class with a method cached per instance, which can be pickled."""
+
+    def __init__(self, balance: int) -> None:
+        self.balance = balance
+
+    @tlru_cache(maxsize=None, lifetime=None, per_instance=True)
+    def total(self, interest: int) -> int:
+        return self.balance + interest
 
 
 class TLRUCacheTest(unittest.TestCase):
@@ -51,7 +73,7 @@ class TLRUCacheTest(unittest.TestCase):
         info = cached_function.cache_info()
         self.assertTupleEqual(
             tuple(info),
-            (1, 3, 5, 1, 0.001, 1),
+            (1, 3, 5, 1, 0.001, 1, 0, 'lru', None, None, None, 0, 0),
             'cache_info tuple mismatch')
         self.assertDictEqual(
             # NOTE: This method is valid and part of the namedtuple interface
@@ -66,7 +88,14 @@ class TLRUCacheTest(unittest.TestCase):
                 'maxsize': 5,
                 'currsize': 1,
                 'lifetime': 0.001,
-                'expired': 1
+                'expired': 1,
+                'stale': 0,
+                'policy': 'lru',
+                'maxbytes': None,
+                'currbytes': None,
+                'hit_curve': None,
+                'errors': 0,
+                'error_hits': 0
             },
             'cache_info dict mismatch')
 
@@ -161,3 +190,1043 @@ class TLRUCacheTest(unittest.TestCase):
         self.assertEqual(info.currsize, 1024)
         self.assertIs(info.lifetime, None)
         self.assertEqual(info.expired, 0)
+
+    def test_concurrent_misses(self) -> None:
+        """Test that misses for different keys do not block each other."""
+        barrier = threading.Barrier(2, timeout=1.0)
+
+        @tlru_cache()
+        def cached_function(value: int) -> int:
+            # Both calls must be running at the same time to pass this
+            barrier.wait()
+            return value ** 2
+
+        results = {}
+        threads = [
+            threading.Thread(
+                target=lambda v: results.update({v: cached_function(v)}),
+                args=(i,))
+            for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertDictEqual(results, {0: 0, 1: 1})
+        self.assertEqual(cached_function.cache_info().misses, 2)
+
+    def test_single_flight(self) -> None:
+        """Test that concurrent misses for the same key run only once."""
+        run_counter = 0
+        started = threading.Event()
+        release = threading.Event()
+
+        @tlru_cache(maxsize=None)
+        def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            started.set()
+            release.wait(1.0)
+            if value < 0:
+                raise ValueError(value)
+            return value ** 2
+
+        for value in (3, -3):
+            results = []
+
+            def target() -> None:
+                try:
+                    results.append(cached_function(value))
+                except ValueError as err:
+                    results.append(err)
+
+            started.clear()
+            release.clear()
+            threads = [threading.Thread(target=target) for _ in range(4)]
+            threads[0].start()
+            started.wait(1.0)
+            for thread in threads[1:]:
+                thread.start()
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(results), 4)
+            if value > 0:
+                self.assertListEqual(results, [9] * 4)
+            else:
+                self.assertTrue(all(isinstance(r, ValueError)
+                                    for r in results))
+        self.assertEqual(run_counter, 2, 'function not run once per key')
+        info = cached_function.cache_info()
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits, 6)
+
+    def test_coroutine_function(self) -> None:
+        """Test caching of coroutine functions."""
+        run_counter = 0
+
+        @tlru_cache(maxsize=5, lifetime=0.05)
+        async def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            await asyncio.sleep(0.01)
+            return value ** 2
+
+        async def main() -> None:
+            results = await asyncio.gather(
+                *(cached_function(i % 2) for i in range(6)))
+            self.assertListEqual(results, [0, 1] * 3)
+            self.assertEqual(await cached_function(1), 1)
+            await asyncio.sleep(0.06)
+            self.assertEqual(await cached_function(1), 1)
+
+        asyncio.run(main())
+        self.assertEqual(run_counter, 3)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 5)
+        self.assertEqual(info.misses, 3)
+        self.assertEqual(info.expired, 1)
+
+    def test_coroutine_function_cancelled(self) -> None:
+        """Test that a cancelled caller does not cancel other callers."""
+
+        @tlru_cache()
+        async def cached_function(value: int) -> int:
+            await asyncio.sleep(0.02)
+            return value ** 2
+
+        async def main() -> None:
+            first = asyncio.ensure_future(cached_function(3))
+            second = asyncio.ensure_future(cached_function(3))
+            await asyncio.sleep(0.005)
+            first.cancel()
+            self.assertEqual(await second, 9)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(await cached_function(3), 9)
+
+        asyncio.run(main())
+        self.assertEqual(cached_function.cache_info().misses, 1)
+
+    def test_cache_info_expiry_queue(self) -> None:
+        """Test cache_info with evicted and replaced cache items."""
+
+        @tlru_cache(maxsize=3, lifetime=0.05)
+        def cached_function(value: int) -> int:
+            return value ** 2
+
+        # Evicted items must not be counted or removed twice
+        _ = [cached_function(i) for i in range(200)]
+        self.assertEqual(cached_function.cache_info().currsize, 3)
+        time.sleep(0.06)
+        self.assertEqual(cached_function.cache_info().currsize, 0)
+        # A replaced item must not be dropped when its old entry expires
+        _ = cached_function(1)
+        time.sleep(0.03)
+        _ = cached_function(2)
+        time.sleep(0.03)
+        _ = cached_function(1)
+        info = cached_function.cache_info()
+        self.assertEqual(info.currsize, 2)
+        self.assertEqual(info.expired, 1)
+        time.sleep(0.03)
+        self.assertEqual(cached_function.cache_info().currsize, 1)
+
+    def test_cache_purge_on_insert(self) -> None:
+        """Test that expired items are dropped before live ones."""
+
+        @tlru_cache(maxsize=3, lifetime=0.05)
+        def cached_function(value: int) -> int:
+            return value ** 2
+
+        _ = cached_function(1)
+        time.sleep(0.03)
+        _ = cached_function(2)
+        _ = cached_function(3)
+        _ = cached_function(1)  # Most recently used, but oldest
+        time.sleep(0.03)
+        _ = cached_function(4)  # Must replace 1 rather than 2
+        _ = cached_function(2)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 2)
+        self.assertEqual(info.misses, 4)
+        self.assertEqual(info.expired, 0)
+
+    def test_unbounded_timed_cache(self) -> None:
+        """Test a cache with only a time constraint."""
+
+        @tlru_cache(maxsize=None, lifetime=0.05)
+        def cached_function(value: int) -> int:
+            return value ** 2
+
+        _ = [cached_function(i) for i in range(100)]
+        time.sleep(0.03)
+        _ = [cached_function(i) for i in range(50, 150)]
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 50)
+        self.assertEqual(info.misses, 150)
+        self.assertIs(info.maxsize, None)
+        self.assertEqual(info.currsize, 150)
+        time.sleep(0.03)  # First batch of elements expires
+        _ = cached_function(0)
+        info = cached_function.cache_info()
+        self.assertEqual(info.misses, 151)
+        self.assertEqual(info.expired, 1)
+        self.assertEqual(info.currsize, 51)
+
+    def test_sharded_cache(self) -> None:
+        """Test a cache split into multiple segments."""
+        run_counter = 0
+
+        @tlru_cache(maxsize=8, lifetime=None, shards=4)
+        def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            return value ** 2
+
+        _ = [cached_function(i) for i in range(100)]
+        info = cached_function.cache_info()
+        self.assertEqual(info.misses, 100)
+        self.assertEqual(info.maxsize, 8)
+        self.assertEqual(info.currsize, 8)
+        # Every shard holds two items, so the last two keys of each shard
+        # are still cached
+        run_counter = 0
+        self.assertEqual(
+            sum(cached_function(i) == i ** 2 for i in range(92, 100)), 8)
+        self.assertEqual(run_counter, 0)
+        cached_function.cache_clear()
+        self.assertTupleEqual(
+            tuple(cached_function.cache_info()),
+            (0, 0, 8, 0, None, 0, 0, 'lru', None, None, None, 0, 0))
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(shards=0)
+
+    def test_cache_clock(self) -> None:
+        """Test the CLOCK eviction policy."""
+
+        @tlru_cache(maxsize=3, lifetime=None, policy='clock')
+        def cached_function(value: int) -> int:
+            return value ** 2
+
+        _ = [cached_function(i) for i in range(3)]
+        _ = cached_function(0)  # Gives 0 a second chance
+        _ = cached_function(3)  # Evicts 1
+        _ = cached_function(0)
+        _ = cached_function(2)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 3)
+        self.assertEqual(info.misses, 4)
+        self.assertEqual(info.currsize, 3)
+        _ = cached_function(1)
+        self.assertEqual(cached_function.cache_info().misses, 5)
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(policy='random')
+
+        # Hits without the lock may mark keys that are being evicted
+        cache = TLRUCache(maxsize=2, lifetime=None, policy='clock')
+        segment = cache.segments[0]
+        cache.set('a', 1)
+        cache.set('b', 2)
+        segment.referenced.add('a')
+        segment.remove_victim('a')
+        self.assertNotIn('a', segment.referenced)
+        segment.referenced.add('a')
+        cache.set('a', 1)
+        self.assertNotIn('a', segment.referenced)
+        cache.set('c', 3)  # Evicts b
+        cache.set('d', 4)  # Evicts a, without a second chance
+        self.assertIsNone(cache.peek('a'))
+        self.assertEqual(cache.peek('c'), 3)
+
+    def test_cache_policies(self) -> None:
+        """Test the frequency based eviction policies."""
+        for policy in ('lfu', 'tinylfu', 'arc'):
+            with self.subTest(policy=policy):
+
+                @tlru_cache(maxsize=10, lifetime=None, policy=policy)
+                def cached_function(value: int) -> int:
+                    return value ** 2
+
+                # Make the first five keys popular, then scan over many
+                # keys used only once
+                for _ in range(5):
+                    _ = [cached_function(i) for i in range(5)]
+                _ = [cached_function(i) for i in range(100, 200)]
+                info = cached_function.cache_info()
+                self.assertEqual(info.currsize, 10)
+                self.assertEqual(info.policy, policy)
+                misses = info.misses
+                _ = [cached_function(i) for i in range(5)]
+                self.assertEqual(
+                    cached_function.cache_info().misses, misses,
+                    'scan evicted popular keys')
+                # Unbounded caches would never use the policy
+                with self.assertRaises(ValueError):
+                    _ = tlru_cache(maxsize=None, policy=policy)
+                with self.assertRaises(ValueError):
+                    _ = TLRUCache(maxsize=None, policy=policy)
+
+        # Policies must implement every method of the base class
+        with self.assertRaises(TypeError):
+            _ = Policy(10)  # type: ignore
+
+    def test_cache_policies_timed(self) -> None:
+        """Test expiry of items managed by an eviction policy."""
+        for policy in ('lfu', 'tinylfu', 'arc'):
+            with self.subTest(policy=policy):
+
+                @tlru_cache(maxsize=50, lifetime=0.02, policy=policy)
+                def cached_function(value: int) -> int:
+                    return value ** 2
+
+                _ = [cached_function(i % 70) for i in range(500)]
+                self.assertLessEqual(
+                    cached_function.cache_info().currsize, 50)
+                time.sleep(0.03)
+                self.assertEqual(cached_function.cache_info().currsize, 0)
+                _ = [cached_function(i) for i in range(100)]
+                self.assertEqual(cached_function.cache_info().currsize, 50)
+
+    def test_variable_lifetime(self) -> None:
+        """Test a lifetime computed from every result."""
+        run_counter = 0
+
+        def lifetime(args, kwargs, result):  # type: ignore
+            return kwargs.get('max_age', args[0] / 100)
+
+        for maxsize in (10, None):
+            with self.subTest(maxsize=maxsize):
+                run_counter = 0
+
+                @tlru_cache(maxsize=maxsize, lifetime=lifetime)
+                def cached_function(value: int, max_age: float = 0.0) -> int:
+                    nonlocal run_counter
+                    run_counter += 1
+                    return value ** 2
+
+                _ = cached_function(1)
+                _ = cached_function(5)
+                _ = cached_function(2, max_age=None)
+                time.sleep(0.02)
+                _ = [cached_function(i) for i in (1, 5)]
+                _ = cached_function(2, max_age=None)
+                info = cached_function.cache_info()
+                self.assertEqual(info.hits, 2)
+                self.assertEqual(info.misses, 4)
+                self.assertEqual(info.expired, 1)
+                self.assertEqual(info.currsize, 3)
+                time.sleep(0.05)  # Only the item without lifetime is left
+                self.assertEqual(cached_function.cache_info().currsize, 1)
+                self.assertEqual(run_counter, 4)
+
+    def test_stale_while_revalidate(self) -> None:
+        """Test returning stale results while they are refreshed."""
+        run_counter = 0
+        release = threading.Event()
+        refreshed = threading.Event()
+
+        @tlru_cache(maxsize=10, lifetime=0.02, stale_ttl=0.5)
+        def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            if run_counter > 1:
+                release.wait()
+                refreshed.set()
+            return value * run_counter
+
+        self.assertEqual(cached_function(2), 2)
+        time.sleep(0.03)
+        # Expired but within the grace period, so the old result is returned
+        self.assertEqual(cached_function(2), 2)
+        self.assertEqual(cached_function(2), 2)
+        release.set()
+        self.assertTrue(refreshed.wait(1.0))
+        time.sleep(0.01)
+        self.assertEqual(cached_function(2), 4)
+        self.assertEqual(run_counter, 2)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 3)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.stale, 2)
+        self.assertEqual(info.expired, 0)
+        time.sleep(0.55)  # Past the grace period, this is a regular miss
+        self.assertEqual(cached_function(2), 6)
+        info = cached_function.cache_info()
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.expired, 1)
+
+    def test_refresh_ahead(self) -> None:
+        """Test refreshing results before they expire."""
+        run_counter = 0
+
+        @tlru_cache(maxsize=None, lifetime=0.05, refresh_ahead=0.03)
+        async def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            return value * run_counter
+
+        async def main() -> None:
+            self.assertEqual(await cached_function(2), 2)
+            self.assertEqual(await cached_function(2), 2)
+            await asyncio.sleep(0.03)
+            # About to expire, refreshed in the background
+            self.assertEqual(await cached_function(2), 2)
+            await asyncio.sleep(0.005)
+            self.assertEqual(await cached_function(2), 4)
+
+        asyncio.run(main())
+        self.assertEqual(run_counter, 2)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 3)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.expired, 0)
+
+    def test_argument_keys(self) -> None:
+        """Test that equivalent calls share a cache entry."""
+
+        @tlru_cache(maxsize=10)
+        def cached_function(a: int, b: int = 2, *args: int,
+                            **kwargs: int) -> int:
+            return a + b + sum(args) + sum(kwargs.values())
+
+        self.assertEqual(cached_function(1), 3)
+        self.assertEqual(cached_function(1, 2), 3)
+        self.assertEqual(cached_function(1, b=2), 3)
+        self.assertEqual(cached_function(b=2, a=1), 3)
+        self.assertEqual(cached_function(1, 2, 3), 6)
+        self.assertEqual(cached_function(1, x=1, y=2), 6)
+        self.assertEqual(cached_function(1, y=2, x=1), 6)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 4)
+        self.assertEqual(info.misses, 3)
+        self.assertEqual(info.currsize, 3)
+
+        # Invalid calls are still passed on to the function
+        with self.assertRaises(TypeError):
+            cached_function(1, a=1)
+        with self.assertRaises(TypeError):
+            cached_function()
+
+    def test_cache_maxbytes(self) -> None:
+        """Test limiting the total weight of the cached results."""
+
+        @tlru_cache(maxsize=None, maxbytes=10, weigher=len)
+        def cached_function(value: str) -> str:
+            return value
+
+        _ = cached_function('aaaa')
+        _ = cached_function('bbbb')
+        _ = cached_function('aaaa')
+        self.assertEqual(cached_function.cache_info().currbytes, 8)
+        # Evicts the least recently used result until the new one fits
+        _ = cached_function('cccccc')
+        info = cached_function.cache_info()
+        self.assertEqual(info.currsize, 2)
+        self.assertEqual(info.currbytes, 10)
+        _ = cached_function('aaaa')
+        self.assertEqual(cached_function.cache_info().hits, 2)
+        # Results that are too large are not cached at all
+        _ = cached_function('x' * 11)
+        info = cached_function.cache_info()
+        self.assertEqual(info.currsize, 2)
+        self.assertEqual(info.currbytes, 10)
+        self.assertEqual(info.maxbytes, 10)
+
+        for policy in ('clock', 'lfu', 'tinylfu', 'arc'):
+            with self.subTest(policy=policy):
+
+                @tlru_cache(maxsize=100, maxbytes=1000, policy=policy,
+                            weigher=lambda result: 100)
+                def policy_function(value: int) -> int:
+                    return value
+
+                for value in range(50):
+                    _ = policy_function(value)
+                    _ = policy_function(value % 7)
+                info = policy_function.cache_info()
+                self.assertLessEqual(info.currsize, 10)
+                self.assertEqual(info.currbytes, 100 * info.currsize)
+
+        with self.assertRaises(ValueError):
+            tlru_cache(maxsize=None, maxbytes=10, policy='arc')
+
+    def test_cache_snapshot(self) -> None:
+        """Test writing the cache to a file and loading it again."""
+        run_counter = 0
+
+        def function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            return value * 2
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.pickle')
+            cached_function = tlru_cache(
+                maxsize=10, lifetime=lambda args, kwargs, result: (
+                    0.05 if args[0] == 1 else None))(function)
+            for value in range(3):
+                _ = cached_function(value)
+            self.assertEqual(cached_function.cache_dump(path), 3)
+
+            cached_function.cache_clear()
+            time.sleep(0.06)  # Skip the result that expired in the meantime
+            self.assertEqual(cached_function.cache_load(path), 2)
+            self.assertEqual(cached_function(0), 0)
+            self.assertEqual(cached_function(2), 4)
+            self.assertEqual(cached_function(1), 2)
+            self.assertEqual(run_counter, 4)
+
+            # Warm-start a new cache from the snapshot
+            warm_function = tlru_cache(maxsize=10, lifetime=60.0,
+                                       snapshot=path)(function)
+            self.assertEqual(warm_function.cache_info().currsize, 2)
+            self.assertEqual(warm_function(2), 4)
+            self.assertEqual(run_counter, 4)
+
+            # Snapshots of other functions are rejected
+            other_function = tlru_cache(snapshot=path)(lambda value: value)
+            self.assertEqual(other_function.cache_info().currsize, 0)
+            with self.assertRaises(ValueError):
+                other_function.cache_load(path)
+
+            # Concurrent dumps leave a complete snapshot and no temporary
+            # files behind, and neither do failed dumps
+            threads = [threading.Thread(target=warm_function.cache_dump,
+                                        args=(path,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(warm_function.cache_load(path), 0)
+            unpicklable = tlru_cache()(lambda value: lambda: value)
+            _ = unpicklable(1)
+            with self.assertRaises(Exception):
+                unpicklable.cache_dump(path)
+            self.assertEqual(os.listdir(directory), ['cache.pickle'])
+            self.assertEqual(
+                tlru_cache(maxsize=10)(function).cache_load(path), 2)
+
+            # Damaged snapshots are ignored with a warning
+            with open(path, 'rb') as file:
+                data = file.read()
+            for damaged in (data[:-3], b'garbage'):
+                with open(path, 'wb') as file:
+                    _ = file.write(damaged)
+                with self.assertWarns(RuntimeWarning):
+                    warm_function = tlru_cache(maxsize=10, lifetime=60.0,
+                                               snapshot=path)(function)
+                self.assertEqual(warm_function.cache_info().currsize, 0)
+
+    def test_shared_cache(self) -> None:
+        """Test caches stored in a database shared by processes."""
+        run_counter = 0
+
+        def function(value: int) -> List[int]:
+            nonlocal run_counter
+            run_counter += 1
+            return [value]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            # Separate caches of the same function stand in for processes
+            decorator = tlru_cache(maxsize=2, lifetime=0.05, shared=path)
+            first = decorator(function)
+            second = decorator(function)
+            self.assertEqual(first(1), [1])
+            self.assertEqual(second(1), [1])
+            self.assertEqual(run_counter, 1)
+            self.assertEqual(second.cache_info().hits, 1)
+
+            _ = first(2)
+            _ = second(1)
+            _ = first(3)  # Evicts the least recently used result, 2
+            self.assertEqual(second.cache_info().currsize, 2)
+            _ = second(2)
+            self.assertEqual(run_counter, 4)
+
+            time.sleep(0.06)
+            self.assertEqual(first.cache_info().currsize, 0)
+            _ = second(3)
+            self.assertEqual(run_counter, 5)
+            first.cache_clear()
+            self.assertEqual(second.cache_info().currsize, 0)
+
+            # Closed caches open a new connection when used again
+            first.cache_close()
+            self.assertEqual(first(3), [3])
+            # Keys are compared by their pickle, not by equality
+            runs = run_counter
+            _ = first(3.0)  # type: ignore
+            self.assertEqual(run_counter, runs + 1)
+            cache = TLRUCache(maxsize=2, lifetime=None, shared=path)
+            cache.set('a', 1)
+            connection = cache.segments[0].storage.connection
+            cache.close()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                _ = connection.execute('SELECT 1')
+            self.assertEqual(cache.get('a'), 1)
+            connection = cache.segments[0].storage.connection
+            del cache
+            _ = gc.collect()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                _ = connection.execute('SELECT 1')
+            TLRUCache(maxsize=2).close()
+
+            # Databases of the first schema version lack a column
+            path = os.path.join(directory, 'old.db')
+            with sqlite3.connect(path) as connection:
+                _ = connection.execute(
+                    'CREATE TABLE entries (name TEXT NOT NULL, key BLOB '
+                    'NOT NULL, value BLOB NOT NULL, expires REAL NOT NULL, '
+                    'used REAL NOT NULL, weight INTEGER NOT NULL, '
+                    'PRIMARY KEY (name, key))')
+                _ = connection.execute(
+                    'CREATE TABLE usage (name TEXT PRIMARY KEY, '
+                    'size INTEGER NOT NULL, bytes INTEGER NOT NULL)')
+                _ = connection.execute(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                    ('', pickle.dumps('a', pickle.HIGHEST_PROTOCOL),
+                     pickle.dumps(1), 1e300, time.time(), 0))
+                _ = connection.execute("INSERT INTO usage VALUES ('', 1, 0)")
+            connection.close()
+            cache = TLRUCache(maxsize=2, lifetime=60.0, shared=path,
+                              instrument=True)
+            self.assertEqual(cache.get('a'), 1)
+            cache.set('b', 2)
+            self.assertEqual(cache.get('b'), 2)
+            self.assertEqual(len(cache), 2)
+            cache.close()
+
+        with self.assertRaises(ValueError):
+            tlru_cache(shared='cache.db', policy='arc')
+
+    def test_cache_get_many(self) -> None:
+        """Test looking up many calls at once."""
+        batches = []
+
+        @tlru_cache(maxsize=10, shards=2)
+        def cached_function(value: int) -> int:
+            return value * 2
+
+        def loader(calls: List[Tuple[int]]) -> List[int]:
+            batches.append(calls)
+            return [value * 3 for value, in calls]
+
+        _ = cached_function(1)
+        _ = cached_function(2)
+        self.assertEqual(
+            cached_function.cache_get_many([(1,), (3,), (2,), (4,), (3,)],
+                                           loader),
+            [2, 9, 4, 12, 9])
+        self.assertEqual(batches, [[(3,), (4,)]])
+        self.assertEqual(cached_function(4), 12)
+        info = cached_function.cache_info()
+        self.assertEqual(info.hits, 4)
+        self.assertEqual(info.misses, 4)
+
+        # Without a loader, misses are computed by the cached function
+        self.assertEqual(cached_function.cache_get_many([(5,), (1,)]),
+                         [10, 2])
+
+        with self.assertRaises(ValueError):
+            cached_function.cache_get_many([(6,), (7,)], lambda calls: [1])
+        self.assertEqual(cached_function(6), 12)
+
+    def test_per_instance_cache(self) -> None:
+        """Test that methods cached per instance do not pin instances."""
+        run_counter = 0
+
+        class Counter:
+
+            def __init__(self, step: int) -> None:
+                self.step = step
+
+            @tlru_cache(maxsize=None, per_instance=True)
+            def add(self, value: int) -> int:
+                nonlocal run_counter
+                run_counter += 1
+                return value + self.step
+
+        first = Counter(1)
+        second = Counter(10)
+        self.assertEqual(first.add(1), 2)
+        self.assertEqual(first.add(value=1), 2)
+        self.assertEqual(second.add(1), 11)
+        self.assertEqual(Counter.add(second, 1), 11)
+        self.assertEqual(run_counter, 2)
+        self.assertEqual(first.add.cache_info().currsize, 1)
+        info = Counter.add.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+
+        reference = weakref.ref(first)
+        del first
+        gc.collect()
+        self.assertIsNone(reference())
+        self.assertEqual(Counter.add.cache_info().currsize, 1)
+
+        Counter.add.cache_clear()
+        self.assertEqual(second.add.cache_info().currsize, 0)
+
+        # Copies and pickles get caches of their own
+        account = Account(1)
+        self.assertEqual(account.total(1), 2)
+        duplicate = copy.copy(account)
+        duplicate.balance = 2
+        self.assertEqual((duplicate.total(1), account.total(1)), (3, 2))
+        restored = pickle.loads(pickle.dumps(account))
+        restored.balance = 3
+        self.assertEqual(restored.total(1), 4)
+        self.assertEqual(Account.total.cache_info().currsize, 3)
+
+        with self.assertRaises(ValueError):
+            tlru_cache(per_instance=True, snapshot='cache.pickle')
+
+    def test_clock_source(self) -> None:
+        """Test that lifetimes are measured with the given clock."""
+        now = 100.0
+        run_counter = 0
+
+        @tlru_cache(maxsize=2, lifetime=10.0, clock=lambda: now)
+        def cached_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            return value
+
+        _ = cached_function(1)
+        now += 9.0
+        _ = cached_function(1)
+        self.assertEqual(run_counter, 1)
+        now += 2.0
+        _ = cached_function(1)
+        self.assertEqual(run_counter, 2)
+        self.assertEqual(cached_function.cache_info().expired, 1)
+
+        @tlru_cache(lifetime=0.05, clock='coarse')
+        def coarse_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            return value
+
+        _ = coarse_function(1)
+        _ = coarse_function(1)
+        self.assertEqual(run_counter, 3)
+        time.sleep(0.1)
+        _ = coarse_function(1)
+        self.assertEqual(run_counter, 4)
+
+        with self.assertRaises(ValueError):
+            tlru_cache(clock='fast')
+
+    def test_instrumentation(self) -> None:
+        """Test eviction counts, histograms and event hooks."""
+        now = 0.0
+        events: List[Tuple[str, int]] = []
+
+        @tlru_cache(maxsize=2, lifetime=10.0, clock=lambda: now,
+                    on_hit=lambda key: events.append(('hit', key)),
+                    on_miss=lambda key: events.append(('miss', key)),
+                    on_evict=lambda key: events.append(('evict', key)),
+                    on_expire=lambda key: events.append(('expire', key)))
+        def cached_function(value: int) -> int:
+            return value
+
+        _ = cached_function(1)
+        now = 3.0
+        _ = cached_function(1)
+        _ = cached_function(2)
+        _ = cached_function(3)  # Evicts 1
+        now = 20.0
+        _ = cached_function(3)  # Expired, and purges 2 on insertion
+        self.assertEqual(events, [
+            ('miss', 1), ('hit', 1), ('miss', 2), ('miss', 3), ('evict', 1),
+            ('expire', 3), ('miss', 3), ('expire', 2)])
+
+        stats = cached_function.cache_stats()
+        self.assertEqual(stats.evicted, 1)
+        self.assertEqual(stats.hit_age, {4.0: 1})
+        self.assertEqual(sum(stats.miss_latency.values()), 4)
+        self.assertGreaterEqual(sum(stats.lock_wait.values()), 5)
+
+        cached_function.cache_clear()
+        self.assertEqual(cached_function.cache_stats().evicted, 0)
+
+        # Ages are known without a fixed lifetime as well
+        for lifetime in (None, lambda args, kwargs, result: 10.0):
+            for options in ({}, {'error_lifetime': 1.0}):
+                with self.subTest(lifetime=lifetime, options=options):
+                    now = 0.0
+                    other_function = tlru_cache(
+                        lifetime=lifetime, clock=lambda: now,
+                        instrument=True, **options)(lambda value: value)
+                    _ = other_function(1)
+                    now = 3.0
+                    _ = other_function(1)
+                    self.assertEqual(
+                        other_function.cache_stats().hit_age, {4.0: 1})
+
+        # Without instrumentation, only evictions are counted
+        @tlru_cache(maxsize=1)
+        def plain_function(value: int) -> int:
+            return value
+
+        _ = plain_function(1)
+        _ = plain_function(2)
+        self.assertEqual(plain_function.cache_stats(), (1, {}, {}, {}))
+
+    def test_cache_invalidate(self) -> None:
+        """Test removing single results and results with a tag."""
+        run_counter = 0
+
+        @tlru_cache(maxsize=10, shards=2,
+                    tags=lambda args, kwargs, result: [args[0]])
+        def cached_function(customer: str, item: int) -> str:
+            nonlocal run_counter
+            run_counter += 1
+            return f'{customer}:{item}'
+
+        for customer in ('a', 'b'):
+            for item in range(3):
+                _ = cached_function(customer, item)
+        self.assertTrue(cached_function.cache_invalidate('a', item=0))
+        self.assertFalse(cached_function.cache_invalidate('a', 0))
+        self.assertEqual(cached_function.cache_info().currsize, 5)
+
+        self.assertEqual(cached_function.cache_invalidate_tag('a'), 2)
+        self.assertEqual(cached_function.cache_invalidate_tag('a'), 0)
+        self.assertEqual(cached_function.cache_info().currsize, 3)
+        _ = cached_function('b', 1)
+        self.assertEqual(run_counter, 6)
+        _ = cached_function('a', 1)
+        self.assertEqual(run_counter, 7)
+
+        # Invalidating a running call does not start it again, but keeps
+        # its result from being cached
+        started = threading.Barrier(2)
+        proceed = threading.Event()
+
+        @tlru_cache()
+        def blocking_function(value: int) -> int:
+            nonlocal run_counter
+            run_counter += 1
+            _ = started.wait(5.0)
+            _ = proceed.wait(5.0)
+            return value
+
+        threads = [threading.Thread(target=blocking_function, args=(1,))]
+        threads[0].start()
+        _ = started.wait(5.0)
+        self.assertFalse(blocking_function.cache_invalidate(1))
+        threads.append(threading.Thread(target=blocking_function, args=(1,)))
+        threads[1].start()
+        time.sleep(0.01)
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        info = blocking_function.cache_info()
+        self.assertEqual((info.misses, info.currsize), (1, 0))
+        self.assertEqual(run_counter, 8)
+        started = threading.Barrier(1)
+        self.assertEqual(blocking_function(1), 1)
+        self.assertEqual(run_counter, 9)
+
+        # Running calls are not released, but only store results without
+        # the invalidated tag
+        started = threading.Barrier(3)
+        proceed = threading.Event()
+
+        @tlru_cache(tags=lambda args, kwargs, result: [args[0]])
+        def slow_function(customer: str) -> str:
+            nonlocal run_counter
+            run_counter += 1
+            _ = started.wait(5.0)
+            _ = proceed.wait(5.0)
+            return customer
+
+        threads = [threading.Thread(target=slow_function, args=(customer,))
+                   for customer in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        _ = started.wait()
+        self.assertEqual(slow_function.cache_invalidate_tag('a'), 0)
+        waiter = threading.Thread(target=slow_function, args=('b',))
+        waiter.start()
+        proceed.set()
+        for thread in (*threads, waiter):
+            thread.join()
+        self.assertEqual(run_counter, 11)
+        self.assertEqual(slow_function.cache_info().currsize, 1)
+        self.assertEqual(slow_function.cache_invalidate_tag('b'), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.pickle')
+            self.assertEqual(cached_function.cache_dump(path), 4)
+            cached_function.cache_clear()
+            self.assertEqual(cached_function.cache_load(path), 4)
+        # Tags are restored from snapshots
+        self.assertEqual(cached_function.cache_invalidate_tag('b'), 3)
+
+        with self.assertRaises(ValueError):
+            tlru_cache(shared='cache.db', tags=lambda *args: ())
+
+    def test_cache_class(self) -> None:
+        """Test the standalone cache and functions sharing it."""
+        now = 0.0
+        cache = TLRUCache(maxsize=3, lifetime=10.0, clock=lambda: now)
+        cache.set('a', 1)
+        cache.set('b', 2, tags=['even'])
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.peek('b'), 2)
+        self.assertIn('b', cache)
+        self.assertNotIn('c', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', None), None)
+        with self.assertRaises(KeyError):
+            _ = cache.pop('a')
+        self.assertEqual(cache.invalidate_tag('even'), 1)
+        cache.set('c', 3)
+        now = 11.0
+        self.assertEqual(cache.get('c', 0), 0)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.expired), (1, 2, 1))
+
+        # Expired items are not counted
+        cache.set('e', 5)
+        self.assertEqual(len(cache), 1)
+        now = 22.0
+        self.assertEqual(len(cache), 0)
+
+        # Setting a key keeps its running call, but not its result
+        segment = cache.segments[0]
+        segment.pending['d'] = call = object()
+        cache.set('d', 4)
+        self.assertIs(segment.pending['d'], call)
+        segment.store('d', call, 5)
+        self.assertEqual(cache.peek('d'), 4)
+        self.assertNotIn('d', segment.pending)
+
+        cache = TLRUCache(maxsize=2, lifetime=None)
+
+        @tlru_cache(cache=cache)
+        def double(value: int) -> int:
+            return 2 * value
+
+        @tlru_cache(cache=cache)
+        def triple(value: int) -> int:
+            return 3 * value
+
+        self.assertEqual((double(1), triple(1)), (2, 3))
+        self.assertEqual((double(1), triple(1)), (2, 3))
+        self.assertEqual(double.cache_info().hits, 2)
+        # Both functions count towards one maxsize
+        _ = double(2)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats().evicted, 1)
+        double.cache_clear()
+        self.assertEqual(triple.cache_info().currsize, 0)
+
+        # Keys of functions sharing a database are kept apart as well
+        with tempfile.TemporaryDirectory() as directory:
+            shared = TLRUCache(shared=os.path.join(directory, 'cache.db'))
+
+            @tlru_cache(cache=shared)
+            def twice(value: int) -> int:
+                return 2 * value
+
+            @tlru_cache(cache=shared)
+            def square(value: int) -> int:
+                return value * value
+
+            self.assertEqual((twice(5), square(5)), (10, 25))
+            self.assertEqual((twice(5), square(5)), (10, 25))
+            self.assertEqual(square.cache_info().hits, 2)
+
+        with self.assertRaises(ValueError):
+            tlru_cache(cache=cache, policy='lfu')
+        with self.assertRaises(ValueError):
+            tlru_cache(100, cache=cache)
+        with self.assertRaises(ValueError):
+            tlru_cache(lifetime=5.0, cache=cache)
+        with self.assertRaises(TypeError):
+            double.cache_dump('cache.pickle')
+
+    def test_autotune(self) -> None:
+        """Test resizing the cache from its estimated hit ratio."""
+
+        @tlru_cache(maxsize=10, lifetime=None, autotune=(10, 200))
+        def cached_function(value: int) -> int:
+            return value ** 2
+
+        # Scans over 50 keys never hit an LRU cache of fewer items
+        for i in range(5000):
+            _ = cached_function(i % 50)
+        info = cached_function.cache_info()
+        self.assertEqual(info.maxsize, 50)
+        self.assertEqual(info.currsize, 50)
+        self.assertEqual(sorted(info.hit_curve), [
+            10, 33, 57, 81, 105, 128, 152, 176, 200])
+        self.assertEqual(info.hit_curve[33], 0.0)
+        self.assertGreater(info.hit_curve[57], 0.99)
+        # The cache shrinks again once the scans faded from the estimate
+        for i in range(20000):
+            _ = cached_function(i % 5)
+        info = cached_function.cache_info()
+        self.assertEqual(info.maxsize, 10)
+        self.assertEqual(info.currsize, 10)
+        self.assertEqual(info.hit_curve[10], 1.0)
+
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(autotune=(0, 10))
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(autotune=(20, 10))
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(autotune=(10, 20), policy='lfu')
+
+    def test_error_lifetime(self) -> None:
+        """Test caching exceptions and negative results."""
+        now = 0.0
+        run_counter = 0
+
+        @tlru_cache(lifetime=60.0, error_lifetime=5.0, clock=lambda: now,
+                    negative=lambda result: result is None)
+        def cached_function(value: int) -> Optional[int]:
+            nonlocal run_counter
+            run_counter += 1
+            if value < 0:
+                raise KeyError(value)
+            return value or None
+
+        for _ in range(3):
+            with self.assertRaises(KeyError):
+                _ = cached_function(-1)
+            self.assertIsNone(cached_function(0))
+            self.assertEqual(cached_function(1), 1)
+        self.assertEqual(run_counter, 3)
+        info = cached_function.cache_info()
+        self.assertEqual((info.hits, info.misses), (6, 3))
+        self.assertEqual((info.errors, info.error_hits), (2, 4))
+        self.assertEqual(info.lifetime, 60.0)
+        with self.assertRaises(KeyError):
+            _ = cached_function.cache_get_many([(1,), (-1,)])
+
+        # Failures expire sooner than other results
+        now = 6.0
+        with self.assertRaises(KeyError):
+            _ = cached_function(-1)
+        self.assertIsNone(cached_function(0))
+        self.assertEqual(cached_function(1), 1)
+        self.assertEqual(run_counter, 5)
+
+        # Negative lifetimes never expire, as without error_lifetime
+        other_function = tlru_cache(lifetime=-1.0, error_lifetime=5.0)(
+            lambda value: value)
+        _ = other_function(1)
+        _ = other_function(1)
+        info = other_function.cache_info()
+        self.assertEqual((info.hits, info.misses, info.expired), (1, 1, 0))
+
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(negative=lambda result: result is None)
+        with self.assertRaises(ValueError):
+            _ = tlru_cache(shared='cache.db', error_lifetime=1.0)
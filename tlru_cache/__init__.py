@@ -7,23 +7,85 @@ cache items are always reasonably recent.
 
 """
 
+import asyncio
 import collections
+import concurrent.futures
 import functools
+import heapq
+import inspect
+import itertools
+import math
+import operator
+import os
+import pickle
+import sys
+import tempfile
 import threading
 import time
-from typing import (Any, Callable, Dict, Generic, Hashable, Iterable,
+import warnings
+import weakref
+from typing import (Any, Callable, Dict, Generic, Hashable, Iterable, List,
                     NamedTuple, Optional, Set, Tuple, Type, TypeVar, Union,
                     overload)
 
+from ._policies import POLICIES, Policy
+from ._shared import SharedStore
+from ._tuning import SizeTuner, curve_sizes
+
 __all__ = [
+    'TLRUCache',
     'tlru_cache'
 ]
 
 __version__ = '0.1.0a2'
 
+# Number of expired items to drop whenever a new item is cached
+_PURGE_BATCH = 2
+
+# Supported eviction policies
+_POLICIES = ('lru', 'clock', *POLICIES)
+
+# Sentinel value used for dict access fallback
+_MISSING = object()
+_DEFAULT = _MISSING, 0.0
+
+# Default of the options of tlru_cache() that may not be passed along with
+# a cache, so that they are only rejected if passed explicitly
+_UNSET: Any = object()
+
+# Expiry time of results whose variable lifetime is None
+_NEVER = float('inf')
+
+# Version of the file format written by cache_dump()
+_SNAPSHOT_FORMAT = 2
+
+# Executor for background refreshes, see _refresh_executor()
+_REFRESH_EXECUTOR: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_REFRESH_LOCK = threading.Lock()
+
+# Coarse clock shared by all caches using it, see _coarse_clock()
+_COARSE_RESOLUTION = 0.01
+_COARSE_NOW = [0.0]
+_COARSE_THREAD: Optional[threading.Thread] = None
+_COARSE_LOCK = threading.Lock()
+
 _T = TypeVar('_T')
 _FuncT = TypeVar('_FuncT', bound=Callable[..., Any])
 
+# A fixed lifetime in seconds, or a callable computing the lifetime of a
+# result from the positional and keyword arguments and the result
+_Lifetime = Union[
+    float, Callable[[Tuple[Any, ...], Dict[str, Any], Any], Optional[float]],
+    None]
+
+# A callable returning the tags of a result from the positional and keyword
+# arguments and the result
+_Tagger = Callable[[Tuple[Any, ...], Dict[str, Any], Any], Iterable[Hashable]]
+
+# An item of a snapshot file: the key, result, remaining lifetime (None if
+# the item never expires) and tags of the item
+_SnapshotItem = Tuple[Hashable, Any, Optional[float], Tuple[Hashable, ...]]
+
 
 class _TLRUCacheInfo(NamedTuple):
     """Container for TLRU cache statistics.
@@ -32,6 +94,14 @@ class _TLRUCacheInfo(NamedTuple):
     call that was found in the cache but out of date will count towards
     both.
 
+    Calls that wait for another thread to finish computing the same
+    result count as hits, so ``misses`` matches the number of times the
+    user function was run for a caller. Background refreshes are not
+    counted as misses.
+
+    The ``stale`` field counts expired results that were returned while
+    being refreshed; these also count as hits, but not as ``expired``.
+
     :param hits: Number of times a cached value was returned.
     :type hits: int
     :param misses: Number of times no cached value could be found.
@@ -40,18 +110,72 @@ class _TLRUCacheInfo(NamedTuple):
     :type maxsize: Optional[int]
     :param currsize: Current number of items in the cache.
     :type int:
-    :param lifetime: Timespan during which cache items are valid.
-    :type Optional[float]
+    :param lifetime: Timespan during which cache items are valid, or the
+        callable computing it for every item.
+    :type Union[float, Callable[..., Optional[float]], None]
     :param expired: Number of elements that were missed due to age.
     :type int:
+    :param stale: Number of expired elements that were still returned
+        during their stale grace period.
+    :type int:
+    :param policy: The eviction policy used when the cache is full.
+    :type policy: str
+    :param maxbytes: The weight constraint of the cache.
+    :type maxbytes: Optional[int]
+    :param currbytes: Current total weight of the items in the cache,
+        or None if weights are not tracked.
+    :type currbytes: Optional[int]
+    :param hit_curve: Estimated hit ratio of the recent calls for sizes
+        within the ``autotune`` bounds, or None if the cache is not
+        tuned.
+    :type hit_curve: Optional[Dict[int, float]]
+    :param errors: Number of exceptions and negative results that were
+        cached.
+    :type errors: int
+    :param error_hits: Number of calls answered with a cached exception
+        or negative result; these also count as hits.
+    :type error_hits: int
 
     """
     hits: int
     misses: int
     maxsize: Optional[int]
     currsize: int
-    lifetime: Optional[float]
+    lifetime: _Lifetime
     expired: int
+    stale: int
+    policy: str
+    maxbytes: Optional[int]
+    currbytes: Optional[int]
+    hit_curve: Optional[Dict[int, float]] = None
+    errors: int = 0
+    error_hits: int = 0
+
+
+class _TLRUCacheStats(NamedTuple):
+    """Container for the instrumentation of a TLRU cache.
+
+    Histograms map the exclusive upper bound of power of two buckets,
+    in seconds, to the number of values in that bucket. Values of zero
+    are counted in the bucket ``0.0``.
+
+    :param evicted: Number of items evicted from the full cache.
+    :type evicted: int
+    :param miss_latency: Histogram of the time the user function took
+        to compute results, including background refreshes.
+    :type miss_latency: Dict[float, int]
+    :param lock_wait: Histogram of the time callers waited for the
+        cache lock.
+    :type lock_wait: Dict[float, int]
+    :param hit_age: Histogram of the age of items when they were hit,
+        measured from the time they were stored.
+    :type hit_age: Dict[float, int]
+
+    """
+    evicted: int
+    miss_latency: Dict[float, int]
+    lock_wait: Dict[float, int]
+    hit_age: Dict[float, int]
 
 
 class _TLRUCacheWrapper(Generic[_T]):
@@ -83,6 +207,283 @@ class _TLRUCacheWrapper(Generic[_T]):
         """Clear the cache and reset cache statistics."""
         ...
 
+    def cache_invalidate(self, *args: Hashable, **kwargs: Hashable
+                         ) -> bool:
+        """Remove the cached result of a call, if any.
+
+        :return: Whether a result was removed.
+        :rtype: bool
+
+        """
+        ...
+
+    def cache_invalidate_tag(self, tag: Hashable) -> int:
+        """Remove the cached results with the given tag.
+
+        :param tag: The tag of the results to remove.
+        :type tag: Hashable
+
+        :return: The number of results removed.
+        :rtype: int
+
+        """
+        ...
+
+    def cache_stats(self) -> _TLRUCacheStats:
+        """Report eviction counts and instrumentation histograms.
+
+        :return: A named tuple containing the instrumentation data.
+        :rtype: _TLRUCacheStats
+
+        """
+        ...
+
+    def cache_get_many(self, calls: Iterable[Iterable[Any]],
+                       loader: Optional[Callable[[List[Tuple[Any, ...]]],
+                                                 Iterable[Any]]] = None
+                       ) -> List[Any]:
+        """Return the results of many calls, computing misses at once.
+
+        :param calls: The positional arguments of every call.
+        :type calls: Iterable[Iterable[Any]]
+        :param loader: Callable taking a list of argument tuples and
+            returning their results in the same order, defaults to None
+            (call the cached function for every miss).
+        :type loader: Optional[Callable[[List[Tuple[Any, ...]]],
+            Iterable[Any]]], optional
+
+        :return: The results of the calls, in order.
+        :rtype: List[Any]
+
+        """
+        ...
+
+    def cache_close(self) -> None:
+        """Close the database connection of a shared cache, if any."""
+        ...
+
+    def cache_dump(self, path: Union[str, 'os.PathLike[str]']) -> int:
+        """Write the unexpired cache items to a snapshot file.
+
+        :param path: The file to write.
+        :type path: Union[str, os.PathLike[str]]
+
+        :return: The number of items written.
+        :rtype: int
+
+        """
+        ...
+
+    def cache_load(self, path: Union[str, 'os.PathLike[str]']) -> int:
+        """Add the unexpired items of a snapshot file to the cache.
+
+        :param path: The file to read.
+        :type path: Union[str, os.PathLike[str]]
+
+        :return: The number of items added.
+        :rtype: int
+
+        """
+        ...
+
+
+class _PendingCall:
+    """Result slot for a cache miss that is currently being computed.
+
+    Concurrent callers for the same key wait on this object instead of
+    running the user function themselves. If the user function raises,
+    the exception is re-raised in every waiting caller.
+
+    """
+
+    __slots__ = ('_done', '_result', '_error')
+
+    def __init__(self) -> None:
+        # Held until the result is published. Most calls never have a
+        # waiter, and a lock is much cheaper to create than an Event.
+        self._done = threading.Lock()
+        self._done.acquire()
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+
+    def set_result(self, result: Any) -> None:
+        """Publish the result and wake up all waiting callers.
+
+        :param result: The return value of the user function.
+        :type result: Any
+
+        """
+        self._result = result
+        self._done.release()
+
+    def set_error(self, error: BaseException) -> None:
+        """Publish an exception and wake up all waiting callers.
+
+        :param error: The exception raised by the user function.
+        :type error: BaseException
+
+        """
+        self._error = error
+        self._done.release()
+
+    def wait(self) -> Any:
+        """Block until the result is available and return it.
+
+        :raises BaseException: Any exception raised by the user function.
+        :return: The return value of the user function.
+        :rtype: Any
+
+        """
+        # Every waiter releases the lock again for the next one
+        with self._done:
+            pass
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _CachedFailure:
+    """An exception or negative result stored in the cache.
+
+    Both are cached for the error lifetime rather than the lifetime of
+    regular results. Hits re-raise the exception with the traceback it
+    was first raised with, so that repeated hits do not extend it.
+
+    :param error: The exception raised by the user function, or None
+        for a negative result.
+    :type error: Optional[Exception]
+    :param result: The negative result, defaults to None.
+    :type result: Any, optional
+
+    """
+
+    __slots__ = ('error', 'traceback', 'result')
+
+    def __init__(self, error: Optional[Exception], result: Any = None
+                 ) -> None:
+        self.error = error
+        self.traceback = None if error is None else error.__traceback__
+        self.result = result
+
+    def unwrap(self) -> Any:
+        """Return the negative result or raise the exception.
+
+        :raises Exception: The cached exception.
+        :return: The cached negative result.
+        :rtype: Any
+
+        """
+        if self.error is not None:
+            raise self.error.with_traceback(self.traceback)
+        return self.result
+
+
+def _record(histogram: Dict[float, int], value: float) -> None:
+    """Count a value in the power of two bucket it falls into.
+
+    Buckets are keyed by their exclusive upper bound; values that are
+    zero or negative are counted in the bucket ``0.0``.
+
+    """
+    bound = math.ldexp(1.0, math.frexp(value)[1]) if value > 0 else 0.0
+    histogram[bound] = histogram.get(bound, 0) + 1
+
+
+class _CacheEvents:
+    """Instrumentation of a cache segment.
+
+    Collects histograms of miss latencies, lock waits and the age of
+    items at the time of a hit, and queues the calls of event hooks.
+    The caller must hold the segment lock, which runs the queued hooks
+    once it is released, see :class:`_InstrumentedLock`.
+
+    :param hooks: The hooks called on a hit, miss, eviction and expiry
+        of an item, each of them optional.
+    :type hooks: Tuple[Optional[Callable[[Hashable], Any]], ...]
+
+    """
+
+    __slots__ = ('on_hit', 'on_miss', 'on_evict', 'on_expire', 'queue',
+                 'miss_latency', 'lock_wait', 'hit_age', 'stored')
+
+    def __init__(self, hooks: Tuple[Optional[Callable[[Hashable], Any]],
+                                    ...]) -> None:
+        self.on_hit, self.on_miss, self.on_evict, self.on_expire = hooks
+        # Hooks to call with a key once the lock is released
+        self.queue: List[Tuple[Callable[[Hashable], Any], Hashable]] = []
+        self.miss_latency: Dict[float, int] = {}
+        self.lock_wait: Dict[float, int] = {}
+        self.hit_age: Dict[float, int] = {}
+        # Time at which every item of an in-memory segment was stored
+        self.stored: Dict[Hashable, float] = {}
+
+    def hit(self, key: Hashable, age: float) -> None:
+        """Record a hit of an item and its age."""
+        _record(self.hit_age, age)
+        if self.on_hit is not None:
+            self.queue.append((self.on_hit, key))
+
+    def miss(self, key: Hashable) -> None:
+        """Record a miss that runs the user function."""
+        if self.on_miss is not None:
+            self.queue.append((self.on_miss, key))
+
+    def evict(self, key: Hashable) -> None:
+        """Record the eviction of an item."""
+        if self.on_evict is not None:
+            self.queue.append((self.on_evict, key))
+
+    def expire(self, key: Hashable) -> None:
+        """Record the removal of an expired item."""
+        if self.on_expire is not None:
+            self.queue.append((self.on_expire, key))
+
+    def clear(self) -> None:
+        """Reset the histograms and forget all items."""
+        self.miss_latency.clear()
+        self.lock_wait.clear()
+        self.hit_age.clear()
+        self.stored.clear()
+
+
+class _InstrumentedLock:
+    """Segment lock of an instrumented cache.
+
+    Records how long every acquisition waited in the ``lock_wait``
+    histogram of `events`, and calls the hooks queued in `events`
+    after releasing the lock, so hooks may use the cache themselves.
+
+    :param events: The instrumentation of the segment.
+    :type events: _CacheEvents
+
+    """
+
+    __slots__ = ('lock', 'events')
+
+    def __init__(self, events: _CacheEvents) -> None:
+        self.lock = threading.Lock()
+        self.events = events
+
+    def __enter__(self) -> bool:
+        if self.lock.acquire(False):
+            _record(self.events.lock_wait, 0.0)
+        else:
+            start = time.perf_counter()
+            _ = self.lock.acquire()
+            _record(self.events.lock_wait, time.perf_counter() - start)
+        return True
+
+    def __exit__(self, *exc_info: Any) -> None:
+        events = self.events
+        queue = events.queue
+        if not queue:
+            self.lock.release()
+            return
+        events.queue = []
+        self.lock.release()
+        for hook, key in queue:
+            hook(key)
+
 
 def _make_key(args: Iterable[Hashable], kwargs: Dict[str, Hashable],
               typed: bool, kwd_mark: Tuple[Hashable] = (object(),),
@@ -127,147 +528,2548 @@ def _make_key(args: Iterable[Hashable], kwargs: Dict[str, Hashable],
     return key
 
 
+def _make_key_builder(user_function: Callable[..., Any], typed: bool
+                      ) -> Callable[[Tuple[Any, ...], Dict[str, Any]],
+                                    Hashable]:
+    """Create a function converting the arguments of a call into a key.
+
+    The signature of `user_function` is inspected once, so that all
+    ways of passing the same arguments result in the same key. Keyword
+    arguments are matched to their parameters, omitted arguments are
+    replaced by their defaults and variable keyword arguments are
+    sorted by name; f(1, 2), f(1, b=2) and f(b=2, a=1) share a key.
+
+    Calls passing all arguments positionally skip this work: their key
+    is the argument tuple itself, or the only argument of functions
+    with a single parameter. Functions without a signature fall back
+    to :func:`_make_key`.
+
+    :param user_function: The function whose arguments are converted.
+    :type user_function: Callable[..., Any]
+    :param typed: Whether to use include type information in the key.
+    :type typed: bool
+
+    :return: A function taking the positional argument tuple and the
+        keyword argument dict of a call and returning a hashable key.
+    :rtype: Callable[[Tuple[Any, ...], Dict[str, Any]], Hashable]
+
+    """
+    try:
+        signature = inspect.signature(user_function, follow_wrapped=False)
+    except (TypeError, ValueError):
+        return lambda args, kwargs: _make_key(args, kwargs, typed)
+    kind = inspect.Parameter
+    parameters = signature.parameters.values()
+    named = [parameter for parameter in parameters
+             if parameter.kind not in (kind.VAR_POSITIONAL, kind.VAR_KEYWORD)]
+    count = len(named)
+    npositional = sum(parameter.kind != kind.KEYWORD_ONLY
+                      for parameter in named)
+    varargs = any(parameter.kind == kind.VAR_POSITIONAL
+                  for parameter in parameters)
+    varkw = any(parameter.kind == kind.VAR_KEYWORD
+                for parameter in parameters)
+    # Position of every parameter that can be passed by keyword
+    index = {parameter.name: i for i, parameter in enumerate(named)
+             if parameter.kind != kind.POSITIONAL_ONLY}
+    invalid = object()
+    defaults: List[Any] = []
+    for parameter in named:
+        default = parameter.default
+        if default is not kind.empty:
+            try:
+                _ = hash(default)
+            except TypeError:
+                # Stands in for this default, which cannot be part of a key
+                default = object()
+        defaults.append(default)
+    # Whether each parameter has no default, and how many parameters after
+    # the given number of positional arguments have none
+    required = [parameter.default is kind.empty for parameter in named]
+    missing_after = [sum(required[i:]) for i in range(count + 1)]
+
+    def make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Hashable:
+        bound = min(len(args), npositional)
+        values = [*args[:bound], *defaults[bound:]]
+        missing = missing_after[bound]
+        extra_items = []
+        for name, value in kwargs.items():
+            i = index.get(name, -1)
+            if bound <= i:
+                values[i] = value
+                missing -= required[i]
+            elif i < 0 and varkw:
+                extra_items.append((name, value))
+            else:
+                missing = -1
+                break
+        if missing or (bound < len(args) and not varargs):
+            # The user function will reject these arguments, but they still
+            # need a key that cannot collide with the key of any valid call
+            return (invalid, args, tuple(kwargs.items()))
+        if varkw:
+            extra_items.sort()
+        if typed:
+            values += [type(value) for value in (
+                *values, *args[bound:], *(value for _, value in extra_items))]
+        if varargs:
+            values.append(args[bound:])
+        if varkw:
+            values.append(tuple(extra_items))
+        return values[0] if len(values) == 1 else tuple(values)
+
+    if typed or varargs or varkw or npositional != count:
+        return make_key
+
+    # Plans for calls to plain functions with keyword arguments, by number
+    # of positional arguments and keyword names. A plan picks the values of
+    # the key from the arguments and defaults of a call.
+    plans: List[Dict[Tuple[str, ...], Callable[[Tuple[Any, ...]], Any]]] = [
+        {} for _ in range(count + 1)]
+
+    def make_plan(nargs: int, names: Tuple[str, ...]
+                  ) -> Optional[Callable[[Tuple[Any, ...]], Any]]:
+        if nargs > count or any(index.get(name, -1) < nargs
+                                for name in names):
+            return None
+        positions = list(range(nargs))
+        for i in range(nargs, count):
+            name = named[i].name
+            if name in names:
+                positions.append(nargs + names.index(name))
+            elif required[i]:
+                return None
+            else:
+                positions.append(nargs + len(names) + i)
+        return operator.itemgetter(*positions)
+
+    def make_key_unplanned(args: Tuple[Any, ...],
+                           kwargs: Dict[str, Any]) -> Hashable:
+        names = tuple(kwargs)
+        plan = make_plan(len(args), names)
+        # Invalid calls are not planned, and neither are rare combinations
+        # of keyword arguments once there are lots of plans
+        if plan is not None and len(plans[len(args)]) < 32:
+            plans[len(args)][names] = plan
+        return make_key(args, kwargs)
+
+    if count == 1:
+
+        def make_key_single(args: Tuple[Any, ...],
+                            kwargs: Dict[str, Any]) -> Hashable:
+            if not kwargs:
+                if len(args) == 1:
+                    return args[0]
+            if not args:
+                # Also plans calls omitting the argument, f()
+                plan = plans[0].get(tuple(kwargs))
+                if plan is not None:
+                    return plan((*kwargs.values(), *defaults))
+            return make_key_unplanned(args, kwargs)
+
+        return make_key_single
+
+    # Defaults completing the key of calls passing the given number of
+    # arguments positionally and none by keyword, or None if a parameter
+    # without default follows
+    padding: List[Optional[Tuple[Any, ...]]] = [
+        None if any(required[i:]) else tuple(defaults[i:])
+        for i in range(count + 1)]
+
+    def make_key_positional(args: Tuple[Any, ...],
+                            kwargs: Dict[str, Any]) -> Hashable:
+        if not kwargs:
+            if len(args) == count:
+                return args
+            # Calls leaving the last arguments at their defaults
+            if len(args) < count:
+                tail = padding[len(args)]
+                if tail is not None:
+                    return args + tail
+        elif len(args) < count:
+            plan = plans[len(args)].get(tuple(kwargs))
+            if plan is not None:
+                return plan((*args, *kwargs.values(), *defaults))
+        return make_key_unplanned(args, kwargs)
+
+    return make_key_positional
+
+
+class _TLRUSegment:
+    """A partition of a TLRU cache with its own lock and storage.
+
+    The cache of a decorated function consists of one or more segments.
+    Keys are assigned to a segment by their hash, and every segment
+    enforces its own share of the total `maxsize`.
+
+    The caller must hold the segment's `lock` when accessing any of its
+    attributes or methods. The only exception are lock-free hits, which
+    read `cache`, add to `referenced` and increment `hits` without it.
+
+    :param maxsize: Maximum number of elements in this segment.
+    :type maxsize: Optional[int]
+    :param lifetime: Seconds after which elements will become invalid,
+        or a callable returning the lifetime of each result.
+    :type lifetime: _Lifetime
+    :param policy: The name of the eviction policy.
+    :type policy: str
+    :param stale_ttl: Seconds during which expired items are still
+        returned while they are being refreshed, defaults to 0.0.
+    :type stale_ttl: float, optional
+    :param refresh_ahead: Seconds before expiry during which a hit
+        triggers a refresh of the item, defaults to 0.0.
+    :type refresh_ahead: float, optional
+    :param maxbytes: Maximum total weight of the items in this segment,
+        defaults to None (no limit).
+    :type maxbytes: Optional[int], optional
+    :param weighed: Whether to track the weight of the items, defaults
+        to False. This is required if `maxbytes` is set.
+    :type weighed: bool, optional
+    :param timer: The clock expiry times are based on, defaults to
+        :func:`time.monotonic`.
+    :type timer: Callable[[], float], optional
+
+    """
+
+    __slots__ = ('maxsize', 'maxbytes', 'bounded', 'lifetime', 'timed',
+                 'variable', 'stale_ttl', 'refresh_ahead', 'clock', 'policy',
+                 'lock', 'cache', 'referenced', 'weights', 'currbytes',
+                 'pending', 'expiry', 'expiry_keys', 'counter', 'hits',
+                 'misses', 'expired', 'stale', 'evicted', 'errors',
+                 'error_hits', 'timer', 'events', 'tag_index', 'item_tags',
+                 'invalidated', 'tuner', 'touch')
+
+    def __init__(self, maxsize: Optional[int], lifetime: _Lifetime,
+                 policy: str, stale_ttl: float = 0.0,
+                 refresh_ahead: float = 0.0, maxbytes: Optional[int] = None,
+                 weighed: bool = False,
+                 timer: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        # Whether items may be evicted, which requires keeping them in LRU
+        # order rather than insertion order
+        self.bounded = maxsize is not None or maxbytes is not None
+        self.lifetime = lifetime
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        # Whether every result has its own lifetime
+        self.variable = callable(lifetime)
+        # Whether cache items expire after the given lifetime
+        self.timed = self.variable or (
+            lifetime is not None and lifetime >= 0)  # type: ignore
+        # CLOCK only approximates recency: hits mark their key as referenced
+        # rather than moving it, and eviction gives referenced items a second
+        # chance. Unlike moving items, marking them is safe without the lock.
+        self.clock = policy == 'clock' and self.bounded
+        # Other policies than LRU and CLOCK keep their own metadata
+        self.policy: Optional[Policy] = None
+        if policy in POLICIES and maxsize is not None:
+            self.policy = POLICIES[policy](maxsize)
+        self.lock = threading.Lock()
+        # Cached results and the time at which they expire. Results that
+        # never expire are stored on their own, without a timestamp. Caches
+        # that neither expire nor evict items never need to reorder them or
+        # drop the oldest, so they use a plain dict, which takes less memory.
+        self.cache: Any = (
+            collections.OrderedDict() if self.timed or self.bounded else {})
+        self.referenced: Set[Hashable] = set()
+        # How a hit marks its key as recently used, bound up front
+        self.touch: Optional[Callable[[Hashable], Any]] = None
+        if self.policy is not None:
+            self.touch = self.policy.hit
+        elif self.clock:
+            self.touch = self.referenced.add
+        elif self.bounded:
+            self.touch = self.cache.move_to_end
+        # Weights of the cached results and their total, if tracked
+        self.weights: Optional[Dict[Hashable, int]] = (
+            {} if weighed else None)
+        self.currbytes = 0
+        # Calls whose result is currently being computed; these are pending
+        # calls for regular functions and tasks for coroutine functions
+        self.pending: Dict[Hashable, Any] = {}
+        # Expiry times and keys of cache items in the order they expire.
+        # Items that were evicted or replaced are left in place and skipped
+        # once they reach the front. This allows dropping expired items in
+        # amortised constant time without scanning the entire cache.
+        # With a fixed lifetime, items expire in the order they were added
+        # and the queue is a deque of expiry times, with a second deque for
+        # the keys; this avoids allocating a tuple for every item. Unbounded
+        # caches never reorder their items, so they do not need these deques
+        # and expire items from the front of the cache itself. With a
+        # variable lifetime, the queue is a heap of (expiry time, counter,
+        # key) items instead.
+        self.expiry: Any = [] if self.variable else collections.deque()
+        self.expiry_keys: 'collections.deque[Hashable]' = collections.deque()
+        self.counter = itertools.count()
+        self.hits = self.misses = self.expired = self.stale = 0
+        self.evicted = 0
+        # Failures that were cached and hits on them
+        self.errors = self.error_hits = 0
+        self.timer = timer
+        # Instrumentation, if enabled; see _CacheEvents
+        self.events: Optional[_CacheEvents] = None
+        # Keys of the items with every tag, and the tags of every tagged
+        # item, so that invalidating a tag only visits its own items
+        self.tag_index: Dict[Hashable, Set[Hashable]] = {}
+        self.item_tags: Dict[Hashable, Tuple[Hashable, ...]] = {}
+        # Tags invalidated while the result for a key was being computed,
+        # or None if the key itself was invalidated. The tags of such results
+        # are only known once they are stored, so they are checked then.
+        self.invalidated: Dict[Hashable, Optional[Set[Hashable]]] = {}
+        # Estimates the hit ratio of other sizes and resizes the segment,
+        # if enabled; see SizeTuner
+        self.tuner: Optional[SizeTuner] = None
+
+    def lookup(self, key: Hashable, now: Optional[float] = None) -> Any:
+        """Return the cached result for `key` and update statistics.
+
+        Expired results are counted towards ``stale`` and returned if
+        they are within the stale grace period; otherwise they are
+        dropped and counted towards ``expired``.
+
+        :param key: The cache key to look up.
+        :type key: Hashable
+        :param now: The current time, defaults to None (look it up).
+        :type now: Optional[float], optional
+
+        :return: The cached result, or `_MISSING` if there is none.
+        :rtype: Any
+
+        """
+        if not self.timed:
+            result = self.cache.get(key, _MISSING)
+        else:
+            result, expires = self.cache.get(key, _DEFAULT)
+            if result is not _MISSING:
+                if now is None:
+                    now = self.timer()
+                if now > expires:
+                    if now - expires > self.stale_ttl:
+                        # Result is out of date - update
+                        del self.cache[key]
+                        self.forget(key)
+                        self.expired += 1
+                        if self.events is not None:
+                            self.events.expire(key)
+                        result = _MISSING
+                    else:
+                        self.stale += 1
+        if self.tuner is not None:
+            # Recorded once the item is known to be expired, since expired
+            # items are missed at any size
+            self.tune(key, result)
+        if result is _MISSING:
+            return _MISSING
+        self.hits += 1
+        if self.events is not None:
+            if now is None:
+                now = self.timer()
+            self.events.hit(key, now - self.events.stored[key])
+        if self.touch is not None:
+            self.touch(key)
+        return result
+
+    def due(self, key: Hashable) -> bool:
+        """Check whether a cached item should be refreshed.
+
+        This is the case if the item is stale or about to expire, and no
+        refresh is currently pending.
+
+        :param key: The key of a cached item.
+        :type key: Hashable
+
+        :return: Whether the caller should start a refresh.
+        :rtype: bool
+
+        """
+        if key in self.pending:
+            return False
+        expires = self.cache[key][1]
+        return self.timer() > expires - self.refresh_ahead
+
+    def tune(self, key: Hashable, result: Any) -> None:
+        """Record a lookup with the tuner and apply the size it chose.
+
+        :param key: The key that was looked up.
+        :type key: Hashable
+        :param result: The cached result, or `_MISSING` if there is
+            none.
+        :type result: Any
+
+        """
+        tuner: SizeTuner = self.tuner  # type: ignore
+        tuner.access(key)
+        if tuner.size == self.maxsize:
+            return
+        self.maxsize = tuner.size
+        cache = self.cache
+        if result is not _MISSING:
+            # Keep the item that is being hit
+            cache.move_to_end(key, last=True)
+        while len(cache) > self.maxsize:
+            self.evict()
+
+    def forget(self, key: Hashable, replaced: bool = False) -> None:
+        """Drop the eviction metadata of an item that was removed.
+
+        :param key: The key of the removed item.
+        :type key: Hashable
+        :param replaced: Whether the item is about to be replaced by a
+            new result, defaults to False.
+        :type replaced: bool, optional
+
+        """
+        if self.policy is not None:
+            self.policy.remove(key)
+        else:
+            self.referenced.discard(key)
+        if self.weights is not None:
+            self.currbytes -= self.weights.pop(key)
+        if self.item_tags:
+            self.untag(key)
+        if self.tuner is not None and not replaced:
+            self.tuner.remove(key)
+        if self.events is not None:
+            del self.events.stored[key]
+
+    def untag(self, key: Hashable) -> None:
+        """Remove a removed item from the tag index.
+
+        :param key: The key of the removed item.
+        :type key: Hashable
+
+        """
+        tag_index = self.tag_index
+        for tag in self.item_tags.pop(key, ()):
+            keys = tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del tag_index[tag]
+
+    def insert(self, key: Hashable, entry: Any, weight: int = 0,
+               tags: Iterable[Hashable] = ()) -> None:
+        """Add a new item, evicting other items if the segment is full.
+
+        Results weighing more than `maxbytes` on their own are not
+        stored at all.
+
+        :param key: The key of the new item.
+        :type key: Hashable
+        :param entry: The result and expiry time of the new item, or
+            only the result if the segment is not timed.
+        :type entry: Any
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: The tags of the item, defaults to ().
+        :type tags: Iterable[Hashable], optional
+
+        """
+        cache = self.cache
+        weights = self.weights
+        maxbytes = self.maxbytes
+        if weights is not None:
+            if maxbytes is not None and weight > maxbytes:
+                return
+            weights[key] = weight
+            self.currbytes += weight
+        if self.events is not None:
+            self.events.stored[key] = self.timer()
+        if self.policy is not None:
+            cache[key] = entry
+            victim = self.policy.insert(key)
+            if victim is not None:
+                self.remove_victim(victim)
+        else:
+            if self.maxsize is not None and len(cache) >= self.maxsize:
+                self.evict()
+            if self.clock:
+                # A hit without the lock may have marked the key after it
+                # was evicted, which must not give the new item a chance
+                self.referenced.discard(key)
+            cache[key] = entry
+        if maxbytes is not None:
+            while self.currbytes > maxbytes:
+                self.evict()
+        tags = tuple(tags)
+        if tags and key in cache:
+            self.item_tags[key] = tags
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+
+    def evict(self) -> None:
+        """Remove the item chosen by the eviction policy."""
+        cache = self.cache
+        if self.policy is not None:
+            key = self.policy.evict()
+        elif not self.clock:
+            key = next(iter(cache))
+        else:
+            # Skip over referenced items, clearing their reference bit
+            referenced = self.referenced
+            key = next(iter(cache))
+            while key in referenced:
+                referenced.remove(key)
+                cache.move_to_end(key, last=True)
+                key = next(iter(cache))
+        self.remove_victim(key)
+
+    def remove_victim(self, key: Hashable) -> None:
+        """Remove an item chosen for eviction and count the eviction.
+
+        The eviction policy must have already dropped its metadata.
+
+        :param key: The key of the evicted item.
+        :type key: Hashable
+
+        """
+        del self.cache[key]
+        self.referenced.discard(key)
+        if self.weights is not None:
+            self.currbytes -= self.weights.pop(key)
+        self.evicted += 1
+        if self.item_tags:
+            self.untag(key)
+        if self.events is not None:
+            del self.events.stored[key]
+            self.events.evict(key)
+
+    def purge(self, now: float, limit: Optional[int] = None) -> None:
+        """Drop expired items from the segment.
+
+        :param now: The current time.
+        :type now: float
+        :param limit: The maximum number of expiry queue items to
+            process, defaults to None (no limit).
+        :type limit: Optional[int], optional
+
+        """
+        cache = self.cache
+        # Stale items are kept until their grace period is over
+        now -= self.stale_ttl
+        if not self.bounded and not self.variable:
+            # Items are never moved, so the oldest item is always first
+            while cache and limit != 0:
+                key = next(iter(cache))
+                if now <= cache[key][1]:
+                    break
+                del cache[key]
+                self.forget(key)
+                if self.events is not None:
+                    self.events.expire(key)
+                if limit is not None:
+                    limit -= 1
+            return
+        expiry = self.expiry
+        keys = self.expiry_keys
+        while expiry and limit != 0:
+            if self.variable:
+                expires, _, key = expiry[0]
+                if now <= expires:
+                    break
+                _ = heapq.heappop(expiry)
+            else:
+                expires = expiry[0]
+                if now <= expires:
+                    break
+                _ = expiry.popleft()
+                key = keys.popleft()
+            if limit is not None:
+                limit -= 1
+            # Skip queue items whose cache item was evicted or replaced
+            if cache.get(key, _DEFAULT)[1] is expires:
+                del cache[key]
+                self.forget(key)
+                if self.events is not None:
+                    self.events.expire(key)
+
+    def store(self, key: Hashable, call: Any, result: Any,
+              lifetime: Optional[float] = None, weight: int = 0,
+              tags: Iterable[Hashable] = ()) -> None:
+        """Store the result of a pending call and release the call.
+
+        The result is only stored if `call` is still registered for
+        `key`; this is not the case if the cache was cleared while the
+        user function was running. Neither is a result with a tag that
+        was invalidated in the meantime.
+
+        :param key: The cache key of the result.
+        :type key: Hashable
+        :param call: The pending call or task that computed the result.
+        :type call: Any
+        :param result: The result to store.
+        :type result: Any
+        :param lifetime: The lifetime of this result if the segment uses
+            a variable lifetime, defaults to None (never expires).
+        :type lifetime: Optional[float], optional
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: The tags of the result, defaults to ().
+        :type tags: Iterable[Hashable], optional
+
+        """
+        if self.pending.get(key) is not call:
+            return
+        del self.pending[key]
+        if self.invalidated and key in self.invalidated:
+            invalidated = self.invalidated.pop(key)
+            if invalidated is None:
+                return
+            tags = tuple(tags)
+            if not invalidated.isdisjoint(tags):
+                return
+        self.set(key, result, lifetime, weight, tags)
+
+    def set(self, key: Hashable, result: Any,
+            lifetime: Optional[float] = None, weight: int = 0,
+            tags: Iterable[Hashable] = ()) -> None:
+        """Store a result, replacing any cached result for `key`.
+
+        :param key: The cache key of the result.
+        :type key: Hashable
+        :param result: The result to store.
+        :type result: Any
+        :param lifetime: The lifetime of this result if the segment uses
+            a variable lifetime, defaults to None (never expires).
+        :type lifetime: Optional[float], optional
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: The tags of the result, defaults to ().
+        :type tags: Iterable[Hashable], optional
+
+        """
+        if key in self.cache:
+            # Replace a refreshed item
+            del self.cache[key]
+            self.forget(key, replaced=True)
+        if not self.timed:
+            self.insert(key, result, weight, tags)
+            return
+        # The timestamp is taken after the result was computed to keep
+        # the expiry queue sorted
+        now = self.timer()
+        # Free a few expired items on every insertion. This bounds the
+        # memory held by expired results without requiring lookups of
+        # their keys, and keeps them from pushing out live items.
+        self.purge(now, _PURGE_BATCH)
+        if not self.variable:
+            expires = now + self.lifetime  # type: ignore
+        elif lifetime is not None:
+            expires = now + lifetime
+        else:
+            self.insert(key, (result, _NEVER), weight, tags)
+            return
+        self.insert(key, (result, expires), weight, tags)
+        expiry = self.expiry
+        if self.variable:
+            heapq.heappush(expiry, (expires, next(self.counter), key))
+        elif not self.bounded:
+            return
+        else:
+            expiry.append(expires)
+            self.expiry_keys.append(key)
+        # Compact the expiry queue if it is mostly made up of evicted
+        # items, which happens with long lifetimes and a small maxsize
+        cache = self.cache
+        if len(expiry) > 2 * len(cache) + 64:
+            if self.variable:
+                expiry[:] = [item for item in expiry
+                             if cache.get(item[2], _DEFAULT)[1] is item[0]]
+                heapq.heapify(expiry)
+                return
+            live = [(expires, key)
+                    for expires, key in zip(expiry, self.expiry_keys)
+                    if cache.get(key, _DEFAULT)[1] is expires]
+            expiry.clear()
+            self.expiry_keys.clear()
+            for expires, key in live:
+                expiry.append(expires)
+                self.expiry_keys.append(key)
+
+    def peek(self, key: Hashable) -> Any:
+        """Return the cached result for `key` without using it.
+
+        Neither the statistics nor the eviction order are updated.
+
+        :param key: The cache key to look up.
+        :type key: Hashable
+
+        :return: The result :meth:`lookup` would return, or `_MISSING`.
+        :rtype: Any
+
+        """
+        if not self.timed:
+            return self.cache.get(key, _MISSING)
+        result, expires = self.cache.get(key, _DEFAULT)
+        if result is not _MISSING and (
+                self.timer() - expires > self.stale_ttl):
+            return _MISSING
+        return result
+
+    def discard(self, key: Hashable, call: Any) -> None:
+        """Release a pending call that failed without storing anything.
+
+        :param key: The cache key of the failed call.
+        :type key: Hashable
+        :param call: The pending call or task that failed.
+        :type call: Any
+
+        """
+        if self.pending.get(key) is call:
+            del self.pending[key]
+            _ = self.invalidated.pop(key, None)
+
+    def items(self, now: float) -> List[_SnapshotItem]:
+        """Return the unexpired items and their remaining lifetime.
+
+        :param now: The current time.
+        :type now: float
+
+        :return: The key, result, remaining lifetime and tags of every
+            item, from the least to the most recently used item. The
+            lifetime is None for items that never expire.
+        :rtype: List[_SnapshotItem]
+
+        """
+        item_tags = self.item_tags
+        if not self.timed:
+            return [(key, result, None, item_tags.get(key, ()))
+                    for key, result in self.cache.items()]
+        return [(key, result, None if expires == _NEVER else expires - now,
+                 item_tags.get(key, ()))
+                for key, (result, expires) in self.cache.items()
+                if now <= expires]
+
+    def restore(self, key: Hashable, result: Any, expires: float,
+                weight: int = 0, tags: Iterable[Hashable] = ()) -> bool:
+        """Add an item loaded from a snapshot.
+
+        Items are not restored if their key is already cached or being
+        computed, since the current result is more recent. Call
+        :meth:`sort_expiry` once all items were restored.
+
+        :param key: The cache key of the item.
+        :type key: Hashable
+        :param result: The cached result.
+        :type result: Any
+        :param expires: The time at which the item expires.
+        :type expires: float
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: The tags of the item, defaults to ().
+        :type tags: Iterable[Hashable], optional
+
+        :return: Whether the item was added.
+        :rtype: bool
+
+        """
+        if key in self.cache or key in self.pending:
+            return False
+        if not self.timed:
+            self.insert(key, result, weight, tags)
+            return key in self.cache
+        self.insert(key, (result, expires), weight, tags)
+        if key not in self.cache:
+            return False  # Not admitted by the policy, or too large
+        if self.variable:
+            if expires != _NEVER:
+                heapq.heappush(
+                    self.expiry, (expires, next(self.counter), key))
+        elif self.bounded:
+            self.expiry.append(expires)
+            self.expiry_keys.append(key)
+        return True
+
+    def sort_expiry(self) -> None:
+        """Sort items with a fixed lifetime by their expiry time.
+
+        Restored items may expire before items that were added earlier,
+        which breaks the assumption that items with a fixed lifetime
+        expire in the order they were added.
+
+        """
+        if not self.timed or self.variable:
+            return
+        cache = self.cache
+        order = sorted(((entry[1], key) for key, entry in cache.items()),
+                       key=operator.itemgetter(0))
+        if not self.bounded:
+            for _, key in order:
+                cache.move_to_end(key, last=True)
+            return
+        self.expiry.clear()
+        self.expiry_keys.clear()
+        for expires, key in order:
+            self.expiry.append(expires)
+            self.expiry_keys.append(key)
+
+    def currsize(self) -> int:
+        """Return the number of valid items in the segment.
+
+        :return: The number of items in the segment after dropping any
+            expired items.
+        :rtype: int
+
+        """
+        if self.timed:
+            self.purge(self.timer())
+        return len(self.cache)
+
+    def clear(self) -> None:
+        """Clear the segment and reset its statistics."""
+        self.cache.clear()
+        self.referenced.clear()
+        if self.weights is not None:
+            self.weights.clear()
+            self.currbytes = 0
+        if self.policy is not None:
+            self.policy.clear()
+        self.pending.clear()
+        self.expiry.clear()
+        self.expiry_keys.clear()
+        self.tag_index.clear()
+        self.item_tags.clear()
+        self.invalidated.clear()
+        self.hits = self.misses = self.expired = self.stale = 0
+        self.evicted = self.errors = self.error_hits = 0
+        if self.events is not None:
+            self.events.clear()
+        if self.tuner is not None:
+            self.tuner.clear()
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Remove the item for `key`, if any.
+
+        A call computing the result for `key` keeps running for the
+        callers waiting on it, but its result, which may be out of date,
+        is not stored.
+
+        :param key: The key of the item to remove.
+        :type key: Hashable
+
+        :return: Whether an item was removed.
+        :rtype: bool
+
+        """
+        if key in self.pending:
+            self.invalidated[key] = None
+        if key not in self.cache:
+            return False
+        del self.cache[key]
+        self.forget(key)
+        return True
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """Remove all items with the given tag.
+
+        The tags of results that are still being computed are not
+        known yet. Their calls keep running for the callers waiting on
+        them, but their results are not stored if they have the tag.
+
+        :param tag: The tag of the items to remove.
+        :type tag: Hashable
+
+        :return: The number of items removed.
+        :rtype: int
+
+        """
+        for key in self.pending:
+            tags = self.invalidated.setdefault(key, set())
+            if tags is not None:
+                tags.add(tag)
+        keys = self.tag_index.pop(tag, ())
+        for key in keys:
+            del self.cache[key]
+            self.forget(key)
+        return len(keys)
+
+
+class _SharedSegment:
+    """A TLRU cache segment stored in a database shared by processes.
+
+    This implements the same interface as :class:`_TLRUSegment`, so the
+    cache wrapper can use either. Keys and results are pickled, results
+    exactly once when they are stored. Keys are compared by their
+    pickle, which unlike ``==`` tells ``1`` and ``1.0`` apart. Items are
+    always evicted in least recently used order.
+
+    Calls that are being computed and the ``hits``, ``misses``,
+    ``expired`` and ``stale`` statistics are tracked by every process on
+    its own; the items and their number are shared.
+
+    The caller must hold the segment's `lock`, which serializes the
+    database access of all threads in this process.
+
+    :param storage: The database storage of the cache.
+    :type storage: SharedStore
+    :param lifetime: Seconds after which elements will become invalid,
+        or a callable returning the lifetime of each result.
+    :type lifetime: _Lifetime
+    :param stale_ttl: Seconds during which expired items are still
+        returned while they are being refreshed, defaults to 0.0.
+    :type stale_ttl: float, optional
+    :param refresh_ahead: Seconds before expiry during which a hit
+        triggers a refresh of the item, defaults to 0.0.
+    :type refresh_ahead: float, optional
+    :param weigh_values: Whether to use the size of the pickled result
+        as its weight, defaults to False.
+    :type weigh_values: bool, optional
+
+    """
+
+    __slots__ = ('storage', 'lifetime', 'timed', 'variable', 'stale_ttl',
+                 'refresh_ahead', 'weigh_values', 'bounded', 'clock', 'lock',
+                 'pending', 'invalidated', 'hits', 'misses', 'expired',
+                 'stale', 'evicted', 'errors', 'error_hits', 'timer',
+                 'events')
+
+    def __init__(self, storage: SharedStore, lifetime: _Lifetime,
+                 stale_ttl: float = 0.0, refresh_ahead: float = 0.0,
+                 weigh_values: bool = False) -> None:
+        self.storage = storage
+        self.lifetime = lifetime
+        self.variable = callable(lifetime)
+        self.timed = self.variable or (
+            lifetime is not None and lifetime >= 0)  # type: ignore
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.weigh_values = weigh_values
+        # Hits always have to update the database, which needs the lock
+        self.bounded = True
+        self.clock = False
+        self.lock = threading.Lock()
+        self.pending: Dict[Hashable, Any] = {}
+        # Keys invalidated while their result was being computed
+        self.invalidated: Set[Hashable] = set()
+        self.hits = self.misses = self.expired = self.stale = 0
+        # Expiry times are compared by all processes, so they need a clock
+        # that is the same in every process
+        self.timer = time.time
+        # Evictions happen in the database and are not counted
+        self.evicted = 0
+        # Shared caches do not cache failures
+        self.errors = self.error_hits = 0
+        self.events: Optional[_CacheEvents] = None
+
+    @property
+    def currbytes(self) -> int:
+        """The total weight of the items in the segment."""
+        return self.storage.usage()[1]
+
+    def lookup(self, key: Hashable, now: Optional[float] = None) -> Any:
+        """Return the cached result for `key` and update statistics.
+
+        :param key: The cache key to look up.
+        :type key: Hashable
+        :param now: The current time, defaults to None (look it up).
+        :type now: Optional[float], optional
+
+        :return: The cached result, or `_MISSING` if there is none.
+        :rtype: Any
+
+        """
+        name = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        row = self.storage.get(name)
+        if row is None:
+            return _MISSING
+        value, expires, stored = row
+        if now is None:
+            now = self.timer()
+        if now > expires:
+            if now - expires > self.stale_ttl:
+                _ = self.storage.delete(name)
+                self.expired += 1
+                if self.events is not None:
+                    self.events.expire(key)
+                return _MISSING
+            self.stale += 1
+        try:
+            result = pickle.loads(value)
+        except Exception:  # pylint: disable=broad-except
+            # E.g. written by a process with a different version of the
+            # result's class; this is not an error as the result can be
+            # computed again
+            _ = self.storage.delete(name)
+            return _MISSING
+        self.hits += 1
+        self.storage.touch(name, now)
+        if self.events is not None:
+            self.events.hit(key, now - stored)
+        return result
+
+    def due(self, key: Hashable) -> bool:
+        """Check whether a cached item should be refreshed.
+
+        :param key: The key of a cached item.
+        :type key: Hashable
+
+        :return: Whether the caller should start a refresh.
+        :rtype: bool
+
+        """
+        if key in self.pending:
+            return False
+        row = self.storage.get(pickle.dumps(key, pickle.HIGHEST_PROTOCOL))
+        return row is not None and self.timer() > row[1] - self.refresh_ahead
+
+    def put(self, key: Hashable, result: Any, expires: float, weight: int,
+            replace: bool = True) -> bool:
+        """Pickle an item and write it to the database.
+
+        :return: Whether the item was stored.
+        :rtype: bool
+
+        """
+        value = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        if self.weigh_values:
+            weight = len(value)
+        now = self.timer()
+        return self.storage.put(
+            pickle.dumps(key, pickle.HIGHEST_PROTOCOL), value, expires,
+            weight, now, replace,
+            (now - self.stale_ttl, _PURGE_BATCH) if self.timed else None)
+
+    def store(self, key: Hashable, call: Any, result: Any,
+              lifetime: Optional[float] = None, weight: int = 0,
+              tags: Iterable[Hashable] = ()) -> None:
+        """Store the result of a pending call and release the call.
+
+        :param key: The cache key of the result.
+        :type key: Hashable
+        :param call: The pending call or task that computed the result.
+        :type call: Any
+        :param result: The result to store.
+        :type result: Any
+        :param lifetime: The lifetime of this result if the segment uses
+            a variable lifetime, defaults to None (never expires).
+        :type lifetime: Optional[float], optional
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: Ignored, shared caches do not support tags.
+        :type tags: Iterable[Hashable], optional
+
+        """
+        if self.pending.get(key) is not call:
+            return
+        del self.pending[key]
+        if key in self.invalidated:
+            self.invalidated.remove(key)
+            return
+        self.set(key, result, lifetime, weight)
+
+    def set(self, key: Hashable, result: Any,
+            lifetime: Optional[float] = None, weight: int = 0,
+            tags: Iterable[Hashable] = ()) -> None:
+        """Store a result, replacing any shared result for `key`.
+
+        :param key: The cache key of the result.
+        :type key: Hashable
+        :param result: The result to store.
+        :type result: Any
+        :param lifetime: The lifetime of this result if the segment uses
+            a variable lifetime, defaults to None (never expires).
+        :type lifetime: Optional[float], optional
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: Ignored, shared caches do not support tags.
+        :type tags: Iterable[Hashable], optional
+
+        """
+        if not self.variable:
+            lifetime = self.lifetime if self.timed else None  # type: ignore
+        expires = _NEVER if lifetime is None else self.timer() + lifetime
+        _ = self.put(key, result, expires, weight)
+
+    def peek(self, key: Hashable) -> Any:
+        """Return the shared result for `key` without using it.
+
+        :param key: The cache key to look up.
+        :type key: Hashable
+
+        :return: The result :meth:`lookup` would return, or `_MISSING`.
+        :rtype: Any
+
+        """
+        row = self.storage.get(pickle.dumps(key, pickle.HIGHEST_PROTOCOL))
+        if row is None or self.timer() - row[1] > self.stale_ttl:
+            return _MISSING
+        try:
+            return pickle.loads(row[0])
+        except Exception:  # pylint: disable=broad-except
+            return _MISSING
+
+    def discard(self, key: Hashable, call: Any) -> None:
+        """Release a pending call that failed without storing anything.
+
+        :param key: The cache key of the failed call.
+        :type key: Hashable
+        :param call: The pending call or task that failed.
+        :type call: Any
+
+        """
+        if self.pending.get(key) is call:
+            del self.pending[key]
+            self.invalidated.discard(key)
+
+    def items(self, now: float) -> List[_SnapshotItem]:
+        """Return the unexpired items and their remaining lifetime.
+
+        :param now: The current time.
+        :type now: float
+
+        :return: The key, result, remaining lifetime and (empty) tags of
+            every item, from the least to the most recently used item.
+        :rtype: List[_SnapshotItem]
+
+        """
+        return [(pickle.loads(name), pickle.loads(value),
+                 None if expires == _NEVER else expires - now, ())
+                for name, value, expires in self.storage.items()
+                if now <= expires]
+
+    def restore(self, key: Hashable, result: Any, expires: float,
+                weight: int = 0, tags: Iterable[Hashable] = ()) -> bool:
+        """Add an item loaded from a snapshot, unless `key` is cached.
+
+        :param key: The cache key of the item.
+        :type key: Hashable
+        :param result: The cached result.
+        :type result: Any
+        :param expires: The time at which the item expires.
+        :type expires: float
+        :param weight: The weight of the result, defaults to 0.
+        :type weight: int, optional
+        :param tags: Ignored, shared caches do not support tags.
+        :type tags: Iterable[Hashable], optional
+
+        :return: Whether the item was added.
+        :rtype: bool
+
+        """
+        if key in self.pending:
+            return False
+        return self.put(key, result, expires if self.timed else _NEVER,
+                        weight, replace=False)
+
+    def sort_expiry(self) -> None:
+        """Do nothing; the database keeps an index of expiry times."""
+
+    def currsize(self) -> int:
+        """Return the number of valid items in the segment.
+
+        :return: The number of items in the segment after dropping any
+            expired items.
+        :rtype: int
+
+        """
+        if self.timed:
+            self.storage.purge(self.timer() - self.stale_ttl)
+        return self.storage.usage()[0]
+
+    def clear(self) -> None:
+        """Clear the shared items and the statistics of this process."""
+        self.storage.clear()
+        self.pending.clear()
+        self.invalidated.clear()
+        self.hits = self.misses = self.expired = self.stale = 0
+        if self.events is not None:
+            self.events.clear()
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Remove the shared item for `key`, if any.
+
+        A call of this process computing the result for `key` keeps
+        running for the callers waiting on it, but its result is not
+        stored.
+
+        :param key: The key of the item to remove.
+        :type key: Hashable
+
+        :return: Whether an item was removed.
+        :rtype: bool
+
+        """
+        if key in self.pending:
+            self.invalidated.add(key)
+        return self.storage.delete(pickle.dumps(key, pickle.HIGHEST_PROTOCOL))
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """Do nothing, since shared caches do not support tags."""
+        return 0
+
+
+def _merge_stats(stats: Iterable[_TLRUCacheStats]) -> _TLRUCacheStats:
+    """Combine the instrumentation of several segments or caches.
+
+    :param stats: The instrumentation data to combine.
+    :type stats: Iterable[_TLRUCacheStats]
+
+    :return: The total evictions and histograms, with buckets sorted.
+    :rtype: _TLRUCacheStats
+
+    """
+    evicted = 0
+    histograms: Tuple[Dict[float, int], ...] = ({}, {}, {})
+    for item in stats:
+        evicted += item.evicted
+        for total, histogram in zip(histograms, item[1:]):
+            for bound, count in histogram.items():
+                total[bound] = total.get(bound, 0) + count
+    return _TLRUCacheStats(
+        evicted, *(dict(sorted(histogram.items()))
+                   for histogram in histograms))
+
+
+def _refresh_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the executor used to refresh items in the background.
+
+    The executor is shared by all caches and created on first use.
+
+    """
+    global _REFRESH_EXECUTOR  # pylint: disable=global-statement
+    with _REFRESH_LOCK:
+        if _REFRESH_EXECUTOR is None:
+            _REFRESH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix='tlru_cache_refresh')
+        return _REFRESH_EXECUTOR
+
+
+def _coarse_tick() -> None:
+    """Update the coarse clock until the interpreter exits."""
+    while True:
+        _COARSE_NOW[0] = time.monotonic()
+        time.sleep(_COARSE_RESOLUTION)
+
+
+def _coarse_now() -> float:
+    """Return the time of the last update of the coarse clock."""
+    return _COARSE_NOW[0]
+
+
+def _coarse_clock() -> Callable[[], float]:
+    """Return a monotonic clock that is only updated periodically.
+
+    Reading the clock only looks up a stored timestamp instead of
+    asking the operating system for the time. The timestamp is updated
+    every `_COARSE_RESOLUTION` seconds by a daemon thread, which is
+    started on first use.
+
+    """
+    global _COARSE_THREAD  # pylint: disable=global-statement
+    with _COARSE_LOCK:
+        if _COARSE_THREAD is None or not _COARSE_THREAD.is_alive():
+            _COARSE_NOW[0] = time.monotonic()
+            _COARSE_THREAD = threading.Thread(
+                target=_coarse_tick, name='tlru_cache_clock', daemon=True)
+            _COARSE_THREAD.start()
+    return _coarse_now
+
+
+def _restart_coarse_clock() -> None:
+    """Restart the coarse clock in a forked child, if it was running.
+
+    Only the forking thread survives a fork, so the clock would stop.
+
+    """
+    global _COARSE_LOCK, _COARSE_THREAD  # pylint: disable=global-statement
+    _COARSE_LOCK = threading.Lock()
+    if _COARSE_THREAD is not None:
+        _COARSE_THREAD = None
+        _ = _coarse_clock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_coarse_clock)
+
+
+def _retrieve_exception(task: 'asyncio.Future[Any]') -> None:
+    """Mark the exception of a background refresh task as retrieved."""
+    if not task.cancelled():
+        _ = task.exception()
+
+
+def _constant_lifetime(lifetime: Optional[float]
+                       ) -> Callable[..., Optional[float]]:
+    """Return a callable lifetime that is the same for every result.
+
+    :param lifetime: The lifetime of every result.
+    :type lifetime: Optional[float]
+
+    :return: A callable for the `lifetime` of a cache segment.
+    :rtype: Callable[..., Optional[float]]
+
+    """
+    def get_lifetime(args: Any, kwargs: Any, result: Any
+                     ) -> Optional[float]:
+        return lifetime
+    return get_lifetime
+
+
+def _check_options(maxsize: Optional[int], shards: int, policy: str,
+                   stale_ttl: Optional[float], refresh_ahead: Optional[float],
+                   maxbytes: Optional[int],
+                   clock: Union[Callable[[], float], str, None],
+                   shared: Union[str, 'os.PathLike[str]', None],
+                   autotune: Optional[Tuple[int, int]] = None,
+                   error_lifetime: Optional[float] = None) -> None:
+    """Validate the options of a cache.
+
+    :raises ValueError: If an option is invalid or not supported in
+        combination with the others.
+
+    """
+    if not isinstance(shards, int) or shards < 1:
+        raise ValueError('shards must be a positive integer')
+    if policy not in _POLICIES:
+        raise ValueError(
+            f'Unknown policy {policy!r}, expected one of {_POLICIES}')
+    if stale_ttl is not None and stale_ttl < 0:
+        raise ValueError('stale_ttl must not be negative')
+    if refresh_ahead is not None and refresh_ahead < 0:
+        raise ValueError('refresh_ahead must not be negative')
+    if maxbytes is not None and maxbytes < 0:
+        raise ValueError('maxbytes must not be negative')
+    if maxsize is None and policy in POLICIES:
+        # Unbounded caches never evict by count, and their byte limit
+        # only supports recency-based eviction
+        raise ValueError(f'The {policy!r} policy requires maxsize to be set')
+    if shared is not None and (policy != 'lru' or shards != 1):
+        raise ValueError('Shared caches only support the lru policy and a '
+                         'single shard')
+    if clock is not None and not callable(clock) and clock != 'coarse':
+        raise ValueError(
+            f"clock must be a callable or 'coarse', not {clock!r}")
+    if clock is not None and shared is not None:
+        raise ValueError('Shared caches always use the wall clock')
+    if autotune is not None:
+        try:
+            lowest, highest = autotune
+        except (TypeError, ValueError):
+            raise ValueError('autotune must be a pair of sizes') from None
+        if not 1 <= lowest <= highest:
+            raise ValueError('autotune bounds must be positive and ordered')
+        if policy != 'lru' or shared is not None:
+            raise ValueError('autotune only supports the lru policy of '
+                             'in-memory caches')
+    if error_lifetime is not None and error_lifetime < 0:
+        raise ValueError('error_lifetime must not be negative')
+    if error_lifetime is not None and shared is not None:
+        raise ValueError('Shared caches do not support error_lifetime')
+
+
+class TLRUCache:
+    """Thread-safe, time aware store of key-value pairs.
+
+    This is the storage behind :func:`tlru_cache`. It can be used on
+    its own as a bounded and timed mapping, or be passed to several
+    decorated functions as their `cache` argument, so that they share
+    one size and weight limit. All options have the same meaning as
+    for :func:`tlru_cache`; the `shared` database keeps several caches
+    apart by their `name`.
+
+    :meth:`get` counts hits and misses and marks items as used, while
+    :meth:`peek` and ``in`` do neither. If `lifetime` is a callable, it
+    is called as ``lifetime((key,), {}, value)`` by :meth:`set`.
+
+    :param maxsize: Number of elements to store, defaults to 128
+    :type maxsize: Optional[int], optional
+    :param lifetime: Maximum age of cache elements, or a callable
+        returning the maximum age of a value, defaults to 60.0
+    :type lifetime: Union[float, Callable[..., Optional[float]], None],
+        optional
+    :param shards: Number of cache segments, defaults to 1
+    :type shards: int, optional
+    :param policy: Eviction policy, defaults to ``'lru'``
+    :type policy: str, optional
+    :param stale_ttl: Grace period for expired values, defaults to None
+    :type stale_ttl: Optional[float], optional
+    :param refresh_ahead: Time before expiry at which decorated
+        functions refresh their result, defaults to None
+    :type refresh_ahead: Optional[float], optional
+    :param maxbytes: Maximum total weight of the values, defaults to
+        None
+    :type maxbytes: Optional[int], optional
+    :param weigher: Callable returning the weight of a value, defaults
+        to None (:func:`sys.getsizeof`)
+    :type weigher: Optional[Callable[[Any], int]], optional
+    :param clock: Callable returning the current time in seconds, or
+        ``'coarse'``, defaults to None (:func:`time.monotonic`)
+    :type clock: Union[Callable[[], float], str, None], optional
+    :param shared: Database file shared by several processes, defaults
+        to None
+    :type shared: Union[str, os.PathLike[str], None], optional
+    :param name: Name of the cache in the `shared` database, defaults
+        to ``''``
+    :type name: str, optional
+    :param instrument: Record histograms of miss latencies, lock waits
+        and hit ages, defaults to False
+    :type instrument: bool, optional
+    :param on_hit: Called with the key of every hit, defaults to None
+    :type on_hit: Optional[Callable[[Hashable], Any]], optional
+    :param on_miss: Called with the key of every miss, defaults to None
+    :type on_miss: Optional[Callable[[Hashable], Any]], optional
+    :param on_evict: Called with the key of every evicted item,
+        defaults to None
+    :type on_evict: Optional[Callable[[Hashable], Any]], optional
+    :param on_expire: Called with the key of every expired item that is
+        dropped, defaults to None
+    :type on_expire: Optional[Callable[[Hashable], Any]], optional
+    :param autotune: Smallest and largest `maxsize` to choose from the
+        estimated hit ratio, defaults to None (fixed `maxsize`)
+    :type autotune: Optional[Tuple[int, int]], optional
+    :param error_lifetime: Lifetime of the exceptions and negative
+        results that decorated functions cache, defaults to None (they
+        are not cached)
+    :type error_lifetime: Optional[float], optional
+
+    """
+
+    def __init__(self, maxsize: Optional[int] = 128,
+                 lifetime: _Lifetime = 60.0, *, shards: int = 1,
+                 policy: str = 'lru', stale_ttl: Optional[float] = None,
+                 refresh_ahead: Optional[float] = None,
+                 maxbytes: Optional[int] = None,
+                 weigher: Optional[Callable[[Any], int]] = None,
+                 clock: Union[Callable[[], float], str, None] = None,
+                 shared: Union[str, 'os.PathLike[str]', None] = None,
+                 name: str = '', instrument: bool = False,
+                 on_hit: Optional[Callable[[Hashable], Any]] = None,
+                 on_miss: Optional[Callable[[Hashable], Any]] = None,
+                 on_evict: Optional[Callable[[Hashable], Any]] = None,
+                 on_expire: Optional[Callable[[Hashable], Any]] = None,
+                 autotune: Optional[Tuple[int, int]] = None,
+                 error_lifetime: Optional[float] = None) -> None:
+        _check_options(maxsize, shards, policy, stale_ttl, refresh_ahead,
+                       maxbytes, clock, shared, autotune, error_lifetime)
+        if autotune is not None:
+            # maxsize is only the initial size
+            lowest, highest = autotune
+            maxsize = highest if maxsize is None else min(
+                max(maxsize, lowest), highest)
+            shards = min(shards, lowest)
+        # Clamp negative maxsize values to 0, which disables the cache
+        if maxsize is not None and maxsize < 0:
+            maxsize = 0
+        self.maxsize = maxsize
+        self.autotune = autotune
+        self.error_lifetime = error_lifetime
+        # Failures expire sooner than other results, so every item needs a
+        # lifetime of its own
+        segment_lifetime = lifetime
+        if error_lifetime is not None and not callable(lifetime):
+            # Negative lifetimes never expire, like in untimed segments
+            segment_lifetime = _constant_lifetime(
+                None if lifetime is None or lifetime < 0 else lifetime)
+        self.lifetime = lifetime
+        self.policy = policy
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.maxbytes = maxbytes
+        # Whether weights are tracked and reported
+        self.weighed = weigher is not None or maxbytes is not None
+
+        # Split the maximum size across the segments; no segment may be
+        # empty
+        if maxsize is None:
+            sizes: List[Optional[int]] = [None] * shards
+        else:
+            shards = max(min(shards, maxsize), 1)
+            sizes = [maxsize // shards + (i < maxsize % shards)
+                     for i in range(shards)]
+        if maxbytes is None:
+            byte_sizes: List[Optional[int]] = [None] * shards
+        else:
+            byte_sizes = [maxbytes // shards + (i < maxbytes % shards)
+                          for i in range(shards)]
+        self.segments: List[Any]
+        if shared is not None and maxsize != 0:
+            # Shared caches weigh the pickled values by default, which is
+            # both cheap and accurate
+            weigh_values = weigher is None and maxbytes is not None
+            self.segments = [_SharedSegment(
+                SharedStore(os.fspath(shared), name, maxsize, maxbytes),
+                segment_lifetime, stale_ttl or 0.0, refresh_ahead or 0.0,
+                weigh_values)]
+        else:
+            if weigher is None and maxbytes is not None:
+                weigher = sys.getsizeof
+            if clock == 'coarse':
+                # Untimed caches never read the clock, so they need no
+                # thread
+                timer = (time.monotonic if lifetime is None
+                         else _coarse_clock())
+            else:
+                timer = clock or time.monotonic  # type: ignore
+            self.segments = [
+                _TLRUSegment(size, segment_lifetime, policy,
+                             stale_ttl or 0.0, refresh_ahead or 0.0,
+                             byte_size, self.weighed, timer)
+                for size, byte_size in zip(sizes, byte_sizes)]
+        self.shards = len(self.segments)
+        self.shared = isinstance(self.segments[0], _SharedSegment)
+        # Called on every value unless None, which shared caches may be
+        # without weighing values
+        self.weigher = weigher
+        hooks = (on_hit, on_miss, on_evict, on_expire)
+        if instrument or hooks != (None,) * 4:
+            for segment in self.segments:
+                segment.events = _CacheEvents(hooks)
+                segment.lock = _InstrumentedLock(segment.events)
+        if autotune is not None:
+            lowest, highest = autotune
+            shards = self.shards
+            for i, segment in enumerate(self.segments):
+                segment.tuner = SizeTuner(
+                    lowest // shards + (i < lowest % shards),
+                    highest // shards + (i < highest % shards),
+                    segment.maxsize)
+
+    def _segment(self, key: Hashable) -> Any:
+        """Return the segment holding `key`.
+
+        :param key: The key of an item.
+        :type key: Hashable
+
+        :return: The segment the key is assigned to by its hash.
+        :rtype: Union[_TLRUSegment, _SharedSegment]
+
+        """
+        if self.shards == 1:
+            return self.segments[0]
+        return self.segments[hash(key) % self.shards]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for `key`, counting a hit or a miss.
+
+        :param key: The key to look up.
+        :type key: Hashable
+        :param default: Returned if `key` is not cached or expired,
+            defaults to None.
+        :type default: Any, optional
+
+        :return: The cached value or `default`.
+        :rtype: Any
+
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            value = segment.lookup(key)
+            if value is _MISSING:
+                segment.misses += 1
+                if segment.events is not None:
+                    segment.events.miss(key)
+                return default
+        return value
+
+    def set(self, key: Hashable, value: Any,
+            tags: Iterable[Hashable] = ()) -> None:
+        """Store a value, evicting other items if the cache is full.
+
+        A decorated function that is computing the value for `key` at
+        the same time keeps running for the callers waiting on it, but
+        does not store its result afterwards.
+
+        :param key: The key of the value.
+        :type key: Hashable
+        :param value: The value to store.
+        :type value: Any
+        :param tags: Tags for :meth:`invalidate_tag`, defaults to ().
+        :type tags: Iterable[Hashable], optional
+
+        :raises ValueError: If tags are given for a shared cache.
+
+        """
+        tags = tuple(tags)
+        if tags and self.shared:
+            raise ValueError('Shared caches do not support tags')
+        if self.maxsize == 0:
+            return
+        segment = self._segment(key)
+        lifetime = None
+        if segment.variable:
+            lifetime = segment.lifetime((key,), {}, value)
+        weight = self.weigher(value) if self.weigher is not None else 0
+        with segment.lock:
+            # Marks a running call as invalidated rather than releasing it
+            _ = segment.invalidate(key)
+            segment.set(key, value, lifetime, weight, tags)
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for `key` without counting or marking a use.
+
+        :param key: The key to look up.
+        :type key: Hashable
+        :param default: Returned if `key` is not cached or expired,
+            defaults to None.
+        :type default: Any, optional
+
+        :return: The cached value or `default`.
+        :rtype: Any
+
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            value = segment.peek(key)
+        return default if value is _MISSING else value
+
+    def pop(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """Remove the item for `key` and return its value.
+
+        :param key: The key to remove.
+        :type key: Hashable
+        :param default: Returned if `key` is not cached or expired,
+            defaults to raising a :class:`KeyError`.
+        :type default: Any, optional
+
+        :raises KeyError: If `key` is not cached and no `default` is
+            given.
+
+        :return: The cached value or `default`.
+        :rtype: Any
+
+        """
+        segment = self._segment(key)
+        with segment.lock:
+            value = segment.peek(key)
+            _ = segment.invalidate(key)
+        if value is not _MISSING:
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        count = 0
+        for segment in self.segments:
+            with segment.lock:
+                count += segment.currsize()
+        return count
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """Remove the items with the given tag.
+
+        This takes time proportional to the number of removed items.
+        Results of decorated functions that are being computed are not
+        stored if they turn out to have the tag.
+
+        :param tag: The tag of the items to remove.
+        :type tag: Hashable
+
+        :return: The number of items removed.
+        :rtype: int
+
+        """
+        count = 0
+        for segment in self.segments:
+            with segment.lock:
+                count += segment.invalidate_tag(tag)
+        return count
+
+    def clear(self) -> None:
+        """Remove all items and reset the statistics."""
+        for segment in self.segments:
+            with segment.lock:
+                segment.clear()
+
+    def close(self) -> None:
+        """Close the database connection of a shared cache.
+
+        A closed cache opens a new connection if it is used again. The
+        connection is also closed once the cache is garbage collected.
+        Caches in memory have nothing to close.
+
+        """
+        if self.shared:
+            for segment in self.segments:
+                with segment.lock:
+                    segment.storage.close()
+
+    def info(self) -> _TLRUCacheInfo:
+        """Report cache statistics.
+
+        :return: A named tuple containing cache statistics information.
+        :rtype: _TLRUCacheInfo
+
+        """
+        hits = misses = currsize = expired = stale = currbytes = 0
+        maxsize = errors = error_hits = 0
+        sizes = [] if self.autotune is None else curve_sizes(*self.autotune)
+        # Estimated hits and uses of the recent calls by cache size
+        estimates = dict.fromkeys(sizes, (0, 0))
+        shards = self.shards
+        for i, segment in enumerate(self.segments):
+            with segment.lock:
+                hits += segment.hits
+                misses += segment.misses
+                currsize += segment.currsize()
+                expired += segment.expired
+                stale += segment.stale
+                currbytes += segment.currbytes
+                errors += segment.errors
+                error_hits += segment.error_hits
+                if self.autotune is not None:
+                    maxsize += segment.maxsize
+                for size in sizes:
+                    # The share of this segment in a cache of this size
+                    share_hits, share_uses = segment.tuner.estimate(
+                        size // shards + (i < size % shards))
+                    total_hits, total_uses = estimates[size]
+                    estimates[size] = (total_hits + share_hits,
+                                       total_uses + share_uses)
+        hit_curve = None
+        if self.autotune is not None:
+            hit_curve = {size: size_hits / uses if uses else 0.0
+                         for size, (size_hits, uses) in estimates.items()}
+        return _TLRUCacheInfo(
+            hits, misses, self.maxsize if hit_curve is None else maxsize,
+            currsize, self.lifetime, expired, stale, self.policy,
+            self.maxbytes, currbytes if self.weighed else None, hit_curve,
+            errors, error_hits)
+
+    def stats(self) -> _TLRUCacheStats:
+        """Report eviction counts and instrumentation histograms.
+
+        Histograms are empty unless the cache is instrumented.
+
+        :return: A named tuple containing the instrumentation data.
+        :rtype: _TLRUCacheStats
+
+        """
+        stats = []
+        for segment in self.segments:
+            with segment.lock:
+                events = segment.events
+                if events is None:
+                    stats.append(_TLRUCacheStats(segment.evicted, {}, {}, {}))
+                else:
+                    stats.append(_TLRUCacheStats(
+                        segment.evicted, dict(events.miss_latency),
+                        dict(events.lock_wait), dict(events.hit_age)))
+        return _merge_stats(stats)
+
+
 def _tlru_cache_wrapper(user_function: Callable[..., _T],
-                        maxsize: Optional[int], lifetime: Optional[float],
-                        typed: bool) -> Callable[..., _T]:
+                        maxsize: Optional[int], lifetime: _Lifetime,
+                        typed: bool, shards: int = 1, policy: str = 'lru',
+                        stale_ttl: Optional[float] = None,
+                        refresh_ahead: Optional[float] = None,
+                        maxbytes: Optional[int] = None,
+                        weigher: Optional[Callable[[Any], int]] = None,
+                        snapshot: Union[str, 'os.PathLike[str]', None] = None,
+                        shared: Union[str, 'os.PathLike[str]', None] = None,
+                        clock: Union[Callable[[], float], str, None] = None,
+                        hooks: Optional[Tuple[Optional[Callable[[Hashable],
+                                                               Any]],
+                                              ...]] = None,
+                        tags: Optional[_Tagger] = None,
+                        cache: Optional[TLRUCache] = None,
+                        autotune: Optional[Tuple[int, int]] = None,
+                        error_lifetime: Optional[float] = None,
+                        negative: Optional[Callable[[Any], bool]] = None
+                        ) -> Callable[..., _T]:
     """Internal cache wrapper.
 
-    This function implements the TLRU cache in its scope and returns a
-    function wrapping the original `user_function`.
+    This function sets up a :class:`TLRUCache`, unless one is given,
+    and returns a function wrapping the original `user_function` that
+    works directly on the segments of the cache.
 
     :param user_function: The function to cache.
     :type user_function: Callable[..., _T]
     :param maxsize: Maximum number of elements in the cache.
     :type maxsize: Optional[int]
-    :param lifetime: Seconds after which elements will become invalid.
-    :type lifetime: Optional[float]
+    :param lifetime: Seconds after which elements will become invalid,
+        or a callable returning the lifetime of each result.
+    :type lifetime: _Lifetime
     :param typed: Whether to use check argument type as well as value.
     :type typed: bool
+    :param shards: Number of independently locked cache segments,
+        defaults to 1.
+    :type shards: int, optional
+    :param policy: The eviction policy, defaults to ``'lru'``.
+    :type policy: str, optional
+    :param stale_ttl: Seconds during which expired results are returned
+        while being refreshed in the background, defaults to None.
+    :type stale_ttl: Optional[float], optional
+    :param refresh_ahead: Seconds before expiry during which a hit
+        refreshes the result in the background, defaults to None.
+    :type refresh_ahead: Optional[float], optional
+    :param maxbytes: Maximum total weight of the cached results,
+        defaults to None (no limit).
+    :type maxbytes: Optional[int], optional
+    :param weigher: Callable returning the weight of a result, defaults
+        to None (:func:`sys.getsizeof` if `maxbytes` is set, otherwise
+        weights are not tracked).
+    :type weigher: Optional[Callable[[Any], int]], optional
+    :param snapshot: Snapshot file to load into the cache if it exists,
+        defaults to None.
+    :type snapshot: Union[str, os.PathLike[str], None], optional
+    :param shared: Database file in which to store the cache, so that it
+        is shared by all processes using the same file, defaults to
+        None.
+    :type shared: Union[str, os.PathLike[str], None], optional
+    :param clock: The clock expiry times are based on, or ``'coarse'``
+        for :func:`_coarse_clock`, defaults to None
+        (:func:`time.monotonic`).
+    :type clock: Union[Callable[[], float], str, None], optional
+    :param hooks: The hooks called on a hit, miss, eviction and expiry
+        of an item, each of them optional, or None to disable the
+        instrumentation, defaults to None.
+    :type hooks: Optional[Tuple[Optional[Callable[[Hashable], Any]],
+        ...]], optional
+    :param tags: Callable returning the tags of a result, defaults to
+        None (results are not tagged).
+    :type tags: Optional[Callable[..., Iterable[Hashable]]], optional
+    :param cache: The cache to store results in, which other functions
+        may share, defaults to None (create a cache from the other
+        arguments).
+    :type cache: Optional[TLRUCache], optional
+    :param autotune: Smallest and largest `maxsize` to choose from the
+        estimated hit ratio, defaults to None (fixed `maxsize`).
+    :type autotune: Optional[Tuple[int, int]], optional
+    :param error_lifetime: Seconds for which exceptions and negative
+        results are cached, defaults to None (they are not cached).
+    :type error_lifetime: Optional[float], optional
+    :param negative: Callable returning whether a result is negative,
+        defaults to None (no result is).
+    :type negative: Optional[Callable[[Any], bool]], optional
 
     :return: A caching wrapper function for the given `user_function`.
     :rtype: Callable[..., _T]
 
     """
-    cache: 'collections.OrderedDict[Hashable, Tuple[Hashable, float]]' = (
-        collections.OrderedDict())
+    # Identifies the function and thereby the format of its keys in
+    # snapshot files and shared databases, so that caches of different
+    # functions are kept apart
+    try:
+        signature = str(inspect.signature(
+            user_function, follow_wrapped=False))
+    except (TypeError, ValueError):
+        signature = '(...)'
+    name = '{}.{}{}{}'.format(
+        getattr(user_function, '__module__', None),
+        getattr(user_function, '__qualname__', type(user_function).__name__),
+        signature, ' (typed)' if typed else '')
+
+    # Functions sharing a cache prefix their keys with a marker of their
+    # own, so that they cannot collide. Keys of shared caches are compared
+    # by their pickle, so they need a marker that pickles to the same
+    # bytes in every process, but not for every function
+    separate = cache is not None
+    if cache is None:
+        on_hit, on_miss, on_evict, on_expire = hooks or (None,) * 4
+        cache = TLRUCache(
+            maxsize, lifetime, shards=shards, policy=policy,
+            stale_ttl=stale_ttl, refresh_ahead=refresh_ahead,
+            maxbytes=maxbytes, weigher=weigher, clock=clock, shared=shared,
+            name=name, instrument=hooks is not None, on_hit=on_hit,
+            on_miss=on_miss, on_evict=on_evict, on_expire=on_expire,
+            autotune=autotune, error_lifetime=error_lifetime)
+    maxsize = cache.maxsize
+    lifetime = cache.lifetime
+    segments = cache.segments
+    shards = cache.shards
+    first = segments[0]
+    # Whether to call the weigher, which shared caches may do without
+    weigh_results = cache.weigher is not None
+    weigh: Callable[[Any], int] = cache.weigher  # type: ignore
+    variable = first.variable
+    # Whether hits may have to refresh their result in the background
+    revalidate = first.timed and bool(cache.stale_ttl or cache.refresh_ahead)
+    get_ttl: Callable[..., Optional[float]] = first.lifetime
+    # Whether exceptions and negative results are cached
+    error_lifetime = cache.error_lifetime
+    failures = error_lifetime is not None
+    tagged = tags is not None
+    get_tags: _Tagger = tags  # type: ignore
+    make_key = _make_key_builder(user_function, typed)
+    if separate:
+        make_function_key = make_key
+        namespace: Hashable = name if cache.shared else object()
+
+        def make_separate_key(args: Tuple[Any, ...],
+                              kwargs: Dict[str, Any]) -> Hashable:
+            return namespace, make_function_key(args, kwargs)
+
+        make_key = make_separate_key
+
+    def describe(args: Any, kwargs: Any, result: Any
+                 ) -> Tuple[Any, Optional[float], int, Iterable[Hashable]]:
+        """Return the item, lifetime, weight and tags to store."""
+        if negative is not None and negative(result):
+            return _CachedFailure(None, result), error_lifetime, 0, ()
+        return (result, get_ttl(args, kwargs, result) if variable else None,
+                weigh(result) if weigh_results else 0,
+                get_tags(args, kwargs, result) if tagged else ())
+
+    def fail(segment: _TLRUSegment, key: Hashable, call: Any,
+             err: BaseException, returned: bool) -> None:
+        """Cache the exception of a call if enabled, else release it.
+
+        Only exceptions raised by the user function itself are cached,
+        not those of the weigher or other callbacks run after it
+        `returned`, and not exceptions like :class:`KeyboardInterrupt`.
 
-    # Sentinel value used for dict access fallback
-    sentinel = object()
-    default = sentinel, 0.0
+        """
+        with segment.lock:
+            if failures and not returned and isinstance(err, Exception):
+                # Callers get the same exception until it expires
+                segment.errors += 1
+                segment.store(key, call, _CachedFailure(err), error_lifetime)
+            else:
+                segment.discard(key, call)
+
+    def unwrap(segment: _TLRUSegment, result: Any) -> Any:
+        """Return a cached result, raising cached exceptions."""
+        if type(result) is _CachedFailure:
+            # NOTE: This may run without the lock, like lock-free hits
+            segment.error_hits += 1
+            return result.unwrap()
+        return result
+
+    def compute(segment: _TLRUSegment, key: Hashable, call: _PendingCall,
+                args: Any, kwargs: Any) -> _T:
+        """Run the user function outside of the lock and store its result.
+
+        Any other callers for the same `key` wait on `call` rather than
+        running the user function themselves.
 
-    # Set up statistics
-    hits = misses = expired = 0
+        """
+        start = time.perf_counter()
+        returned = False
+        try:
+            result = user_function(*args, **kwargs)
+            returned = True
+            item = describe(args, kwargs, result)
+        except BaseException as err:
+            fail(segment, key, call, err, returned)
+            call.set_error(err)
+            raise
+        with segment.lock:
+            if segment.events is not None:
+                _record(segment.events.miss_latency,
+                        time.perf_counter() - start)
+            if type(item[0]) is _CachedFailure:
+                segment.errors += 1
+            segment.store(key, call, *item)
+        call.set_result(result)
+        return result
+
+    coroutine = inspect.iscoroutinefunction(user_function)
+
+    if coroutine:
+
+        async def compute_async(segment: _TLRUSegment, key: Hashable,
+                                args: Any, kwargs: Any) -> Any:
+            """Await the user function and store its result.
+
+            This runs as its own task, which is registered as the pending
+            call for `key` and awaited by all callers of that key.
+
+            """
+            task = asyncio.current_task()
+            start = time.perf_counter()
+            returned = False
+            try:
+                result = await user_function(*args, **kwargs)
+                returned = True
+                item = describe(args, kwargs, result)
+            except BaseException as err:
+                fail(segment, key, task, err, returned)
+                raise
+            with segment.lock:
+                if segment.events is not None:
+                    _record(segment.events.miss_latency,
+                            time.perf_counter() - start)
+                if type(item[0]) is _CachedFailure:
+                    segment.errors += 1
+                segment.store(key, task, *item)
+            return result
 
-    # Create local names for common cache methods
-    cache_get = cache.get
-    cache_len = cache.__len__
-    cache_move = cache.move_to_end
-    t_now = time.time
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            """Cache for coroutine functions.
+
+            The lock is only held for dictionary access and never across
+            an ``await``, so it does not block the event loop.
+
+            """
+            if maxsize == 0:
+                first.misses += 1
+                return await user_function(*args, **kwargs)
+            key = make_key(args, kwargs)
+            segment = first if shards == 1 else segments[hash(key) % shards]
+            with segment.lock:
+                result = segment.lookup(key)
+                if result is not _MISSING:
+                    if revalidate and segment.due(key):
+                        # Refresh the result in the background
+                        task = segment.pending[key] = asyncio.ensure_future(
+                            compute_async(segment, key, args, kwargs))
+                        task.add_done_callback(_retrieve_exception)
+                    return unwrap(segment, result) if failures else result
+                task = segment.pending.get(key)
+                if task is None:
+                    segment.misses += 1
+                    if segment.events is not None:
+                        segment.events.miss(key)
+                    task = segment.pending[key] = asyncio.ensure_future(
+                        compute_async(segment, key, args, kwargs))
+                else:
+                    segment.hits += 1
+            # Shielding the task keeps a cancelled caller from cancelling
+            # the computation for any other callers waiting on it
+            return await asyncio.shield(task)
+
+    elif maxsize == 0:
+
+        def wrapper(*args: Any, **kwargs: Any) -> _T:  # type: ignore
+            """No caching, only update access statistics."""
+            first.misses += 1
+            return user_function(*args, **kwargs)
 
-    lock = threading.Lock()
+    else:
 
-    if maxsize == 0:
+        def call_locked(segment: _TLRUSegment, key: Hashable,
+                        args: Any, kwargs: Any) -> _T:
+            """Look up `key` under the segment lock and handle misses."""
+            with segment.lock:
+                result = segment.lookup(key)
+                if result is not _MISSING:
+                    if not revalidate or not segment.due(key):
+                        if failures:
+                            return unwrap(segment, result)  # type: ignore
+                        return result  # type: ignore
+                    segment.pending[key] = call = _PendingCall()
+                else:
+                    call = segment.pending.get(key)
+                    if call is None:
+                        segment.misses += 1
+                        if segment.events is not None:
+                            segment.events.miss(key)
+                        segment.pending[key] = new_call = _PendingCall()
+                    else:
+                        segment.hits += 1
+            if result is not _MISSING:
+                # Return the current result and refresh it in the background
+                _ = _refresh_executor().submit(
+                    compute, segment, key, call, args, kwargs)
+                if failures:
+                    return unwrap(segment, result)  # type: ignore
+                return result  # type: ignore
+            if call is not None:
+                return call.wait()  # type: ignore
+            return compute(segment, key, new_call, args, kwargs)
+
+        # Hits need no lock if they do not reorder the cache, which is the
+        # case for unbounded caches and with the CLOCK policy, and if they
+        # do not have to check whether to refresh the result
+        if ((not first.bounded or cache.policy == 'clock')
+                and not revalidate and first.events is None):
+            clock = first.clock
+            timed = first.timed
+            t_now = first.timer
+
+            def wrapper(*args: Any, **kwargs: Any) -> _T:  # type: ignore
+                """TLRU cache with lock-free hits."""
+                key = make_key(args, kwargs)
+                segment = (first if shards == 1
+                           else segments[hash(key) % shards])
+                if timed:
+                    result, expires = segment.cache.get(key, _DEFAULT)
+                    if t_now() > expires:
+                        result = _MISSING
+                else:
+                    result = segment.cache.get(key, _MISSING)
+                if result is not _MISSING:
+                    # NOTE: Without the lock, concurrent hits may overwrite
+                    # each other's increment. Hit counts are approximate.
+                    segment.hits += 1
+                    if clock:
+                        segment.referenced.add(key)
+                    if failures:
+                        return unwrap(segment, result)  # type: ignore
+                    return result  # type: ignore
+                # Expired results are handled by the locked path
+                return call_locked(segment, key, args, kwargs)
+
+        elif (cache.policy == 'lru' and shards == 1 and not cache.shared
+              and not revalidate and first.events is None
+              and first.tuner is None):
+            # The lock and lookup of the single segment are bound up front,
+            # and hits return without the miss handling of call_locked()
+            lock = first.lock
+            lookup = first.lookup
+
+            def wrapper(*args: Any, **kwargs: Any) -> _T:  # type: ignore
+                """TLRU cache of a single LRU segment with fast hits."""
+                key = make_key(args, kwargs)
+                with lock:
+                    result = lookup(key)
+                if result is not _MISSING:
+                    if failures:
+                        return unwrap(first, result)  # type: ignore
+                    return result  # type: ignore
+                # Expired results were dropped by the lookup
+                return call_locked(first, key, args, kwargs)
 
-        def wrapper(*args: Any, **kwargs: Any) -> _T:
-            """No caching, only update access statistics."""
-            nonlocal misses
-            misses += 1
-            return user_function(*args, **kwargs)
+        else:
 
-    # Infinite cache size
-    elif maxsize is None:
+            def wrapper(*args: Any, **kwargs: Any) -> _T:  # type: ignore
+                """TLRU cache with locked hits for strict LRU ordering."""
+                key = make_key(args, kwargs)
+                return call_locked(
+                    first if shards == 1 else segments[hash(key) % shards],
+                    key, args, kwargs)
 
-        # TODO: Add time only constraint
+    def cache_invalidate(*args: Any, **kwargs: Any) -> bool:
+        """Remove the cached result of a call, if any.
 
-        def wrapper(*args: Any, **kwargs: Any) -> _T:
-            """Simple caching with no size or time constraint."""
-            nonlocal hits, misses
-            with lock:
-                key = _make_key(args, kwargs, typed)
-                result, _ = cache_get(key, default)
-                if result is not sentinel:
-                    hits += 1
-                    return result  # type: ignore
-                misses += 1
-                result = user_function(*args, **kwargs)
-                cache[key] = result, 0.0  # Time data not needed/used
-            return result
+        A call with the same arguments that is currently running still
+        returns its result to its callers, but the result is not cached.
 
-    elif lifetime is None or lifetime < 0:
+        :return: Whether a result was removed.
+        :rtype: bool
 
-        def wrapper(*args: Any, **kwargs: Any) -> _T:
-            """Basic LRU cache."""
-            nonlocal hits, misses
-            key = _make_key(args, kwargs, typed)
-            with lock:
-                result, _ = cache_get(key, default)
-                if result is not sentinel:
+        """
+        key = make_key(args, kwargs)
+        segment = first if shards == 1 else segments[hash(key) % shards]
+        with segment.lock:
+            return segment.invalidate(key)
+
+    def cache_get_many(calls: Iterable[Iterable[Any]],
+                       loader: Optional[Callable[[List[Tuple[Any, ...]]],
+                                                 Iterable[Any]]] = None
+                       ) -> List[Any]:
+        """Return the results of many calls, computing misses at once.
+
+        Hits are looked up with a single lock acquisition per segment.
+        The arguments of all misses are then passed to `loader` in one
+        call, so that it can fetch their results together, e.g. with a
+        single database query. Calls with the same arguments that are
+        already being computed elsewhere are waited for instead.
+
+        :param calls: The positional arguments of every call.
+        :type calls: Iterable[Iterable[Any]]
+        :param loader: Callable taking a list of argument tuples and
+            returning their results in the same order, defaults to None
+            (call the cached function for every miss).
+        :type loader: Optional[Callable[[List[Tuple[Any, ...]]],
+            Iterable[Any]]], optional
+
+        :raises TypeError: If the cached function is a coroutine
+            function.
+        :raises ValueError: If `loader` returns the wrong number of
+            results.
+
+        :return: The results of the calls, in order.
+        :rtype: List[Any]
 
-                    hits += 1
-                    cache_move(key, last=True)
-                    return result  # type: ignore
+        """
+        if coroutine:
+            raise TypeError(
+                'cache_get_many() does not support coroutine functions')
+        arguments = [tuple(args) for args in calls]
+        if loader is None:
+            def loader(missing: List[Tuple[Any, ...]]) -> List[Any]:
+                return [user_function(*args) for args in missing]
+        if maxsize == 0:
+            first.misses += len(arguments)
+            return list(loader(arguments))
+        keys = [make_key(args, {}) for args in arguments]
+        results: List[Any] = [_MISSING] * len(keys)
+        # Positions of the calls in every segment
+        positions: Dict[int, List[int]] = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(
+                0 if shards == 1 else hash(key) % shards, []).append(i)
+        # Calls this batch has to compute, and calls computed elsewhere
+        own: Dict[Hashable, Tuple[Any, _PendingCall, Tuple[Any, ...]]] = {}
+        waiting: Dict[Hashable, _PendingCall] = {}
+        refresh = []
+        for index, indexes in positions.items():
+            segment = segments[index]
+            with segment.lock:
+                now = segment.timer()
+                for i in indexes:
+                    key = keys[i]
+                    if key in own or key in waiting:
+                        segment.hits += 1
+                        continue
+                    result = segment.lookup(key, now)
+                    if result is not _MISSING:
+                        results[i] = result
+                        if failures and type(result) is _CachedFailure:
+                            segment.error_hits += 1
+                        if revalidate and segment.due(key):
+                            segment.pending[key] = call = _PendingCall()
+                            refresh.append((segment, key, call, arguments[i]))
+                        continue
+                    call = segment.pending.get(key)
+                    if call is None:
+                        segment.misses += 1
+                        if segment.events is not None:
+                            segment.events.miss(key)
+                        segment.pending[key] = call = _PendingCall()
+                        own[key] = (segment, call, arguments[i])
+                    else:
+                        segment.hits += 1
+                        waiting[key] = call
+        for segment, key, call, args in refresh:
+            _ = _refresh_executor().submit(
+                compute, segment, key, call, args, {})
+        computed: Dict[Hashable, Any] = {}
+        if own:
+            missing = [args for _, _, args in own.values()]
+            try:
+                loaded = list(loader(missing))
+                if len(loaded) != len(missing):
+                    raise ValueError(f'loader returned {len(loaded)} results '
+                                     f'for {len(missing)} calls')
+                described = [describe(args, {}, result)
+                             for args, result in zip(missing, loaded)]
+            except BaseException as err:
+                for key, (segment, call, _) in own.items():
+                    with segment.lock:
+                        segment.discard(key, call)
+                    call.set_error(err)
+                raise
+            # Store the results with one lock acquisition per segment
+            stores: Dict[Any, List[Any]] = {}
+            for (key, (segment, call, _)), result, item in zip(
+                    own.items(), loaded, described):
+                stores.setdefault(segment, []).append(
+                    (key, call, result, item))
+            for segment, batch in stores.items():
+                with segment.lock:
+                    for key, call, _, item in batch:
+                        if type(item[0]) is _CachedFailure:
+                            segment.errors += 1
+                        segment.store(key, call, *item)
+                for key, call, result, _ in batch:
+                    call.set_result(result)
+                    computed[key] = result
+        for i, key in enumerate(keys):
+            result = results[i]
+            if result is _MISSING:
+                results[i] = (computed[key] if key in computed
+                              else waiting[key].wait())
+            elif type(result) is _CachedFailure:
+                # Raises cached exceptions like a call would
+                results[i] = result.unwrap()
+        return results
+
+    def cache_dump(path: Union[str, 'os.PathLike[str]']) -> int:
+        """Write the unexpired cache items to a snapshot file.
+
+        Items are written with their remaining lifetime, one pickle at a
+        time, to a uniquely named temporary file that then replaces
+        `path`, so that concurrent dumps never publish a mix of both. Cached
+        exceptions and negative results are left out.
+
+        :param path: The file to write.
+        :type path: Union[str, os.PathLike[str]]
+
+        :raises TypeError: If the cache is shared by several functions.
+
+        :return: The number of items written.
+        :rtype: int
 
-                if maxsize is not None and cache_len() >= maxsize:
-                    _ = cache.popitem(last=False)
+        """
+        if separate:
+            raise TypeError('cache_dump() does not support caches shared by '
+                            'several functions')
+        now = first.timer()
+        items: List[_SnapshotItem] = []
+        for segment in segments:
+            with segment.lock:
+                items += segment.items(now)
+        if failures:
+            # Failures are short-lived, and exceptions with a traceback
+            # cannot be pickled
+            items = [item for item in items
+                     if type(item[1]) is not _CachedFailure]
+        # Unlike the clock of the cache, wall clock time is comparable
+        # after a restart or on another host
+        written = time.time()
+        path = os.fspath(path)
+        # A temporary file of its own, since several processes may write
+        # the same snapshot at once
+        descriptor, temp = tempfile.mkstemp(
+            prefix=f'{os.path.basename(path)}.',
+            dir=os.path.dirname(path) or '.')
+        try:
+            with open(descriptor, 'wb') as file:
+                pickle.dump((_SNAPSHOT_FORMAT, name, written), file,
+                            pickle.HIGHEST_PROTOCOL)
+                for item in items:
+                    pickle.dump(item, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return len(items)
+
+    def load(path: Union[str, 'os.PathLike[str]'], strict: bool) -> int:
+        """Add the unexpired items of a snapshot file to the cache.
+
+        If `strict` is False, snapshots of other functions are ignored
+        instead of raising a :class:`ValueError`.
 
-                misses += 1
+        """
+        if maxsize == 0:
+            return 0
+        count = 0
+        with open(path, 'rb') as file:
+            header = pickle.load(file)
+            if not isinstance(header, tuple) or header[:2] != (
+                    _SNAPSHOT_FORMAT, name):
+                if strict:
+                    raise ValueError(f'{path!r} is not a snapshot of {name}')
+                return 0
+            elapsed = time.time() - header[2]
+            # Items are read one at a time, so the file never has to fit
+            # into memory next to the cache
+            while True:
+                try:
+                    key, result, remaining, tags = pickle.load(file)
+                except EOFError:
+                    break
+                if remaining is not None:
+                    remaining -= elapsed
+                    if remaining <= 0:
+                        continue
+                now = first.timer()
+                if variable:
+                    expires = _NEVER if remaining is None else now + remaining
+                elif first.timed:
+                    # Items never live longer than the current lifetime
+                    ttl: float = lifetime  # type: ignore
+                    if remaining is not None:
+                        ttl = min(remaining, ttl)
+                    expires = now + ttl
+                else:
+                    expires = 0.0
+                weight = weigh(result) if weigh_results else 0
+                segment = (first if shards == 1
+                           else segments[hash(key) % shards])
+                with segment.lock:
+                    count += segment.restore(
+                        key, result, expires, weight, tags)
+        for segment in segments:
+            with segment.lock:
+                segment.sort_expiry()
+        return count
+
+    def cache_load(path: Union[str, 'os.PathLike[str]']) -> int:
+        """Add the unexpired items of a snapshot file to the cache.
+
+        Items that are already cached are kept. Only load snapshots
+        from trusted sources, since loading them runs :mod:`pickle`.
+
+        :param path: The file to read.
+        :type path: Union[str, os.PathLike[str]]
+
+        :raises ValueError: If the file is a snapshot of another
+            function.
+        :raises TypeError: If the cache is shared by several functions.
+
+        :return: The number of items added.
+        :rtype: int
 
-                result = user_function(*args, **kwargs)
-                cache[key] = result, 0.0  # Time data not needed/used
-            return result
+        """
+        if separate:
+            raise TypeError('cache_load() does not support caches shared by '
+                            'several functions')
+        return load(path, True)
+
+    if snapshot is not None:
+        # Warm starts are best-effort; a missing or damaged snapshot, e.g.
+        # one left behind by a crash, must not keep the program from starting
+        try:
+            _ = load(snapshot, False)
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError,
+                ImportError) as err:
+            cache.clear()
+            warnings.warn(f'Ignoring the damaged snapshot {snapshot!r}: '
+                          f'{err!r}', RuntimeWarning, stacklevel=3)
+
+    wrapper.cache_info = cache.info  # type: ignore
+    wrapper.cache_clear = cache.clear  # type: ignore
+    wrapper.cache_close = cache.close  # type: ignore
+    wrapper.cache_invalidate = cache_invalidate  # type: ignore
+    wrapper.cache_invalidate_tag = cache.invalidate_tag  # type: ignore
+    wrapper.cache_stats = cache.stats  # type: ignore
+    wrapper.cache_get_many = cache_get_many  # type: ignore
+    wrapper.cache_dump = cache_dump  # type: ignore
+    wrapper.cache_load = cache_load  # type: ignore
+    return wrapper
 
-    else:
 
-        def wrapper(*args: Any, **kwargs: Any) -> _T:
-            """Timed LRU cache.."""
-            nonlocal hits, misses, expired
-            key = _make_key(args, kwargs, typed)
-            with lock:
-                result, time_added = cache_get(key, default)
-                now = t_now()
-                if result is not sentinel:
-
-                    if now - time_added <= lifetime:  # type: ignore
-                        hits += 1
-                        cache_move(key, last=True)
-                        return result  # type: ignore
+class _TLRUCachedMethod:
+    """Descriptor giving every instance its own cache of a method.
 
-                    # Result is out of date - update
-                    _ = cache.pop(key)
-                    expired += 1
-                elif maxsize is not None and cache_len() >= maxsize:
-                    _ = cache.popitem(last=False)
+    The cache of an instance is created on first access and kept by the
+    descriptor, keyed by the identity of the instance, rather than in
+    the instance itself, so that copies and pickles of the instance do
+    not carry it along. Caches only refer to their instance weakly and
+    are dropped along with it, so instances are freed as soon as they
+    are no longer used, along with their cached results. ``self`` is not
+    part of the key, and every instance has its own locks.
 
-                misses += 1
+    :param method: The method to cache, taking the instance as its
+        first argument.
+    :type method: Callable[..., Any]
+    :param options: Keyword arguments for :func:`_tlru_cache_wrapper`.
+    :type options: Dict[str, Any]
 
-                result = user_function(*args, **kwargs)
-                cache[key] = result, now  # Time data not needed/used
-            return result
+    """
 
-    def cache_info() -> _TLRUCacheInfo:
-        """Report cache statistics.
+    def __init__(self, method: Callable[..., Any],
+                 options: Dict[str, Any]) -> None:
+        self.method = method
+        self.options = options
+        self.name = method.__name__
+        self.lock = threading.Lock()
+        # Weak reference to every live instance and its cache, by the id
+        # of the instance. Instances are not used as keys themselves, since
+        # equal instances still need caches of their own.
+        self.caches: Dict[int, Tuple['weakref.ref[Any]', Any]] = {}
+        try:
+            signature = inspect.signature(method, follow_wrapped=False)
+        except (TypeError, ValueError):
+            self.signature = None
+        else:
+            # Keys are built from the arguments following self
+            self.signature = signature.replace(
+                parameters=list(signature.parameters.values())[1:])
+        functools.update_wrapper(self, method)
+
+    def __set_name__(self, owner: Type[Any], name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: Any, owner: Optional[Type[Any]] = None
+                ) -> Any:
+        if instance is None:
+            return self
+        entry = self.caches.get(id(instance))
+        if entry is not None and entry[0]() is instance:
+            return entry[1]
+        with self.lock:
+            entry = self.caches.get(id(instance))
+            if entry is not None and entry[0]() is instance:
+                return entry[1]
+            return self._bind(instance)
+
+    def _bind(self, instance: Any) -> Any:
+        """Create the cache of a single instance."""
+        method = self.method
+        caches = self.caches
+        key = id(instance)
+
+        def forget(ref: 'weakref.ref[Any]') -> None:
+            # Runs when the instance is freed, possibly by the garbage
+            # collector while this thread holds the lock, so it must not
+            # take it
+            entry = caches.get(key)
+            if entry is not None and entry[0] is ref:
+                caches.pop(key, None)
+
+        try:
+            ref = weakref.ref(instance, forget)
+        except TypeError:
+            raise TypeError(
+                f'Cannot cache {self.name!r} per instance, since '
+                f'{type(instance).__name__!r} objects do not support weak '
+                'references') from None
+        if inspect.iscoroutinefunction(method):
+
+            async def bound_async(*args: Any, **kwargs: Any) -> Any:
+                return await method(ref(), *args, **kwargs)
+
+            bound: Callable[..., Any] = bound_async
+        else:
+
+            def bound(*args: Any, **kwargs: Any) -> Any:
+                return method(ref(), *args, **kwargs)
+
+        functools.update_wrapper(bound, method)
+        if self.signature is not None:
+            bound.__signature__ = self.signature  # type: ignore
+        wrapper = _tlru_cache_wrapper(bound, **self.options)
+        wrapper = functools.update_wrapper(wrapper, method)
+        caches[key] = ref, wrapper
+        return wrapper
+
+    def _caches(self) -> List[Any]:
+        """Return the caches of all live instances."""
+        with self.lock:
+            return [cache for _, cache in list(self.caches.values())]
+
+    def __call__(self, instance: Any, *args: Any, **kwargs: Any) -> Any:
+        return self.__get__(instance)(*args, **kwargs)
+
+    def cache_info(self) -> _TLRUCacheInfo:
+        """Report the combined statistics of all instance caches.
 
         :return: A named tuple containing cache statistics information.
+            The ``maxsize`` and ``maxbytes`` fields apply to every
+            instance separately.
         :rtype: _TLRUCacheInfo
 
         """
-        with lock:
-            for key in list(cache):
-                if lifetime is not None and t_now() - cache[key][1] > lifetime:
-                    _ = cache.pop(key)
-            return _TLRUCacheInfo(
-                hits, misses, maxsize, cache_len(), lifetime, expired)
+        caches = self._caches()
+        infos = [cache.cache_info() for cache in caches]
+        options = self.options
+        weighed = (options['weigher'] is not None
+                   or options['maxbytes'] is not None)
+        return _TLRUCacheInfo(
+            sum(info.hits for info in infos),
+            sum(info.misses for info in infos),
+            options['maxsize'],
+            sum(info.currsize for info in infos),
+            options['lifetime'],
+            sum(info.expired for info in infos),
+            sum(info.stale for info in infos),
+            options['policy'],
+            options['maxbytes'],
+            sum(info.currbytes or 0 for info in infos) if weighed else None,
+            None,
+            sum(info.errors for info in infos),
+            sum(info.error_hits for info in infos))
 
-    def cache_clear() -> None:
-        """Clear the cache and reset cache statistics."""
-        nonlocal hits, misses, expired
-        with lock:
-            cache.clear()
-            hits = misses = expired = 0
+    def cache_clear(self) -> None:
+        """Clear the caches and statistics of all instances."""
+        caches = self._caches()
+        for cache in caches:
+            cache.cache_clear()
 
-    wrapper.cache_info = cache_info  # type: ignore
-    wrapper.cache_clear = cache_clear  # type: ignore
-    return wrapper
+    def cache_invalidate_tag(self, tag: Hashable) -> int:
+        """Remove the results with the given tag from all instances.
+
+        :param tag: The tag of the results to remove.
+        :type tag: Hashable
+
+        :return: The number of results removed.
+        :rtype: int
+
+        """
+        caches = self._caches()
+        return sum(cache.cache_invalidate_tag(tag) for cache in caches)
+
+    def cache_stats(self) -> _TLRUCacheStats:
+        """Report the combined instrumentation of all instance caches.
+
+        :return: A named tuple containing the instrumentation data.
+        :rtype: _TLRUCacheStats
+
+        """
+        caches = self._caches()
+        return _merge_stats(cache.cache_stats() for cache in caches)
 
 
 @overload
@@ -295,7 +3097,26 @@ def tlru_cache(user_function: Callable[..., _T]) -> _TLRUCacheWrapper[_T]:
 
 @overload
 def tlru_cache(maxsize: Optional[int] = 128,
-               lifetime: Optional[float] = 60.0, typed: bool = False
+               lifetime: _Lifetime = 60.0, typed: bool = False, *,
+               shards: int = 1, policy: str = 'lru',
+               stale_ttl: Optional[float] = None,
+               refresh_ahead: Optional[float] = None,
+               maxbytes: Optional[int] = None,
+               weigher: Optional[Callable[[Any], int]] = None,
+               snapshot: Union[str, 'os.PathLike[str]', None] = None,
+               shared: Union[str, 'os.PathLike[str]', None] = None,
+               per_instance: bool = False,
+               clock: Union[Callable[[], float], str, None] = None,
+               instrument: bool = False,
+               on_hit: Optional[Callable[[Hashable], Any]] = None,
+               on_miss: Optional[Callable[[Hashable], Any]] = None,
+               on_evict: Optional[Callable[[Hashable], Any]] = None,
+               on_expire: Optional[Callable[[Hashable], Any]] = None,
+               tags: Optional[_Tagger] = None,
+               cache: Optional[TLRUCache] = None,
+               autotune: Optional[Tuple[int, int]] = None,
+               error_lifetime: Optional[float] = None,
+               negative: Optional[Callable[[Any], bool]] = None
                ) -> Callable[[Callable[..., _T]], _TLRUCacheWrapper[_T]]:
     """Timed least-recently-used (TLRU) cache decorator.
 
@@ -310,17 +3131,149 @@ def tlru_cache(maxsize: Optional[int] = 128,
     resulting in behaviour identical to the original
     :func:`functools.lru_cache()`.
 
+    If `lifetime` is a callable, it is called as ``lifetime(args,
+    kwargs, result)`` after every miss and returns the lifetime of that
+    result in seconds, or None if the result should never expire. This
+    allows results to carry their own freshness information.
+
+    If `stale_ttl` is set, expired results are still returned for this
+    many seconds while a single background refresh is scheduled. If
+    `refresh_ahead` is set, hits within this many seconds of a result
+    expiring refresh it in the background. Either keeps frequently used
+    results from ever causing a miss on expiry. Refreshes of regular
+    functions run in a shared thread pool, coroutine functions are
+    refreshed in a separate task.
+
+    Lifetimes are measured with `clock`, which defaults to
+    :func:`time.monotonic`, so that adjustments of the system time do
+    not expire or revive cached results. Any callable returning seconds
+    can be used instead, e.g. a fake clock in tests. With ``'coarse'``,
+    the time is read from a timestamp that a background thread updates
+    every 10 milliseconds, which makes hits cheaper; results may then
+    live up to 10 milliseconds longer than their lifetime. Shared
+    caches always use :func:`time.time`, which is the same in every
+    process.
+
     If `typed` is True, arguments of different types will be cached
     separately. For example, f(3.0) and f(3) will be treated as
     distinct calls with distinct results.
 
+    If `shards` is greater than 1, the cache is split into that many
+    segments with their own lock. Keys are assigned to a segment by
+    their hash and every segment holds an equal share of `maxsize`, so
+    threads working on different keys rarely wait for each other.
+
+    The `policy` controls which item is evicted when the cache is full.
+    The default, ``'lru'``, evicts the least recently used item. With
+    ``'clock'``, recency is only approximated by marking items on use
+    and giving marked items a second chance on eviction. This allows
+    cache hits to skip the lock entirely, at the cost of approximate
+    hit counts under heavy contention.
+    ``'lfu'`` evicts the least frequently used item. ``'tinylfu'``
+    (Window TinyLFU) only admits new items into the main cache if they
+    are used more often than its eviction candidate, which protects
+    frequently used items from scans. ``'arc'`` (adaptive replacement
+    cache) balances recency and frequency based on recent evictions.
+    These three require `maxsize` to be set.
+
+    If `maxbytes` is set, items are also evicted until the total weight
+    of the cached results is at most `maxbytes`, and results weighing
+    more than that are not cached at all. The weight of a result is
+    computed by calling `weigher` on it, which defaults to
+    :func:`sys.getsizeof`. Note that this only measures the result
+    object itself, not any objects it refers to. Without `maxsize`,
+    `maxbytes` requires the ``'lru'`` or ``'clock'`` policy.
+
     Arguments to the cached function must be hashabe.
 
+    Call ``f.cache_dump(path)`` to write the unexpired cache items and
+    their remaining lifetime to a file, and ``f.cache_load(path)`` to
+    add them to a cache, e.g. after a restart. Items that expired in
+    the meantime are skipped. If `snapshot` is set, the cache is loaded
+    from this file on decoration if it exists, unless the file belongs
+    to another function. Results and keys must be picklable, and only
+    trusted files should be loaded.
+
+    If `shared` is set, the cache is stored in an SQLite database file
+    instead of the memory of the process, so that all processes on a
+    host that use the same file share the cache, e.g. the workers of a
+    pre-fork server. The same file can hold the caches of several
+    functions. Keys and results must be picklable; results are pickled
+    once when they are stored and unpickled on every hit. The ``hits``,
+    ``misses``, ``expired`` and ``stale`` statistics only count the
+    calls of the current process, while the size of the cache is shared.
+    Only the ``'lru'`` policy is supported. Unless a `weigher` is given,
+    the weight of a result is the size of its pickle. Keys are compared
+    by their pickle, so equal arguments that pickle differently, e.g.
+    ``1`` and ``1.0`` or sets in a different order, do not share an
+    entry. The database connection of a process is closed by
+    ``f.cache_close()`` or once the cache is garbage collected.
+
+    By default, the instance of a decorated method is part of the key,
+    so all instances share one cache that keeps them alive until their
+    items are evicted. If `per_instance` is True, every instance gets
+    its own cache instead, created on first access and freed with the
+    instance, and ``self`` is left out of the key. This requires
+    instances to support weak references; `snapshot` and `shared` are
+    not supported. ``cache_info()`` and ``cache_clear()`` on the method of
+    the class cover the caches of all live instances. Class methods
+    can use the default mode, since classes rarely need to be freed.
+
+    If the decorated function is a coroutine function, the awaited
+    result is cached instead of the coroutine object. Concurrent
+    awaiters of the same arguments share a single pending task.
+
+    Call ``f.cache_invalidate(*args, **kwargs)`` to remove the result
+    of a single call. If `tags` is set, it is called as ``tags(args,
+    kwargs, result)`` after every miss and returns the tags of that
+    result, e.g. the customer it belongs to. ``f.cache_invalidate_tag(
+    tag)`` then removes all results with that tag, in time proportional
+    to their number. Results of calls that are running while they are
+    invalidated are not cached. Shared caches do not support tags.
+
+    If `cache` is set, results are stored in this :class:`TLRUCache`
+    instead of a cache of their own, so that several functions can
+    share one size and weight limit. The keys of every function are
+    kept apart. The settings of the cache apply, so `maxsize`,
+    `lifetime` and the other cache options must not be passed; `typed`,
+    `tags` and `negative` still apply to the function. ``f.cache_info()``,
+    ``f.cache_clear()`` and ``f.cache_stats()`` cover the entire cache,
+    and ``f.cache_dump()`` and ``f.cache_load()`` are not supported.
+
+    If `autotune` is set to a pair of sizes, the cache estimates the
+    hit ratio it would have at every size within these bounds from the
+    reuse distances of a sample of its keys, and regularly resizes
+    itself to the smallest size that has at most one percentage point
+    fewer hits than the largest. `maxsize` is the initial size. Only
+    the LRU policy of in-memory caches can be tuned.
+
+    If `error_lifetime` is set, exceptions raised by the user function
+    are cached for this many seconds, usually fewer than `lifetime`, and
+    re-raised by every call with the same arguments until then. This
+    keeps a failing backend from being called again by every caller.
+    If `negative` is set as well, it is called with every result and
+    results for which it returns True, e.g. ``None`` for an item that
+    does not exist, are cached for `error_lifetime` as well. Exceptions
+    that do not derive from :class:`Exception`, like
+    :class:`KeyboardInterrupt`, are never cached.
+
+    Calling ``f.cache_stats()`` returns the number of evicted items
+    and, if `instrument` is True, histograms of the time misses took to
+    compute, the time callers waited for the cache lock and the age of
+    items when they were hit. The `on_hit`, `on_miss`, `on_evict` and
+    `on_expire` hooks are called with the key of the item concerned;
+    they also enable the instrumentation. Hooks run in the calling
+    thread right after it releases the cache lock, and their exceptions
+    propagate to the caller. Instrumented caches always take the lock
+    on hits. Shared caches do not report evictions.
+
     Calling ``f.cache_info()`` returns a named tuple of cache
-    statistics (hits, misses, maxsize, currsize, lifetime, expired).
+    statistics (hits, misses, maxsize, currsize, lifetime, expired,
+    stale, policy, maxbytes, currbytes, hit_curve, errors, error_hits).
     The ``expired`` key tracks how many times an element did exist but
     was ignored due having exceeded the cache `lifetime`. Expired items
-    are also added to the ``misses`` key.
+    are also added to the ``misses`` key. The ``stale`` key tracks how
+    many expired results were returned during their `stale_ttl`.
 
     Clear the cache and statistics with ``f.cache_info()``. Access the
     underlying function with ``f.__wrapped__`.
@@ -330,10 +3283,67 @@ def tlru_cache(maxsize: Optional[int] = 128,
 
     :param maxsize: Number of elements to store, defaults to 128
     :type maxsize: Optional[int], optional
-    :param lifetime: Maximum age of cache elements, defaults to 60.0
-    :type lifetime: Optional[float], optional
+    :param lifetime: Maximum age of cache elements, or a callable
+        returning the maximum age of a result, defaults to 60.0
+    :type lifetime: Union[float, Callable[..., Optional[float]], None],
+        optional
     :param typed: Strict type comparison, defaults to False
     :type typed: bool, optional
+    :param shards: Number of cache segments, defaults to 1
+    :type shards: int, optional
+    :param policy: Eviction policy, defaults to ``'lru'``
+    :type policy: str, optional
+    :param stale_ttl: Grace period for expired results, defaults to None
+    :type stale_ttl: Optional[float], optional
+    :param refresh_ahead: Time before expiry at which hits refresh the
+        result, defaults to None
+    :type refresh_ahead: Optional[float], optional
+    :param maxbytes: Maximum total weight of the cached results,
+        defaults to None
+    :type maxbytes: Optional[int], optional
+    :param weigher: Callable returning the weight of a result,
+        defaults to None (:func:`sys.getsizeof`)
+    :type weigher: Optional[Callable[[Any], int]], optional
+    :param snapshot: File to warm-start the cache from, defaults to
+        None
+    :type snapshot: Union[str, os.PathLike[str], None], optional
+    :param shared: Database file shared by several processes, defaults
+        to None
+    :type shared: Union[str, os.PathLike[str], None], optional
+    :param per_instance: Give every instance its own cache of the
+        decorated method, defaults to False
+    :type per_instance: bool, optional
+    :param clock: Callable returning the current time in seconds, or
+        ``'coarse'``, defaults to None (:func:`time.monotonic`)
+    :type clock: Union[Callable[[], float], str, None], optional
+    :param instrument: Record histograms of miss latencies, lock waits
+        and hit ages, defaults to False
+    :type instrument: bool, optional
+    :param on_hit: Called with the key of every hit, defaults to None
+    :type on_hit: Optional[Callable[[Hashable], Any]], optional
+    :param on_miss: Called with the key of every miss, defaults to None
+    :type on_miss: Optional[Callable[[Hashable], Any]], optional
+    :param on_evict: Called with the key of every evicted item,
+        defaults to None
+    :type on_evict: Optional[Callable[[Hashable], Any]], optional
+    :param on_expire: Called with the key of every expired item that is
+        dropped, defaults to None
+    :type on_expire: Optional[Callable[[Hashable], Any]], optional
+    :param tags: Callable returning the tags of a result, defaults to
+        None
+    :type tags: Optional[Callable[..., Iterable[Hashable]]], optional
+    :param cache: Cache to store the results in, which may be shared by
+        several functions, defaults to None
+    :type cache: Optional[TLRUCache], optional
+    :param autotune: Smallest and largest `maxsize` to choose from the
+        estimated hit ratio, defaults to None
+    :type autotune: Optional[Tuple[int, int]], optional
+    :param error_lifetime: Time for which exceptions and negative
+        results are cached, defaults to None (they are not cached)
+    :type error_lifetime: Optional[float], optional
+    :param negative: Callable returning whether a result is negative,
+        defaults to None
+    :type negative: Optional[Callable[[Any], bool]], optional
 
     :return: A TLRU-cached wrapper for the decorated function.
     :rtype: Any
@@ -342,9 +3352,27 @@ def tlru_cache(maxsize: Optional[int] = 128,
     ...
 
 
-def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
-               lifetime: Union[Optional[float], bool] = 60.0,
-               typed: bool = False
+def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = _UNSET,
+               lifetime: Union[_Lifetime, bool] = _UNSET,
+               typed: bool = False, *, shards: int = 1,
+               policy: str = 'lru', stale_ttl: Optional[float] = None,
+               refresh_ahead: Optional[float] = None,
+               maxbytes: Optional[int] = None,
+               weigher: Optional[Callable[[Any], int]] = None,
+               snapshot: Union[str, 'os.PathLike[str]', None] = None,
+               shared: Union[str, 'os.PathLike[str]', None] = None,
+               per_instance: bool = False,
+               clock: Union[Callable[[], float], str, None] = None,
+               instrument: bool = False,
+               on_hit: Optional[Callable[[Hashable], Any]] = None,
+               on_miss: Optional[Callable[[Hashable], Any]] = None,
+               on_evict: Optional[Callable[[Hashable], Any]] = None,
+               on_expire: Optional[Callable[[Hashable], Any]] = None,
+               tags: Optional[_Tagger] = None,
+               cache: Optional[TLRUCache] = None,
+               autotune: Optional[Tuple[int, int]] = None,
+               error_lifetime: Optional[float] = None,
+               negative: Optional[Callable[[Any], bool]] = None
                ) -> Union[_TLRUCacheWrapper[_T], Callable[[Callable[..., _T]], _TLRUCacheWrapper[_T]]]:
     """Timed least-recently-used (TLRU) cache decorator.
 
@@ -359,17 +3387,149 @@ def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
     resulting in behaviour identical to the original
     :func:`functools.lru_cache()`.
 
+    If `lifetime` is a callable, it is called as ``lifetime(args,
+    kwargs, result)`` after every miss and returns the lifetime of that
+    result in seconds, or None if the result should never expire. This
+    allows results to carry their own freshness information.
+
+    If `stale_ttl` is set, expired results are still returned for this
+    many seconds while a single background refresh is scheduled. If
+    `refresh_ahead` is set, hits within this many seconds of a result
+    expiring refresh it in the background. Either keeps frequently used
+    results from ever causing a miss on expiry. Refreshes of regular
+    functions run in a shared thread pool, coroutine functions are
+    refreshed in a separate task.
+
+    Lifetimes are measured with `clock`, which defaults to
+    :func:`time.monotonic`, so that adjustments of the system time do
+    not expire or revive cached results. Any callable returning seconds
+    can be used instead, e.g. a fake clock in tests. With ``'coarse'``,
+    the time is read from a timestamp that a background thread updates
+    every 10 milliseconds, which makes hits cheaper; results may then
+    live up to 10 milliseconds longer than their lifetime. Shared
+    caches always use :func:`time.time`, which is the same in every
+    process.
+
     If `typed` is True, arguments of different types will be cached
     separately. For example, f(3.0) and f(3) will be treated as
     distinct calls with distinct results.
 
+    If `shards` is greater than 1, the cache is split into that many
+    segments with their own lock. Keys are assigned to a segment by
+    their hash and every segment holds an equal share of `maxsize`, so
+    threads working on different keys rarely wait for each other.
+
+    The `policy` controls which item is evicted when the cache is full.
+    The default, ``'lru'``, evicts the least recently used item. With
+    ``'clock'``, recency is only approximated by marking items on use
+    and giving marked items a second chance on eviction. This allows
+    cache hits to skip the lock entirely, at the cost of approximate
+    hit counts under heavy contention.
+    ``'lfu'`` evicts the least frequently used item. ``'tinylfu'``
+    (Window TinyLFU) only admits new items into the main cache if they
+    are used more often than its eviction candidate, which protects
+    frequently used items from scans. ``'arc'`` (adaptive replacement
+    cache) balances recency and frequency based on recent evictions.
+    These three require `maxsize` to be set.
+
+    If `maxbytes` is set, items are also evicted until the total weight
+    of the cached results is at most `maxbytes`, and results weighing
+    more than that are not cached at all. The weight of a result is
+    computed by calling `weigher` on it, which defaults to
+    :func:`sys.getsizeof`. Note that this only measures the result
+    object itself, not any objects it refers to. Without `maxsize`,
+    `maxbytes` requires the ``'lru'`` or ``'clock'`` policy.
+
     Arguments to the cached function must be hashabe.
 
+    Call ``f.cache_dump(path)`` to write the unexpired cache items and
+    their remaining lifetime to a file, and ``f.cache_load(path)`` to
+    add them to a cache, e.g. after a restart. Items that expired in
+    the meantime are skipped. If `snapshot` is set, the cache is loaded
+    from this file on decoration if it exists, unless the file belongs
+    to another function. Results and keys must be picklable, and only
+    trusted files should be loaded.
+
+    If `shared` is set, the cache is stored in an SQLite database file
+    instead of the memory of the process, so that all processes on a
+    host that use the same file share the cache, e.g. the workers of a
+    pre-fork server. The same file can hold the caches of several
+    functions. Keys and results must be picklable; results are pickled
+    once when they are stored and unpickled on every hit. The ``hits``,
+    ``misses``, ``expired`` and ``stale`` statistics only count the
+    calls of the current process, while the size of the cache is shared.
+    Only the ``'lru'`` policy is supported. Unless a `weigher` is given,
+    the weight of a result is the size of its pickle. Keys are compared
+    by their pickle, so equal arguments that pickle differently, e.g.
+    ``1`` and ``1.0`` or sets in a different order, do not share an
+    entry. The database connection of a process is closed by
+    ``f.cache_close()`` or once the cache is garbage collected.
+
+    By default, the instance of a decorated method is part of the key,
+    so all instances share one cache that keeps them alive until their
+    items are evicted. If `per_instance` is True, every instance gets
+    its own cache instead, created on first access and freed with the
+    instance, and ``self`` is left out of the key. This requires
+    instances to support weak references; `snapshot` and `shared` are
+    not supported. ``cache_info()`` and ``cache_clear()`` on the method of
+    the class cover the caches of all live instances. Class methods
+    can use the default mode, since classes rarely need to be freed.
+
+    If the decorated function is a coroutine function, the awaited
+    result is cached instead of the coroutine object. Concurrent
+    awaiters of the same arguments share a single pending task.
+
+    Call ``f.cache_invalidate(*args, **kwargs)`` to remove the result
+    of a single call. If `tags` is set, it is called as ``tags(args,
+    kwargs, result)`` after every miss and returns the tags of that
+    result, e.g. the customer it belongs to. ``f.cache_invalidate_tag(
+    tag)`` then removes all results with that tag, in time proportional
+    to their number. Results of calls that are running while they are
+    invalidated are not cached. Shared caches do not support tags.
+
+    If `cache` is set, results are stored in this :class:`TLRUCache`
+    instead of a cache of their own, so that several functions can
+    share one size and weight limit. The keys of every function are
+    kept apart. The settings of the cache apply, so `maxsize`,
+    `lifetime` and the other cache options must not be passed; `typed`,
+    `tags` and `negative` still apply to the function. ``f.cache_info()``,
+    ``f.cache_clear()`` and ``f.cache_stats()`` cover the entire cache,
+    and ``f.cache_dump()`` and ``f.cache_load()`` are not supported.
+
+    If `autotune` is set to a pair of sizes, the cache estimates the
+    hit ratio it would have at every size within these bounds from the
+    reuse distances of a sample of its keys, and regularly resizes
+    itself to the smallest size that has at most one percentage point
+    fewer hits than the largest. `maxsize` is the initial size. Only
+    the LRU policy of in-memory caches can be tuned.
+
+    If `error_lifetime` is set, exceptions raised by the user function
+    are cached for this many seconds, usually fewer than `lifetime`, and
+    re-raised by every call with the same arguments until then. This
+    keeps a failing backend from being called again by every caller.
+    If `negative` is set as well, it is called with every result and
+    results for which it returns True, e.g. ``None`` for an item that
+    does not exist, are cached for `error_lifetime` as well. Exceptions
+    that do not derive from :class:`Exception`, like
+    :class:`KeyboardInterrupt`, are never cached.
+
+    Calling ``f.cache_stats()`` returns the number of evicted items
+    and, if `instrument` is True, histograms of the time misses took to
+    compute, the time callers waited for the cache lock and the age of
+    items when they were hit. The `on_hit`, `on_miss`, `on_evict` and
+    `on_expire` hooks are called with the key of the item concerned;
+    they also enable the instrumentation. Hooks run in the calling
+    thread right after it releases the cache lock, and their exceptions
+    propagate to the caller. Instrumented caches always take the lock
+    on hits. Shared caches do not report evictions.
+
     Calling ``f.cache_info()`` returns a named tuple of cache
-    statistics (hits, misses, maxsize, currsize, lifetime, expired).
+    statistics (hits, misses, maxsize, currsize, lifetime, expired,
+    stale, policy, maxbytes, currbytes, hit_curve, errors, error_hits).
     The ``expired`` key tracks how many times an element did exist but
     was ignored due having exceeded the cache `lifetime`. Expired items
-    are also added to the ``misses`` key.
+    are also added to the ``misses`` key. The ``stale`` key tracks how
+    many expired results were returned during their `stale_ttl`.
 
     Clear the cache and statistics with ``f.cache_info()``. Access the
     underlying function with ``f.__wrapped__`.
@@ -379,10 +3539,67 @@ def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
 
     :param maxsize: Number of elements to store, defaults to 128
     :type maxsize: Optional[int], optional
-    :param lifetime: Maximum age of cache elements, defaults to 60.0
-    :type lifetime: Optional[float], optional
+    :param lifetime: Maximum age of cache elements, or a callable
+        returning the maximum age of a result, defaults to 60.0
+    :type lifetime: Union[float, Callable[..., Optional[float]], None],
+        optional
     :param typed: Strict type comparison, defaults to False
     :type typed: bool, optional
+    :param shards: Number of cache segments, defaults to 1
+    :type shards: int, optional
+    :param policy: Eviction policy, defaults to ``'lru'``
+    :type policy: str, optional
+    :param stale_ttl: Grace period for expired results, defaults to None
+    :type stale_ttl: Optional[float], optional
+    :param refresh_ahead: Time before expiry at which hits refresh the
+        result, defaults to None
+    :type refresh_ahead: Optional[float], optional
+    :param maxbytes: Maximum total weight of the cached results,
+        defaults to None
+    :type maxbytes: Optional[int], optional
+    :param weigher: Callable returning the weight of a result,
+        defaults to None (:func:`sys.getsizeof`)
+    :type weigher: Optional[Callable[[Any], int]], optional
+    :param snapshot: File to warm-start the cache from, defaults to
+        None
+    :type snapshot: Union[str, os.PathLike[str], None], optional
+    :param shared: Database file shared by several processes, defaults
+        to None
+    :type shared: Union[str, os.PathLike[str], None], optional
+    :param per_instance: Give every instance its own cache of the
+        decorated method, defaults to False
+    :type per_instance: bool, optional
+    :param clock: Callable returning the current time in seconds, or
+        ``'coarse'``, defaults to None (:func:`time.monotonic`)
+    :type clock: Union[Callable[[], float], str, None], optional
+    :param instrument: Record histograms of miss latencies, lock waits
+        and hit ages, defaults to False
+    :type instrument: bool, optional
+    :param on_hit: Called with the key of every hit, defaults to None
+    :type on_hit: Optional[Callable[[Hashable], Any]], optional
+    :param on_miss: Called with the key of every miss, defaults to None
+    :type on_miss: Optional[Callable[[Hashable], Any]], optional
+    :param on_evict: Called with the key of every evicted item,
+        defaults to None
+    :type on_evict: Optional[Callable[[Hashable], Any]], optional
+    :param on_expire: Called with the key of every expired item that is
+        dropped, defaults to None
+    :type on_expire: Optional[Callable[[Hashable], Any]], optional
+    :param tags: Callable returning the tags of a result, defaults to
+        None
+    :type tags: Optional[Callable[..., Iterable[Hashable]]], optional
+    :param cache: Cache to store the results in, which may be shared by
+        several functions, defaults to None
+    :type cache: Optional[TLRUCache], optional
+    :param autotune: Smallest and largest `maxsize` to choose from the
+        estimated hit ratio, defaults to None
+    :type autotune: Optional[Tuple[int, int]], optional
+    :param error_lifetime: Time for which exceptions and negative
+        results are cached, defaults to None (they are not cached)
+    :type error_lifetime: Optional[float], optional
+    :param negative: Callable returning whether a result is negative,
+        defaults to None
+    :type negative: Optional[Callable[[Any], bool]], optional
 
     :return: A TLRU-cached wrapper for the decorated function.
     :rtype: Any
@@ -397,6 +3614,60 @@ def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
 
     # TODO: Handle negative time
 
+    if cache is not None and (
+            (maxsize is not _UNSET and not callable(maxsize))
+            or lifetime is not _UNSET):
+        raise ValueError('Cache options must be set on the TLRUCache passed '
+                         'as cache')
+    if maxsize is _UNSET:
+        maxsize = 128
+    if lifetime is _UNSET:
+        lifetime = 60.0
+
+    _check_options(maxsize, shards, policy,  # type: ignore
+                   stale_ttl, refresh_ahead, maxbytes, clock, shared,
+                   autotune, error_lifetime)
+    if negative is not None and (
+            cache.error_lifetime if cache is not None
+            else error_lifetime) is None:
+        raise ValueError('negative requires error_lifetime to be set')
+    if tags is not None and shared is not None:
+        raise ValueError('Shared caches do not support tags')
+    if per_instance and (snapshot is not None or shared is not None
+                         or cache is not None or autotune is not None):
+        raise ValueError('Per-instance caches do not support snapshot, '
+                         'shared, cache or autotune')
+
+    hooks = (on_hit, on_miss, on_evict, on_expire)
+    if not instrument and hooks == (None,) * 4:
+        hooks = None  # type: ignore
+    if cache is not None and (
+            shards != 1 or policy != 'lru' or stale_ttl is not None
+            or refresh_ahead is not None or maxbytes is not None
+            or weigher is not None or clock is not None or shared is not None
+            or snapshot is not None or hooks is not None
+            or autotune is not None or error_lifetime is not None):
+        raise ValueError('Cache options must be set on the TLRUCache passed '
+                         'as cache')
+
+    def decorating_function(user_function: _FuncT) -> _FuncT:
+        if per_instance:
+            return _TLRUCachedMethod(  # type: ignore
+                user_function, dict(
+                    maxsize=maxsize, lifetime=lifetime, typed=typed,
+                    shards=shards, policy=policy, stale_ttl=stale_ttl,
+                    refresh_ahead=refresh_ahead, maxbytes=maxbytes,
+                    weigher=weigher, clock=clock, hooks=hooks, tags=tags,
+                    error_lifetime=error_lifetime, negative=negative))
+        wrapper = _tlru_cache_wrapper(
+            user_function, maxsize, lifetime, typed,  # type: ignore
+            shards=shards, policy=policy, stale_ttl=stale_ttl,
+            refresh_ahead=refresh_ahead, maxbytes=maxbytes, weigher=weigher,
+            snapshot=snapshot, shared=shared, clock=clock, hooks=hooks,
+            tags=tags, cache=cache, autotune=autotune,
+            error_lifetime=error_lifetime, negative=negative)
+        return functools.update_wrapper(wrapper, user_function)
+
     # Implementation A (part 1)
     if isinstance(maxsize, int):
 
@@ -412,8 +3683,7 @@ def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
         # user_function was passed in via the maxsize argument
         user_function: Callable[..., _T] = maxsize
         maxsize = 128
-        wrapper = _tlru_cache_wrapper(user_function, maxsize, lifetime, typed)
-        return functools.update_wrapper(wrapper, user_function)
+        return decorating_function(user_function)  # type: ignore
 
     # Neither A nor B --> undefined behaviour
     elif maxsize is not None:
@@ -421,9 +3691,4 @@ def tlru_cache(maxsize: Union[Callable[..., _T], Optional[int]] = 128,
             'Expected first argument to be an integer, a callable, or None')
 
     # Implementation A (part 2)
-
-    def decorating_function(user_function: _FuncT) -> _FuncT:
-        wrapper = _tlru_cache_wrapper(user_function, maxsize, lifetime, typed)
-        return functools.update_wrapper(wrapper, user_function)
-
     return decorating_function
@@ -0,0 +1,412 @@
+"""Eviction policies for bounded TLRU caches.
+
+The default LRU and CLOCK policies are implemented directly by the
+cache segments, which keeps their hit path as short as possible. The
+policies in this module track their own metadata and are used for the
+other values of the ``policy`` argument of ``tlru_cache``.
+
+All policy methods are called with the segment lock held.
+
+"""
+
+import abc
+import collections
+from typing import Dict, Hashable, List, Optional
+
+__all__ = [
+    'Policy',
+    'LFUPolicy',
+    'TinyLFUPolicy',
+    'ARCPolicy',
+    'POLICIES'
+]
+
+
+class Policy(abc.ABC):
+    """Base class for eviction policies.
+
+    A policy tracks the keys stored in a cache segment and decides
+    which key to evict once the segment is full.
+
+    :param maxsize: Maximum number of items in the segment.
+    :type maxsize: int
+
+    """
+
+    __slots__ = ('maxsize',)
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+
+    @abc.abstractmethod
+    def hit(self, key: Hashable) -> None:
+        """Record a cache hit for a stored key.
+
+        :param key: The key that was used.
+        :type key: Hashable
+
+        """
+
+    @abc.abstractmethod
+    def insert(self, key: Hashable) -> Optional[Hashable]:
+        """Record a new key and return the key to evict, if any.
+
+        The returned key may be any stored key, including the newly
+        inserted one if the policy does not admit it.
+
+        :param key: The key that was added to the segment.
+        :type key: Hashable
+
+        :return: A key the caller must remove from the segment, or None
+            if the segment is not over capacity.
+        :rtype: Optional[Hashable]
+
+        """
+
+    @abc.abstractmethod
+    def evict(self) -> Hashable:
+        """Choose a key to evict and forget it.
+
+        This is used if the segment must shrink for another reason than
+        its number of keys, e.g. because its results are too large.
+
+        :return: A stored key the caller must remove from the segment.
+        :rtype: Hashable
+
+        """
+
+    @abc.abstractmethod
+    def remove(self, key: Hashable) -> None:
+        """Forget a key that was removed from the segment.
+
+        This is used for items that were dropped without the policy
+        choosing them, e.g. because they expired.
+
+        :param key: The key that was removed.
+        :type key: Hashable
+
+        """
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Forget all keys."""
+
+
+class LFUPolicy(Policy):
+    """Least frequently used policy.
+
+    Keys are grouped into buckets by use count. The least recently used
+    key of the lowest non-empty bucket is evicted, which takes constant
+    time for hits, insertions and evictions.
+
+    """
+
+    __slots__ = ('counts', 'buckets', 'min_count')
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize)
+        self.counts: Dict[Hashable, int] = {}
+        self.buckets: Dict[
+            int, 'collections.OrderedDict[Hashable, None]'] = {}
+        self.min_count = 0
+
+    def _unlink(self, key: Hashable) -> int:
+        count = self.counts.pop(key)
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+        return count
+
+    def _link(self, key: Hashable, count: int) -> None:
+        self.counts[key] = count
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = collections.OrderedDict()
+        bucket[key] = None
+
+    def hit(self, key: Hashable) -> None:
+        count = self._unlink(key)
+        self._link(key, count + 1)
+        if count == self.min_count and count not in self.buckets:
+            self.min_count = count + 1
+
+    def insert(self, key: Hashable) -> Optional[Hashable]:
+        victim = None
+        if len(self.counts) >= self.maxsize:
+            victim = self.evict()
+        self._link(key, 1)
+        self.min_count = 1
+        return victim
+
+    def evict(self) -> Hashable:
+        # Removing arbitrary keys may leave min_count out of date
+        if self.min_count not in self.buckets:
+            self.min_count = min(self.buckets)
+        victim = next(iter(self.buckets[self.min_count]))
+        _ = self._unlink(victim)
+        return victim
+
+    def remove(self, key: Hashable) -> None:
+        if key in self.counts:
+            _ = self._unlink(key)
+
+    def clear(self) -> None:
+        self.counts.clear()
+        self.buckets.clear()
+        self.min_count = 0
+
+
+class _FrequencySketch:
+    """Count-min sketch of how often keys were used recently.
+
+    Every key increments one 4-bit counter in each of four rows; the
+    smallest of these counters is its estimated frequency. All counters
+    are halved once the number of increments reaches ten times the
+    cache size, so that old popularity fades away.
+
+    :param maxsize: Maximum number of items in the cache.
+    :type maxsize: int
+
+    """
+
+    __slots__ = ('width', 'mask', 'table', 'additions', 'sample_size')
+
+    # Odd multipliers used to derive one index per row from the key hash
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+              0x165667B19E3779F9, 0x27D4EB2F165667C5)
+
+    def __init__(self, maxsize: int) -> None:
+        self.width = 1 << max(maxsize - 1, 15).bit_length()
+        self.mask = self.width - 1
+        self.table = bytearray(4 * self.width)
+        self.additions = 0
+        self.sample_size = 10 * maxsize
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        value = hash(key)
+        mask = self.mask
+        width = self.width
+        return [((value * seed) >> 32 & mask) + row * width
+                for row, seed in enumerate(self._SEEDS)]
+
+    def increment(self, key: Hashable) -> None:
+        """Record a use of `key`.
+
+        :param key: The key that was used.
+        :type key: Hashable
+
+        """
+        table = self.table
+        for index in self._indexes(key):
+            if table[index] < 15:
+                table[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table = bytearray(count >> 1 for count in table)
+            self.additions //= 2
+
+    def estimate(self, key: Hashable) -> int:
+        """Return the estimated recent use count of `key`.
+
+        :param key: The key to estimate.
+        :type key: Hashable
+
+        :return: The estimated number of uses, at most 15.
+        :rtype: int
+
+        """
+        table = self.table
+        return min(table[index] for index in self._indexes(key))
+
+
+class TinyLFUPolicy(Policy):
+    """Window TinyLFU policy.
+
+    New keys enter a small LRU window holding 1% of the cache. Keys
+    leaving the window compete with the eviction candidate of the main
+    cache, and only the one used more often according to a frequency
+    sketch is kept. This keeps one-off scans from flushing out
+    frequently used keys. The main cache is a segmented LRU whose
+    protected part holds keys that were hit while on probation.
+
+    """
+
+    __slots__ = ('sketch', 'window', 'probation', 'protected',
+                 'window_size', 'main_size', 'protected_size')
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize)
+        self.sketch = _FrequencySketch(maxsize)
+        self.window: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.probation: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.protected: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.window_size = max(maxsize // 100, 1)
+        self.main_size = maxsize - self.window_size
+        self.protected_size = self.main_size * 4 // 5
+
+    def hit(self, key: Hashable) -> None:
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            # Promote to the protected segment, demoting its oldest key
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+        else:
+            self.protected.move_to_end(key)
+
+    def insert(self, key: Hashable) -> Optional[Hashable]:
+        self.sketch.increment(key)
+        window = self.window
+        window[key] = None
+        if len(window) <= self.window_size:
+            return None
+        candidate, _ = window.popitem(last=False)
+        probation = self.probation
+        if len(probation) + len(self.protected) < self.main_size:
+            probation[candidate] = None
+            return None
+        if probation:
+            victim = next(iter(probation))
+        elif self.protected:
+            victim = next(iter(self.protected))
+        else:
+            return candidate
+        if self.sketch.estimate(candidate) <= self.sketch.estimate(victim):
+            return candidate
+        self.remove(victim)
+        probation[candidate] = None
+        return victim
+
+    def evict(self) -> Hashable:
+        for segment in (self.probation, self.protected, self.window):
+            if segment:
+                victim, _ = segment.popitem(last=False)
+                return victim
+        raise KeyError('evict from an empty policy')
+
+    def remove(self, key: Hashable) -> None:
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                del segment[key]
+                return
+
+    def clear(self) -> None:
+        self.window.clear()
+        self.probation.clear()
+        self.protected.clear()
+
+
+class ARCPolicy(Policy):
+    """Adaptive replacement cache policy.
+
+    Keys used once are kept in a recency list, keys used more than once
+    in a frequency list. Ghost lists remember keys recently evicted from
+    either list, and misses on ghost keys shift the target size of the
+    recency list towards whichever list would have kept them.
+
+    """
+
+    __slots__ = ('recent', 'frequent', 'recent_ghosts', 'frequent_ghosts',
+                 'target')
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize)
+        self.recent: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.frequent: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.recent_ghosts: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.frequent_ghosts: 'collections.OrderedDict[Hashable, None]' = (
+            collections.OrderedDict())
+        self.target = 0.0
+
+    def hit(self, key: Hashable) -> None:
+        if key in self.recent:
+            del self.recent[key]
+            self.frequent[key] = None
+        else:
+            self.frequent.move_to_end(key)
+
+    def _replace(self, in_frequent_ghosts: bool) -> Hashable:
+        recent = self.recent
+        if recent and (not self.frequent or len(recent) > self.target or (
+                in_frequent_ghosts and len(recent) == self.target)):
+            victim, _ = recent.popitem(last=False)
+            self.recent_ghosts[victim] = None
+        else:
+            victim, _ = self.frequent.popitem(last=False)
+            self.frequent_ghosts[victim] = None
+        return victim
+
+    def insert(self, key: Hashable) -> Optional[Hashable]:
+        maxsize = self.maxsize
+        recent, frequent = self.recent, self.frequent
+        recent_ghosts, frequent_ghosts = (
+            self.recent_ghosts, self.frequent_ghosts)
+        full = len(recent) + len(frequent) >= maxsize
+        victim = None
+        if key in recent_ghosts:
+            self.target = min(self.target + max(
+                len(frequent_ghosts) / len(recent_ghosts), 1), maxsize)
+            del recent_ghosts[key]
+            if full:
+                victim = self._replace(False)
+            frequent[key] = None
+            return victim
+        if key in frequent_ghosts:
+            self.target = max(self.target - max(
+                len(recent_ghosts) / len(frequent_ghosts), 1), 0)
+            del frequent_ghosts[key]
+            if full:
+                victim = self._replace(True)
+            frequent[key] = None
+            return victim
+        if len(recent) + len(recent_ghosts) >= maxsize:
+            if len(recent) < maxsize:
+                _ = recent_ghosts.popitem(last=False)
+                if full:
+                    victim = self._replace(False)
+            else:
+                victim, _ = recent.popitem(last=False)
+        else:
+            total = (len(recent) + len(frequent)
+                     + len(recent_ghosts) + len(frequent_ghosts))
+            if total >= 2 * maxsize and frequent_ghosts:
+                _ = frequent_ghosts.popitem(last=False)
+            if full:
+                victim = self._replace(False)
+        recent[key] = None
+        return victim
+
+    def evict(self) -> Hashable:
+        return self._replace(False)
+
+    def remove(self, key: Hashable) -> None:
+        if key in self.recent:
+            del self.recent[key]
+        elif key in self.frequent:
+            del self.frequent[key]
+
+    def clear(self) -> None:
+        self.recent.clear()
+        self.frequent.clear()
+        self.recent_ghosts.clear()
+        self.frequent_ghosts.clear()
+        self.target = 0.0
+
+
+# Policy classes by the name used for the ``policy`` argument
+POLICIES = {
+    'lfu': LFUPolicy,
+    'tinylfu': TinyLFUPolicy,
+    'arc': ARCPolicy,
+}
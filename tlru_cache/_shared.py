@@ -0,0 +1,349 @@
+"""Cache storage shared by the processes on one host.
+
+Caches created with the ``shared`` argument of ``tlru_cache`` store
+their items in an SQLite database instead of a dictionary, so that all
+processes using the same database file share one cache, e.g. the
+workers of a pre-fork server or a :mod:`multiprocessing` pool.
+
+This module only deals with serialized keys and results. Every method
+runs in its own transaction, and SQLite takes care of locking between
+processes. Within a process, the caller must serialize all calls.
+
+"""
+
+import os
+import sqlite3
+import weakref
+from typing import Iterator, List, Optional, Tuple
+
+__all__ = [
+    'SharedStore'
+]
+
+# Version of the tables below, kept in the user_version of the database
+_VERSION = 1
+
+_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS entries (
+        name TEXT NOT NULL,
+        key BLOB NOT NULL,
+        value BLOB NOT NULL,
+        expires REAL NOT NULL,
+        used REAL NOT NULL,
+        weight INTEGER NOT NULL,
+        stored REAL NOT NULL,
+        PRIMARY KEY (name, key)
+    )''',
+    'CREATE INDEX IF NOT EXISTS entries_used ON entries (name, used)',
+    'CREATE INDEX IF NOT EXISTS entries_expires ON entries (name, expires)',
+    # Number and total weight of the entries of every cache, which would
+    # otherwise take a full scan to count
+    '''CREATE TABLE IF NOT EXISTS usage (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )''',
+)
+
+
+def _migrate(connection: sqlite3.Connection, version: int) -> None:
+    """Bring the tables of another schema version up to date.
+
+    Must be called within a transaction, before the tables are created.
+
+    :param connection: The database connection.
+    :type connection: sqlite3.Connection
+    :param version: The schema version of the database.
+    :type version: int
+
+    """
+    columns = [row[1] for row in connection.execute(
+        'PRAGMA table_info(entries)')]
+    if version > _VERSION:
+        # Entries can always be computed again, so tables of an unknown
+        # version are rebuilt rather than guessed at
+        _ = connection.execute('DROP TABLE IF EXISTS entries')
+        _ = connection.execute('DROP TABLE IF EXISTS usage')
+    elif columns and 'stored' not in columns:
+        # Entries of the first version lack the time they were stored,
+        # for which the time of their last use stands in
+        _ = connection.execute(
+            'ALTER TABLE entries ADD COLUMN stored REAL NOT NULL DEFAULT 0')
+        _ = connection.execute('UPDATE entries SET stored = used')
+    _ = connection.execute(f'PRAGMA user_version = {_VERSION}')
+
+
+def _close(connection: sqlite3.Connection, pid: int) -> None:
+    """Close a connection in the process that opened it."""
+    if os.getpid() == pid:
+        connection.close()
+
+
+class SharedStore:
+    """Storage of a single cache in an SQLite database file.
+
+    Several caches can share a database file as long as their `name`
+    differs. Items are evicted in least recently used order once the
+    cache holds more than `maxsize` items or their total weight is
+    above `maxbytes`.
+
+    The database connection is opened on first use and closed by
+    :meth:`close` or once the store is garbage collected.
+
+    :param path: The database file, which is created if necessary.
+    :type path: str
+    :param name: The name of the cache within the database.
+    :type name: str
+    :param maxsize: Maximum number of items in the cache.
+    :type maxsize: Optional[int]
+    :param maxbytes: Maximum total weight of the items in the cache.
+    :type maxbytes: Optional[int]
+
+    """
+
+    __slots__ = ('path', 'name', 'maxsize', 'maxbytes', '_connection',
+                 '_pid', '_finalizer', '__weakref__')
+
+    def __init__(self, path: str, name: str, maxsize: Optional[int],
+                 maxbytes: Optional[int]) -> None:
+        self.path = path
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._finalizer: Optional[weakref.finalize] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The database connection of the current process.
+
+        Connections must not be used across :func:`os.fork`, so a child
+        process opens its own connection on first use.
+
+        """
+        if self._connection is None or self._pid != os.getpid():
+            # The connection of the parent process is left open for it
+            self.close()
+            connection = sqlite3.connect(
+                self.path, timeout=30.0, isolation_level=None,
+                check_same_thread=False)
+            # Entries can always be computed again, so durability is not
+            # worth waiting for the disk
+            _ = connection.execute('PRAGMA journal_mode=WAL')
+            _ = connection.execute('PRAGMA synchronous=OFF')
+            with connection:
+                _ = connection.execute('BEGIN IMMEDIATE')
+                version = connection.execute(
+                    'PRAGMA user_version').fetchone()[0]
+                if version != _VERSION:
+                    _migrate(connection, version)
+                for statement in _SCHEMA:
+                    _ = connection.execute(statement)
+                _ = connection.execute(
+                    'INSERT OR IGNORE INTO usage VALUES (?, 0, 0)',
+                    (self.name,))
+            self._connection = connection
+            self._pid = os.getpid()
+            self._finalizer = weakref.finalize(
+                self, _close, connection, self._pid)
+        return self._connection
+
+    def close(self) -> None:
+        """Close the database connection of the current process.
+
+        The store opens a new connection if it is used again.
+
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+        self._connection = None
+        self._finalizer = None
+
+    def get(self, key: bytes) -> Optional[Tuple[bytes, float, float]]:
+        """Return the value, expiry and storage time stored for `key`.
+
+        :param key: The serialized key.
+        :type key: bytes
+
+        :return: The serialized value, the time at which it expires and
+            the time at which it was stored, or None if `key` is not
+            stored.
+        :rtype: Optional[Tuple[bytes, float, float]]
+
+        """
+        return self.connection.execute(
+            'SELECT value, expires, stored FROM entries '
+            'WHERE name = ? AND key = ?', (self.name, key)).fetchone()
+
+    def touch(self, key: bytes, now: float) -> None:
+        """Mark `key` as used.
+
+        :param key: The serialized key.
+        :type key: bytes
+        :param now: The current time.
+        :type now: float
+
+        """
+        _ = self.connection.execute(
+            'UPDATE entries SET used = ? WHERE name = ? AND key = ?',
+            (now, self.name, key))
+
+    def _remove(self, connection: sqlite3.Connection,
+                keys: List[Tuple[bytes, int]]) -> None:
+        """Delete entries within a transaction and update the usage."""
+        _ = connection.executemany(
+            'DELETE FROM entries WHERE name = ? AND key = ?',
+            [(self.name, key) for key, _ in keys])
+        _ = connection.execute(
+            'UPDATE usage SET size = size - ?, bytes = bytes - ? '
+            'WHERE name = ?',
+            (len(keys), sum(weight for _, weight in keys), self.name))
+
+    def delete(self, key: bytes) -> bool:
+        """Delete the entry for `key`, if any.
+
+        :param key: The serialized key.
+        :type key: bytes
+
+        :return: Whether an entry was deleted.
+        :rtype: bool
+
+        """
+        connection = self.connection
+        with connection:
+            _ = connection.execute('BEGIN IMMEDIATE')
+            entries = connection.execute(
+                'SELECT key, weight FROM entries WHERE name = ? AND key = ?',
+                (self.name, key)).fetchall()
+            self._remove(connection, entries)
+        return bool(entries)
+
+    def purge(self, before: float, limit: Optional[int] = None) -> None:
+        """Delete entries that expired before the given time.
+
+        :param before: Entries expiring before this time are deleted.
+        :type before: float
+        :param limit: The maximum number of entries to delete, defaults
+            to None (no limit).
+        :type limit: Optional[int], optional
+
+        """
+        connection = self.connection
+        with connection:
+            _ = connection.execute('BEGIN IMMEDIATE')
+            self._purge(connection, before, limit)
+
+    def _purge(self, connection: sqlite3.Connection, before: float,
+               limit: Optional[int]) -> None:
+        self._remove(connection, connection.execute(
+            'SELECT key, weight FROM entries WHERE name = ? AND expires < ? '
+            'ORDER BY expires LIMIT ?',
+            (self.name, before, -1 if limit is None else limit)).fetchall())
+
+    def put(self, key: bytes, value: bytes, expires: float, weight: int,
+            now: float, replace: bool = True,
+            purge: Optional[Tuple[float, int]] = None) -> bool:
+        """Store an entry, evicting others if the cache is full.
+
+        Values weighing more than `maxbytes` on their own are not
+        stored at all.
+
+        :param key: The serialized key.
+        :type key: bytes
+        :param value: The serialized value.
+        :type value: bytes
+        :param expires: The time at which the entry expires.
+        :type expires: float
+        :param weight: The weight of the value.
+        :type weight: int
+        :param now: The current time.
+        :type now: float
+        :param replace: Whether to replace an existing entry for `key`,
+            defaults to True.
+        :type replace: bool, optional
+        :param purge: The time before which entries expired and the
+            maximum number of them to delete first, defaults to None.
+        :type purge: Optional[Tuple[float, int]], optional
+
+        :return: Whether the entry was stored.
+        :rtype: bool
+
+        """
+        if self.maxbytes is not None and weight > self.maxbytes:
+            return False
+        name = self.name
+        connection = self.connection
+        with connection:
+            _ = connection.execute('BEGIN IMMEDIATE')
+            if purge is not None:
+                self._purge(connection, *purge)
+            old = connection.execute(
+                'SELECT key, weight FROM entries WHERE name = ? AND key = ?',
+                (name, key)).fetchall()
+            if old and not replace:
+                return False
+            self._remove(connection, old)
+            _ = connection.execute(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, key, value, expires, now, weight, now))
+            _ = connection.execute(
+                'UPDATE usage SET size = size + 1, bytes = bytes + ? '
+                'WHERE name = ?', (weight, name))
+            size, total = connection.execute(
+                'SELECT size, bytes FROM usage WHERE name = ?',
+                (name,)).fetchone()
+            maxsize, maxbytes = self.maxsize, self.maxbytes
+            victims: List[Tuple[bytes, int]] = []
+            if maxsize is not None and size > maxsize:
+                victims = connection.execute(
+                    'SELECT key, weight FROM entries WHERE name = ? '
+                    'ORDER BY used LIMIT ?',
+                    (name, size - maxsize)).fetchall()
+                total -= sum(weight for _, weight in victims)
+            if maxbytes is not None and total > maxbytes:
+                for victim in connection.execute(
+                        'SELECT key, weight FROM entries WHERE name = ? '
+                        'ORDER BY used LIMIT -1 OFFSET ?',
+                        (name, len(victims))):
+                    victims.append(victim)
+                    total -= victim[1]
+                    if total <= maxbytes:
+                        break
+            if victims:
+                self._remove(connection, victims)
+        return True
+
+    def usage(self) -> Tuple[int, int]:
+        """Return the number and total weight of the stored entries.
+
+        :return: The number of entries and their total weight.
+        :rtype: Tuple[int, int]
+
+        """
+        return self.connection.execute(
+            'SELECT size, bytes FROM usage WHERE name = ?',
+            (self.name,)).fetchone()
+
+    def items(self) -> Iterator[Tuple[bytes, bytes, float]]:
+        """Iterate over all entries.
+
+        :return: The key, value and expiry time of every entry, from the
+            least to the most recently used entry.
+        :rtype: Iterator[Tuple[bytes, bytes, float]]
+
+        """
+        return self.connection.execute(
+            'SELECT key, value, expires FROM entries WHERE name = ? '
+            'ORDER BY used', (self.name,))
+
+    def clear(self) -> None:
+        """Delete all entries."""
+        connection = self.connection
+        with connection:
+            _ = connection.execute('BEGIN IMMEDIATE')
+            _ = connection.execute(
+                'DELETE FROM entries WHERE name = ?', (self.name,))
+            _ = connection.execute(
+                'UPDATE usage SET size = 0, bytes = 0 WHERE name = ?',
+                (self.name,))
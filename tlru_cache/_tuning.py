@@ -0,0 +1,234 @@
+"""Automatic sizing of LRU caches.
+
+Caches created with the ``autotune`` argument of ``tlru_cache`` choose
+their own ``maxsize`` within the given bounds. Every segment simulates
+an LRU cache of the largest allowed size on a sample of its keys and
+records how many distinct keys were used between two uses of the same
+key, its reuse distance. An LRU cache of a given size hits exactly the
+uses whose reuse distance is below that size, so this yields the hit
+ratio of every size at once.
+
+Keys are sampled by their hash, so every use of a sampled key is seen,
+and the distances are scaled by the sample rate. This keeps the memory
+and time spent on the simulation independent of the cache size. A few
+very popular keys make up much of the uses of typical workloads, which
+skews the sample depending on whether they are part of it. The
+difference between the expected and the actual number of sampled uses
+is therefore counted towards the shortest distance, which is where the
+uses of popular keys fall (SHARDS-adj).
+
+All methods are called with the segment lock held.
+
+"""
+
+import math
+from typing import Dict, Hashable, List, Tuple
+
+__all__ = [
+    'SizeTuner',
+    'curve_sizes'
+]
+
+# Maximum number of sampled keys to simulate
+_SAMPLE_SIZE = 1024
+# Odd multiplier mixing the key hashes, so that keys with regular hashes
+# such as consecutive integers are sampled evenly
+_MIX = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+# Hit ratio a smaller size may lose compared to the largest size
+_SLACK = 0.01
+
+
+class SizeTuner:
+    """Estimate the hit ratio curve of a segment and choose its size.
+
+    The curve is estimated from the uses of the last few windows of
+    sampled keys, with older windows weighing less. At the end of every
+    window, :attr:`size` is set to the smallest size whose estimated
+    hit ratio is at most one percentage point below that of `maxsize`.
+
+    :param minsize: The smallest size to choose.
+    :type minsize: int
+    :param maxsize: The largest size to choose.
+    :type maxsize: int
+    :param size: The initial size.
+    :type size: int
+
+    """
+
+    __slots__ = ('minsize', 'maxsize', 'size', 'depth', 'rate', 'threshold',
+                 'capacity', 'last', 'tree', 'now', 'distances', 'cold',
+                 'uses', 'pending', 'window')
+
+    def __init__(self, minsize: int, maxsize: int, size: int) -> None:
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.size = size
+        # Number of sampled keys in a simulated cache of maxsize
+        self.depth = min(maxsize, _SAMPLE_SIZE)
+        self.rate = self.depth / maxsize
+        self.threshold = int(self.rate * (1 << 64))
+        # Sampled keys by the time of their last use, in the order they
+        # were used. The times index a Fenwick tree holding a one at the
+        # last use of every key, so that the number of distinct keys used
+        # since a time is a prefix sum. Times are renumbered once they
+        # reach the capacity of the tree.
+        self.capacity = 4 * self.depth
+        self.last: Dict[Hashable, int] = {}
+        self.tree = [0] * (self.capacity + 1)
+        self.now = 0
+        # Number of uses by their sampled reuse distance, and of uses of
+        # keys that were not used before, or too long ago
+        self.distances = [0] * self.depth
+        self.cold = 0
+        # Number of all uses, sampled or not, and of those in the current
+        # window
+        self.uses = 0
+        self.pending = 0
+        self.window = int(4 * max(self.depth, 256) / self.rate)
+
+    def _add(self, index: int, value: int) -> None:
+        tree = self.tree
+        capacity = self.capacity
+        while index <= capacity:
+            tree[index] += value
+            index += index & -index
+
+    def _count(self, index: int) -> int:
+        tree = self.tree
+        total = 0
+        while index:
+            total += tree[index]
+            index &= index - 1
+        return total
+
+    def _renumber(self) -> None:
+        """Number the last uses from one, in the order they happened."""
+        last = self.last
+        for index, key in enumerate(last, 1):
+            last[key] = index
+        self.now = len(last)
+        tree = self.tree = [0] * (self.capacity + 1)
+        capacity = self.capacity
+        for index in range(1, capacity + 1):
+            if index <= self.now:
+                tree[index] += 1
+            parent = index + (index & -index)
+            if parent <= capacity:
+                tree[parent] += tree[index]
+
+    def access(self, key: Hashable) -> None:
+        """Record a use of `key`.
+
+        :param key: The key that was looked up.
+        :type key: Hashable
+
+        """
+        self.uses += 1
+        self.pending += 1
+        if self.pending >= self.window:
+            self.pending = 0
+            self.size = self.choose()
+            # Let older windows fade away
+            self.distances = [count >> 1 for count in self.distances]
+            self.cold >>= 1
+            self.uses >>= 1
+        if (hash(key) * _MIX) & _MASK >= self.threshold:
+            return
+        last = self.last
+        time = last.pop(key, None)
+        if time is None:
+            self.cold += 1
+        else:
+            self.distances[self._count(self.now) - self._count(time)] += 1
+            self._add(time, -1)
+        if self.now == self.capacity:
+            self._renumber()
+        self.now += 1
+        self._add(self.now, 1)
+        last[key] = self.now
+        if len(last) > self.depth:
+            # The oldest key is beyond the largest size
+            oldest = next(iter(last))
+            self._add(last.pop(oldest), -1)
+
+    def remove(self, key: Hashable) -> None:
+        """Forget a key whose item expired or was invalidated.
+
+        Its next use is a miss at any size.
+
+        :param key: The key of the removed item.
+        :type key: Hashable
+
+        """
+        time = self.last.pop(key, None)
+        if time is not None:
+            self._add(time, -1)
+
+    def estimate(self, size: int) -> Tuple[float, float]:
+        """Estimate the hits of an LRU cache of `size`.
+
+        :param size: The size of the cache, at most `maxsize`.
+        :type size: int
+
+        :return: The number of recent sampled uses that would have been
+            hits, and the number of all recent sampled uses.
+        :rtype: Tuple[float, float]
+
+        """
+        distances = self.distances
+        total = sum(distances) + self.cold
+        # Correct the shortest distance for the skew of the sample
+        error = self.uses * self.rate - total
+        hits = sum(distances[:math.ceil(size * self.rate)])
+        if size:
+            hits = max(hits + error, 0.0)
+        return hits, max(total + error, 0.0)
+
+    def choose(self) -> int:
+        """Return the size the segment should have.
+
+        :return: The smallest size within the bounds whose estimated hit
+            ratio is close to that of the largest size.
+        :rtype: int
+
+        """
+        best, total = self.estimate(self.maxsize)
+        if not total:
+            return self.size
+        target = best - _SLACK * total
+        # Hits of the size of every sampled distance, from the shortest
+        distances = self.distances
+        hits, _ = self.estimate(1)
+        index = 0
+        while hits < target and index + 1 < len(distances):
+            index += 1
+            hits += distances[index]
+        size = math.floor(index / self.rate) + 1
+        return max(self.minsize, min(size, self.maxsize))
+
+    def clear(self) -> None:
+        """Forget all uses, but keep the current size."""
+        self.last.clear()
+        self.tree = [0] * (self.capacity + 1)
+        self.now = 0
+        self.distances = [0] * self.depth
+        self.cold = 0
+        self.uses = 0
+        self.pending = 0
+
+
+def curve_sizes(minsize: int, maxsize: int) -> List[int]:
+    """Return the sizes at which to report the hit ratio curve.
+
+    :param minsize: The smallest size.
+    :type minsize: int
+    :param maxsize: The largest size.
+    :type maxsize: int
+
+    :return: Up to nine evenly spaced sizes, including both bounds.
+    :rtype: List[int]
+
+    """
+    return sorted({minsize + (maxsize - minsize) * step // 8
+                   for step in range(9)})